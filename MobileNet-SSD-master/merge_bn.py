@@ -1,128 +1,367 @@
+"""
+Fold BatchNorm/Scale layers into the preceding Convolution/Deconvolution.
+
+Caffe is not needed: the prototxt is rewritten as text and the caffemodel is
+read and written with protobuf using a minimal subset of caffe.proto (fields
+that are not declared here are kept as unknown fields and written back as-is).
+
+    python merge_bn.py --model MobileNetSSD_deploy.prototxt --weights mobilenet_iter_73000.caffemodel
+    python merge_bn.py --model ... --weights ... --check   # compare with the original in cv2.dnn
+"""
 import os
 import sys
+import time
 import argparse
-import logging
 
 import numpy as np
-try:
-    caffe_root = '/home/yaochuanqi/work/caffe/'
-    sys.path.insert(0, caffe_root + 'python')
-    import caffe
-except ImportError:
-    logging.fatal("Cannot find caffe!")
-from caffe.proto import caffe_pb2
-from google.protobuf import text_format
+from google.protobuf import descriptor_pb2, descriptor_pool, message_factory
+
+BN_EPS = 1e-5
+
 
 def make_parser():
     parser = argparse.ArgumentParser()
     parser.add_argument('--model', type=str, required=True, help='.prototxt file for inference')
     parser.add_argument('--weights', type=str, required=True, help='.caffemodel file for inference')
+    parser.add_argument('--output-model', type=str, default='no_bn.prototxt')
+    parser.add_argument('--output-weights', type=str, default='no_bn.caffemodel')
+    parser.add_argument('--check', action='store_true',
+                        help='compare outputs, load time and inference time with cv2.dnn')
+    parser.add_argument('--images', type=str, default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'images'))
     return parser
 
+
+# ---------------------------------------------------------------------------
+# caffemodel (binary protobuf)
+# ---------------------------------------------------------------------------
+
+def _caffe_messages():
+    """NetParameter/LayerParameter/BlobProto with only the fields needed here"""
+    F = descriptor_pb2.FieldDescriptorProto
+    proto = descriptor_pb2.FileDescriptorProto(name='caffe_min.proto', package='caffe_min', syntax='proto2')
+
+    def add(message, name, number, type_, label=F.LABEL_OPTIONAL, type_name=None, packed=False):
+        field = message.field.add(name=name, number=number, type=type_, label=label)
+        if type_name:
+            field.type_name = type_name
+        if packed:
+            field.options.packed = True
+
+    shape = proto.message_type.add(name='BlobShape')
+    add(shape, 'dim', 1, F.TYPE_INT64, F.LABEL_REPEATED, packed=True)
+
+    blob = proto.message_type.add(name='BlobProto')
+    add(blob, 'num', 1, F.TYPE_INT32)
+    add(blob, 'channels', 2, F.TYPE_INT32)
+    add(blob, 'height', 3, F.TYPE_INT32)
+    add(blob, 'width', 4, F.TYPE_INT32)
+    add(blob, 'data', 5, F.TYPE_FLOAT, F.LABEL_REPEATED, packed=True)
+    add(blob, 'shape', 7, F.TYPE_MESSAGE, type_name='.caffe_min.BlobShape')
+
+    layer = proto.message_type.add(name='LayerParameter')
+    add(layer, 'name', 1, F.TYPE_STRING)
+    add(layer, 'type', 2, F.TYPE_STRING)
+    add(layer, 'bottom', 3, F.TYPE_STRING, F.LABEL_REPEATED)
+    add(layer, 'top', 4, F.TYPE_STRING, F.LABEL_REPEATED)
+    add(layer, 'blobs', 7, F.TYPE_MESSAGE, F.LABEL_REPEATED, '.caffe_min.BlobProto')
+
+    net = proto.message_type.add(name='NetParameter')
+    add(net, 'name', 1, F.TYPE_STRING)
+    add(net, 'layer', 100, F.TYPE_MESSAGE, F.LABEL_REPEATED, '.caffe_min.LayerParameter')
+
+    pool = descriptor_pool.DescriptorPool()
+    pool.Add(proto)
+    return message_factory.GetMessageClass(pool.FindMessageTypeByName('caffe_min.NetParameter'))
+
+
+NetParameter = _caffe_messages()
+
+
+def blob_to_array(blob):
+    if len(blob.shape.dim):
+        shape = tuple(blob.shape.dim)
+    else:
+        shape = (blob.num, blob.channels, blob.height, blob.width)
+    return np.array(blob.data, dtype=np.float32).reshape(shape)
+
+
+def array_to_blob(array, blob):
+    blob.Clear()
+    blob.shape.dim.extend(array.shape)
+    blob.data.extend(np.ascontiguousarray(array, dtype=np.float32).ravel().tolist())
+
+
+def read_caffemodel(path):
+    net = NetParameter()
+    with open(path, 'rb') as fp:
+        net.ParseFromString(fp.read())
+    if len(net.layer) == 0:
+        raise ValueError("No 'layer' entries in {} (V1 'layers' models are not supported)".format(path))
+    return net
+
+
+# ---------------------------------------------------------------------------
+# prototxt (protobuf text format)
+# ---------------------------------------------------------------------------
+
+def parse_prototxt(text):
+    """[[key, value], ...] where value is the raw token (quotes kept) or a nested list"""
+    tokens = []
+    for line in text.splitlines():
+        pos = 0
+        while pos < len(line):
+            char = line[pos]
+            if char.isspace():
+                pos += 1
+            elif char in '{}':
+                tokens.append(char)
+                pos += 1
+            elif char == '"':
+                end = pos + 1
+                while line[end] != '"':
+                    end += 2 if line[end] == '\\' else 1
+                tokens.append(line[pos:end + 1])
+                pos = end + 1
+            elif char == '#':
+                break
+            else:
+                end = pos
+                while end < len(line) and not line[end].isspace() and line[end] not in '{}"':
+                    end += 1
+                tokens.append(line[pos:end])
+                pos = end
+    pos = 0
+
+    def block():
+        nonlocal pos
+        items = []
+        while pos < len(tokens) and tokens[pos] != '}':
+            key = tokens[pos].rstrip(':')
+            pos += 1
+            if tokens[pos] == '{':
+                pos += 1
+                items.append([key, block()])
+                pos += 1
+            else:
+                items.append([key, tokens[pos]])
+                pos += 1
+        return items
+
+    return block()
+
+
+def format_prototxt(items, indent=0):
+    lines = []
+    for key, value in items:
+        if isinstance(value, list):
+            lines.append(' ' * indent + key + ' {')
+            lines.append(format_prototxt(value, indent + 2))
+            lines.append(' ' * indent + '}')
+        else:
+            lines.append(' ' * indent + '{}: {}'.format(key, value))
+    return '\n'.join(line for line in lines if line)
+
+
+def _get(items, key, default=None):
+    for k, v in items:
+        if k == key:
+            return v
+    return default
+
+
+def _get_all(items, key):
+    return [v for k, v in items if k == key]
+
+
+def _text(value):
+    return value.strip('"')
+
+
+def _set(items, key, value):
+    for item in items:
+        if item[0] == key:
+            item[1] = value
+            return
+    items.append([key, value])
+
+
+# ---------------------------------------------------------------------------
+# folding
+# ---------------------------------------------------------------------------
+
 bn_maps = {}
+
+
 def find_top_after_bn(layers, name, top):
-    bn_maps[name] = {} 
+    bn_maps[name] = {}
     for l in layers:
-        if len(l.bottom) == 0:
+        bottoms = _get_all(l, 'bottom')
+        if len(bottoms) == 0:
             continue
-        if l.bottom[0] == top and l.type == "BatchNorm":
-            bn_maps[name]["bn"] = l.name
-            top = l.top[0]
-        if l.bottom[0] == top and l.type == "Scale":
-            bn_maps[name]["scale"] = l.name
-            top = l.top[0]
+        layer_type = _text(_get(l, 'type', ''))
+        if _text(bottoms[0]) == top and layer_type == "BatchNorm":
+            bn_maps[name]["bn"] = _text(_get(l, 'name'))
+            top = _text(_get(l, 'top'))
+        if _text(bottoms[0]) == top and layer_type == "Scale":
+            bn_maps[name]["scale"] = _text(_get(l, 'name'))
+            top = _text(_get(l, 'top'))
     return top
 
+
 def pre_process(expected_proto, new_proto):
-    net_specs = caffe_pb2.NetParameter()
-    net_specs2 = caffe_pb2.NetParameter()
+    """Write the prototxt without BatchNorm/Scale; convolutions get bias_term: true"""
+    bn_maps.clear()
     with open(expected_proto, "r") as fp:
-        text_format.Merge(str(fp.read()), net_specs)
-
-    net_specs2.MergeFrom(net_specs)
-    layers = net_specs.layer
-    num_layers = len(layers)
+        net_specs = parse_prototxt(fp.read())
+    layers = _get_all(net_specs, 'layer')
 
-    for i in range(num_layers - 1, -1, -1):
-         del net_specs2.layer[i]
+    for l in layers:
+        layer_type = _text(_get(l, 'type', ''))
+        if layer_type == "Convolution" or layer_type == "Deconvolution":
+            name = _text(_get(l, 'name'))
+            bn_maps[name]["top"] = find_top_after_bn(layers, name, _text(_get(l, 'top')))
+            bn_maps[name]["type"] = layer_type
+    folded = {v for m in bn_maps.values() for k, v in m.items() if k in ("bn", "scale")}
 
-    for idx in range(num_layers):
-        l = layers[idx]
-        if l.type == "BatchNorm" or l.type == "Scale":
+    net_specs2 = []
+    for key, value in net_specs:
+        if key != 'layer':
+            net_specs2.append([key, value])
             continue
-        elif l.type == "Convolution" or l.type == "Deconvolution":
-            top = find_top_after_bn(layers, l.name, l.top[0])
-            bn_maps[l.name]["type"] = l.type
-            layer = net_specs2.layer.add()
-            layer.MergeFrom(l)
-            layer.top[0] = top
-            layer.convolution_param.bias_term = True
-        else:
-            layer = net_specs2.layer.add()
-            layer.MergeFrom(l)
+        name = _text(_get(value, 'name'))
+        if name in folded:
+            continue
+        if name in bn_maps and "bn" in bn_maps[name]:
+            _set(value, 'top', '"{}"'.format(bn_maps[name]["top"]))
+            param = _get(value, 'convolution_param')
+            if param is None:
+                param = []
+                value.append(['convolution_param', param])
+            _set(param, 'bias_term', 'true')
+        net_specs2.append([key, value])
 
     with open(new_proto, "w") as fp:
-        fp.write("{}".format(net_specs2))
+        fp.write(format_prototxt(net_specs2) + '\n')
+    return bn_maps
+
 
-def load_weights(net, nobn):
-    if sys.version_info > (3,0):
-        listKeys = nobn.params.keys()
+def fold_weights(params, key):
+    """Folded [weights, bias] for one convolution, same math as the Caffe version"""
+    conv = params[key]
+    bn = params[bn_maps[key]["bn"]]
+    wt = conv[0]
+    if bn_maps[key]["type"] == "Convolution":
+        channels = wt.shape[0]
+    elif bn_maps[key]["type"] == "Deconvolution":
+        channels = wt.shape[1]
     else:
-        listKeys = nobn.params.iterkeys()
-    for key in listKeys:
-        if type(nobn.params[key]) is caffe._caffe.BlobVec:
-            conv = net.params[key]
-            if key not in bn_maps or "bn" not in bn_maps[key]:
-                for i, w in enumerate(conv):
-                    nobn.params[key][i].data[...] = w.data
-            else:
-                print(key)
-                bn = net.params[bn_maps[key]["bn"]]
-                scale = net.params[bn_maps[key]["scale"]]
-                wt = conv[0].data
-                channels = 0
-                if bn_maps[key]["type"] == "Convolution": 
-                    channels = wt.shape[0]
-                elif bn_maps[key]["type"] == "Deconvolution": 
-                    channels = wt.shape[1]
-                else:
-                    print("error type " + bn_maps[key]["type"])
-                    exit(-1)
-                bias = np.zeros(channels)
-                if len(conv) > 1:
-                    bias = conv[1].data
-                mean = bn[0].data
-                var = bn[1].data
-                scalef = bn[2].data
-
-                scales = scale[0].data
-                shift = scale[1].data
-
-                if scalef != 0:
-                    scalef = 1. / scalef
-                mean = mean * scalef
-                var = var * scalef
-                rstd = 1. / np.sqrt(var + 1e-5)
-                if bn_maps[key]["type"] == "Convolution": 
-                    rstd1 = rstd.reshape((channels,1,1,1))
-                    scales1 = scales.reshape((channels,1,1,1))
-                    wt = wt * rstd1 * scales1
-                else:
-                    rstd1 = rstd.reshape((1, channels,1,1))
-                    scales1 = scales.reshape((1, channels,1,1))
-                    wt = wt * rstd1 * scales1
-                bias = (bias - mean) * rstd * scales + shift
-                
-                nobn.params[key][0].data[...] = wt
-                nobn.params[key][1].data[...] = bias
+        print("error type " + bn_maps[key]["type"])
+        exit(-1)
+    bias = np.zeros(channels)
+    if len(conv) > 1:
+        bias = conv[1].ravel()
+    mean = bn[0].ravel()
+    var = bn[1].ravel()
+    scalef = bn[2].ravel()[0]
+
+    if "scale" in bn_maps[key]:
+        scale = params[bn_maps[key]["scale"]]
+        scales = scale[0].ravel()
+        shift = scale[1].ravel() if len(scale) > 1 else np.zeros(channels)
+    else:
+        scales = np.ones(channels)
+        shift = np.zeros(channels)
+
+    if scalef != 0:
+        scalef = 1. / scalef
+    mean = mean * scalef
+    var = var * scalef
+    rstd = 1. / np.sqrt(var + BN_EPS)
+    if bn_maps[key]["type"] == "Convolution":
+        rstd1 = rstd.reshape((channels, 1, 1, 1))
+        scales1 = scales.reshape((channels, 1, 1, 1))
+    else:
+        rstd1 = rstd.reshape((1, channels, 1, 1))
+        scales1 = scales.reshape((1, channels, 1, 1))
+    wt = wt * rstd1 * scales1
+    bias = (bias - mean) * rstd * scales + shift
+    return [wt.astype(np.float32), bias.astype(np.float32)]
+
+
+def load_weights(weights, new_weights):
+    """Write the caffemodel without BatchNorm/Scale, folding them into the convolutions"""
+    net = read_caffemodel(weights)
+    params = {l.name: [blob_to_array(b) for b in l.blobs] for l in net.layer if len(l.blobs)}
+    folded = {v for m in bn_maps.values() for k, v in m.items() if k in ("bn", "scale")}
+
+    nobn = NetParameter()
+    nobn.name = net.name
+    for l in net.layer:
+        if l.name in folded:
+            continue
+        layer = nobn.layer.add()
+        layer.CopyFrom(l)
+        if l.name in bn_maps and "bn" in bn_maps[l.name]:
+            print(l.name)
+            wt, bias = fold_weights(params, l.name)
+            del layer.blobs[:]
+            array_to_blob(wt, layer.blobs.add())
+            array_to_blob(bias, layer.blobs.add())
+
+    with open(new_weights, 'wb') as fp:
+        fp.write(nobn.SerializeToString())
+
+
+# ---------------------------------------------------------------------------
+# check with cv2.dnn
+# ---------------------------------------------------------------------------
+
+def check(model, weights, new_model, new_weights, image_dir, repeat=10):
+    """Compare outputs, load time, inference time and size of both models in cv2.dnn"""
+    import glob
+    import cv2
+
+    images = [cv2.imread(p) for p in sorted(glob.glob(os.path.join(image_dir, '*.jpg')))]
+    images = [img for img in images if img is not None]
+    if not images:
+        images = [np.random.RandomState(0).randint(0, 255, (300, 300, 3)).astype(np.uint8)]
+    blobs = [cv2.dnn.blobFromImage(img, 0.007843, (300, 300), (127.5, 127.5, 127.5)) for img in images]
+
+    results = {}
+    for label, (proto, caffemodel) in (('bn', (model, weights)), ('no_bn', (new_model, new_weights))):
+        start = time.perf_counter()
+        for _ in range(3):
+            net = cv2.dnn.readNetFromCaffe(proto, caffemodel)
+        load_ms = (time.perf_counter() - start) / 3 * 1000
+
+        outputs = []
+        for blob in blobs:
+            net.setInput(blob)
+            outputs.append(net.forward(['mbox_loc', 'mbox_conf_flatten']))
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for blob in blobs:
+                net.setInput(blob)
+                net.forward()
+        forward_ms = (time.perf_counter() - start) / (repeat * len(blobs)) * 1000
+        results[label] = (load_ms, forward_ms, os.path.getsize(caffemodel), outputs)
+
+    diff = max(float(np.abs(a - b).max())
+               for ref, new in zip(results['bn'][3], results['no_bn'][3]) for a, b in zip(ref, new))
+    print("{:8s} {:>10s} {:>12s} {:>10s}".format('model', 'load ms', 'forward ms', 'size KB'))
+    for label, (load_ms, forward_ms, size, _) in results.items():
+        print("{:8s} {:10.1f} {:12.2f} {:10.0f}".format(label, load_ms, forward_ms, size / 1024.))
+    passed = diff < 1e-3
+    print("max abs diff (mbox_loc, mbox_conf_flatten) on {} image(s): {:.2e} -> {}".format(
+        len(blobs), diff, 'PASS' if passed else 'FAIL'))
+    return passed
+
 
 if __name__ == '__main__':
     parser1 = make_parser()
     args = parser1.parse_args()
-    pre_process(args.model, "no_bn.prototxt")
-
-    net = caffe.Net(args.model, args.weights, caffe.TEST)  
-    net2 = caffe.Net("no_bn.prototxt", caffe.TEST)
+    pre_process(args.model, args.output_model)
+    load_weights(args.weights, args.output_weights)
 
-    load_weights(net, net2)
-    net2.save("no_bn.caffemodel")
+    if args.check and not check(args.model, args.weights, args.output_model, args.output_weights, args.images):
+        sys.exit(1)
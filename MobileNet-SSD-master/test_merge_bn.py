@@ -0,0 +1,105 @@
+"""
+Kiểm tra merge_bn.py trên một mạng conv + BatchNorm + Scale nhỏ tự tạo
+(không cần Caffe hay model thật): output của cv2.dnn trước và sau khi gộp
+BatchNorm phải giống nhau.
+
+    python -m pytest MobileNet-SSD-master/test_merge_bn.py
+"""
+import cv2
+import numpy as np
+import pytest
+
+import merge_bn
+
+PROTOTXT = """name: "tiny_bn"
+input: "data"
+input_shape { dim: 1 dim: 3 dim: 16 dim: 16 }
+layer {
+  name: "conv1"
+  type: "Convolution"
+  bottom: "data"
+  top: "conv1"
+  convolution_param { num_output: 4 bias_term: false pad: 1 kernel_size: 3 stride: 1 }
+}
+layer { name: "conv1/bn" type: "BatchNorm" bottom: "conv1" top: "conv1" }
+layer { name: "conv1/scale" type: "Scale" bottom: "conv1" top: "conv1" scale_param { bias_term: true } }
+layer { name: "conv1/relu" type: "ReLU" bottom: "conv1" top: "conv1" }
+layer {
+  name: "conv2"
+  type: "Convolution"
+  bottom: "conv1"
+  top: "conv2"
+  convolution_param { num_output: 6 pad: 0 kernel_size: 1 stride: 1 }
+}
+layer { name: "conv2/bn" type: "BatchNorm" bottom: "conv2" top: "conv2/bn" }
+layer { name: "conv2/scale" type: "Scale" bottom: "conv2/bn" top: "conv2/scale" scale_param { bias_term: true } }
+"""
+
+
+def add_layer(net, name, layer_type, blobs):
+    layer = net.layer.add()
+    layer.name = name
+    layer.type = layer_type
+    for array in blobs:
+        merge_bn.array_to_blob(np.asarray(array, dtype=np.float32), layer.blobs.add())
+
+
+def batch_norm_blobs(rng, channels, scale_factor):
+    # Caffe lưu mean/var nhân với scale_factor (blob thứ ba)
+    mean = rng.randn(channels) * scale_factor
+    var = rng.uniform(0.5, 2.0, channels) * scale_factor
+    return [mean, var, [scale_factor]]
+
+
+@pytest.fixture
+def tiny_model(tmp_path):
+    rng = np.random.RandomState(0)
+    net = merge_bn.NetParameter()
+    net.name = 'tiny_bn'
+    add_layer(net, 'conv1', 'Convolution', [rng.randn(4, 3, 3, 3)])
+    add_layer(net, 'conv1/bn', 'BatchNorm', batch_norm_blobs(rng, 4, 0.5))
+    add_layer(net, 'conv1/scale', 'Scale', [rng.uniform(0.5, 1.5, 4), rng.randn(4)])
+    add_layer(net, 'conv1/relu', 'ReLU', [])
+    add_layer(net, 'conv2', 'Convolution', [rng.randn(6, 4, 1, 1), rng.randn(6)])
+    add_layer(net, 'conv2/bn', 'BatchNorm', batch_norm_blobs(rng, 6, 1.0))
+    add_layer(net, 'conv2/scale', 'Scale', [rng.uniform(0.5, 1.5, 6), rng.randn(6)])
+
+    prototxt = tmp_path / 'tiny.prototxt'
+    caffemodel = tmp_path / 'tiny.caffemodel'
+    prototxt.write_text(PROTOTXT)
+    caffemodel.write_bytes(net.SerializeToString())
+    return str(prototxt), str(caffemodel)
+
+
+def forward(prototxt, caffemodel, blob, output):
+    net = cv2.dnn.readNetFromCaffe(prototxt, caffemodel)
+    net.setInput(blob)
+    return net.forward(output)
+
+
+def test_fold_matches_original(tiny_model, tmp_path):
+    prototxt, caffemodel = tiny_model
+    new_prototxt, new_caffemodel = str(tmp_path / 'no_bn.prototxt'), str(tmp_path / 'no_bn.caffemodel')
+    maps = merge_bn.pre_process(prototxt, new_prototxt)
+    merge_bn.load_weights(caffemodel, new_caffemodel)
+    assert maps['conv1'] == {'bn': 'conv1/bn', 'scale': 'conv1/scale', 'top': 'conv1', 'type': 'Convolution'}
+    assert maps['conv2']['top'] == 'conv2/scale'
+
+    layers = [layer.type for layer in merge_bn.read_caffemodel(new_caffemodel).layer]
+    assert layers == ['Convolution', 'ReLU', 'Convolution']
+
+    blob = np.random.RandomState(1).randn(1, 3, 16, 16).astype(np.float32)
+    # cv2.dnn trả output theo tên layer: 'conv1' của mạng gốc là trước BatchNorm (in-place),
+    # nên so sánh sau ReLU và ở output cuối
+    for output in ('conv1/relu', 'conv2/scale'):
+        expected = forward(prototxt, caffemodel, blob, output)
+        folded = forward(new_prototxt, new_caffemodel, blob, output)
+        np.testing.assert_allclose(folded, expected, atol=1e-4, rtol=1e-4)
+
+
+def test_rejects_model_without_layers(tmp_path):
+    # Model V1 lưu trong trường 'layers' (số 2): với proto tối giản không có layer nào
+    path = tmp_path / 'v1.caffemodel'
+    path.write_bytes(merge_bn.NetParameter(name='v1').SerializeToString())
+    with pytest.raises(ValueError):
+        merge_bn.read_caffemodel(str(path))
@@ -1,23 +1,50 @@
+import argparse
 import cv2
 import requests
-from PIL import Image
-import io
 import numpy as np
+import os
+import sys
 import time
 import json
+import threading
+
+# Cho phép import các module dùng chung ở thư mục gốc của repo
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from esp32_display import create_display
+from esp32_frame_source import CaptureFrameSource, LatestFrameGrabber, MJPEGFrameSource
+from esp32_http import ESP32HttpClient, ResultPublisher
+from esp32_latency import FrameRate, StageLatency
+from esp32_metrics import Counters, MetricsServer, counter, gauge, latency_summary
+from esp32_result_codec import ResultEncoder
+from esp32_engines import create_engine
+from esp32_tracking import DetectTrackScheduler
 
 # pip install ultralytics opencv-python requests pillow
-from ultralytics import YOLO
+# (hoặc pip install onnxruntime và dùng model .onnx xuất bởi esp32_onnx_export.py)
 
 class ESP32CamYOLOv8Detector:
-    def __init__(self, esp32_ip=None, esp32_ap_ip="192.168.4.1", model_path="yolov8n.pt"):
+    def __init__(self, esp32_ip=None, esp32_ap_ip="192.168.4.1", model_path="yolov8n.pt",
+                 use_stream=False, threaded_capture=True, binary_results=False, delta_results=False,
+                 track_interval=None, headless=False, latency_log=None, metrics_port=None):
         """
         Khởi tạo detector
         
         Args:
             esp32_ip: IP của ESP32-CAM (nếu None, sẽ tự động lấy từ AP)
             esp32_ap_ip: IP của AP của ESP32-CAM (mặc định 192.168.4.1)
-            model_path: Đường dẫn đến model YOLOv8
+            model_path: Đường dẫn đến model YOLOv8 (.pt chạy bằng ultralytics,
+                .onnx chạy bằng ONNX Runtime)
+            use_stream: Đọc luồng MJPEG (http://IP:81/stream) thay vì poll /capture
+            threaded_capture: Lấy frame trên thread riêng, inference luôn dùng frame mới nhất
+            binary_results: Gửi /results dạng nhị phân gọn (esp32_result_codec) thay cho JSON
+            delta_results: Với binary_results, chỉ gửi thay đổi so với trạng thái ESP32 đã nhận
+            track_interval: Chạy YOLOv8 tối đa mỗi N frame, các frame giữa dời box bằng optical flow
+                (N tự chỉnh theo chuyển động); None = chạy model mọi frame
+            headless: Không vẽ và không mở cửa sổ (server không màn hình, thoát bằng Ctrl+C);
+                khi hiển thị, việc vẽ chạy trên thread riêng
+            latency_log: File JSON lines nhận p50/p95/p99 của từng công đoạn mỗi 10 giây
+            metrics_port: Mở endpoint Prometheus http://127.0.0.1:PORT/metrics (esp32_metrics);
+                None = tắt
         """
         # Nếu không có IP, tự động lấy từ ESP32-CAM AP
         if esp32_ip is None:
@@ -32,11 +59,41 @@ class ESP32CamYOLOv8Detector:
         self.distance_url = f"http://{esp32_ip}/distance"
         self.results_url = f"http://{esp32_ip}/results"
         self.ip_url = f"http://{esp32_ip}/ip"
+        self.http = ESP32HttpClient(esp32_ip)
+        self.use_stream = use_stream
+        self.headless = headless
+        if use_stream:
+            self.frame_source = MJPEGFrameSource(f"http://{esp32_ip}:81/stream", timeout=3, verbose=True)
+        else:
+            self.frame_source = CaptureFrameSource(self.stream_url, timeout=3, verbose=True,
+                                                   client=self.http)
+        if threaded_capture:
+            self.frame_source = LatestFrameGrabber(self.frame_source)
+        # Độ trễ theo công đoạn: fetch/decode (frame source), preprocess/forward/postprocess
+        # (engine), draw (thread hiển thị), publish (thread gửi kết quả)
+        self.latency = StageLatency(esp32_ip, export_path=latency_log)
+        self.frame_source.latency = self.latency
+        self.frame_rate = FrameRate()
+        # Số detection theo class (chỉ thread inference tăng, đọc khi scrape /metrics)
+        self.detection_counts = Counters()
+        self.metrics_port = metrics_port
 
         print(f"✅ ESP32-CAM IP: {esp32_ip}")
         print("Loading YOLOv8 model...")
-        self.model = YOLO(model_path)
-        print("Model loaded!")
+        self.engine = create_engine(model_path)
+        print(f"Model loaded! ({self.engine.name})")
+        self.engine.latency = self.latency
+        self.tracking = None
+        if track_interval:
+            self.tracking = DetectTrackScheduler(self.engine.infer, max_interval=track_interval)
+
+        self.result_encoder = None
+        if binary_results or delta_results:
+            self.result_encoder = ResultEncoder(self.engine.class_names, delta=delta_results)
+        # Lỗi kết nối khi gửi /results chỉ đặt cờ; IP được kiểm tra lại trên thread chính
+        self.ip_check_requested = threading.Event()
+        self.publisher = ResultPublisher(self.http, on_error=self.ip_check_requested.set,
+                                         encoder=self.result_encoder, latency=self.latency)
     
     def get_esp32_ip_from_ap(self, ap_ip="192.168.4.1", timeout=5):
         """
@@ -50,8 +107,11 @@ class ESP32CamYOLOv8Detector:
             IP của ESP32-CAM hoặc None nếu không tìm thấy
         """
         try:
-            ip_endpoint = f"http://{ap_ip}/ip"
-            response = requests.get(ip_endpoint, timeout=timeout)
+            ap_client = ESP32HttpClient(ap_ip)
+            try:
+                response = ap_client.get('ip', timeout=timeout)
+            finally:
+                ap_client.close()
             if response.status_code == 200:
                 data = response.json()
                 wifi_ip = data.get("ip", "")
@@ -71,28 +131,12 @@ class ESP32CamYOLOv8Detector:
 
     def get_frame_from_esp32(self):
         """Lấy frame từ ESP32-CAM"""
-        try:
-            response = requests.get(self.stream_url, timeout=3)
-            if response.status_code == 200:
-                image = Image.open(io.BytesIO(response.content))
-                frame = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
-                # Resize nếu cần
-                h, w = frame.shape[:2]
-                if w > 640:
-                    scale = 640 / w
-                    frame = cv2.resize(frame, (640, int(h * scale)))
-                return frame
-            else:
-                print(f"[ESP32] HTTP {response.status_code} when requesting {self.stream_url}")
-                return None
-        except Exception as e:
-            print(f"[ESP32] Error getting frame: {e}")
-            return None
+        return self.frame_source.read()
 
     def get_distance_from_esp32(self):
         """Lấy distance + pip từ ESP32 endpoint"""
         try:
-            response = requests.get(self.distance_url, timeout=1)
+            response = self.http.get('distance')
             if response.status_code == 200:
                 data = response.json()
                 distance = int(data.get("distance_mm", -1))
@@ -105,81 +149,204 @@ class ESP32CamYOLOv8Detector:
             return -1, "NONE"
 
     def detect_objects(self, frame):
-        """Nhận diện objects với YOLOv8"""
-        results = self.model(frame)[0]  # Lấy kết quả đầu tiên
-        detections = []
-
-        for box, cls, conf in zip(results.boxes.xyxy, results.boxes.cls, results.boxes.conf):
-            x1, y1, x2, y2 = map(int, box)
-            class_name = self.model.names[int(cls)]
-            confidence = float(conf)
-            detections.append({
-                "class": class_name,
-                "bbox": [x1, y1, x2 - x1, y2 - y1],
-                "confidence": confidence
-            })
-            # Vẽ bounding box
+        """Nhận diện objects với YOLOv8 và vẽ lên frame"""
+        results = self.infer(frame)
+        return self.draw_boxes(frame, results), self.to_detections(results)
+
+    def infer(self, frame):
+        """Mảng DETECTION_DTYPE của frame (qua tracker nếu bật)"""
+        if self.tracking is not None:
+            return self.tracking.process(frame)[0]
+        return self.engine.infer(frame)
+
+    def to_detections(self, results):
+        """Danh sách object cho JSON kết quả (bbox dạng x, y, w, h)"""
+        return [{
+            "class": self.engine.class_names[class_id],
+            "bbox": [x1, y1, x2 - x1, y2 - y1],
+            "confidence": confidence
+        } for class_id, confidence, x1, y1, x2, y2 in results.tolist()]
+
+    def draw_boxes(self, frame, results):
+        """Vẽ bounding box và label lên frame"""
+        for class_id, confidence, x1, y1, x2, y2 in results.tolist():
             cv2.rectangle(frame, (x1, y1), (x2, y2), (0,255,0), 2)
-            cv2.putText(frame, f"{class_name}:{confidence:.2f}", (x1, y1 - 5),
+            cv2.putText(frame, f"{self.engine.class_names[class_id]}:{confidence:.2f}", (x1, y1 - 5),
                         cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0,255,0), 2)
-        return frame, detections
+        return frame
+
+    def render_frame(self, frame, snapshot):
+        """Vẽ frame để hiển thị (chạy trên thread hiển thị); snapshot None = placeholder"""
+        if snapshot is None:
+            cv2.putText(frame, "No frame from ESP32-CAM", (10,180),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0,0,255),2)
+            return frame
+        results, distance_mm, pip_type = snapshot
+        self.draw_boxes(frame, results)
+        cv2.putText(frame, f"Distance: {distance_mm} mm ({pip_type})", (10,30),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255,255,0), 2)
+        return frame
 
     def run_detection(self):
         """Chạy detection loop chính"""
         print("🚀 Bắt đầu nhận diện YOLOv8 từ ESP32-CAM + distance...")
-        cv2.namedWindow("ESP32-CAM YOLOv8 Detection", cv2.WINDOW_NORMAL)
+        # Vẽ và hiển thị trên thread riêng (hoặc không vẽ gì khi headless)
+        display = create_display("ESP32-CAM YOLOv8 Detection", self.render_frame, headless=self.headless,
+                                 latency=self.latency)
+        metrics = None
+        if self.metrics_port is not None:
+            metrics = MetricsServer(self.collect_metrics, port=self.metrics_port)
+            print(f"📊 Metrics: {metrics.url}")
         
         last_ip_check = time.time()
         ip_check_interval = 10  # Kiểm tra IP mỗi 10 giây
 
-        while True:
-            # Kiểm tra và cập nhật IP định kỳ
-            current_time = time.time()
-            if current_time - last_ip_check > ip_check_interval:
-                self.update_esp32_ip()
-                last_ip_check = current_time
-            
-            frame = self.get_frame_from_esp32()
-            distance_mm, pip_type = self.get_distance_from_esp32()
-
-            if frame is None:
-                placeholder = np.zeros((360, 640, 3), dtype=np.uint8)
-                cv2.putText(placeholder, "No frame from ESP32-CAM", (10,180),
-                            cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0,0,255),2)
-                cv2.imshow("ESP32-CAM YOLOv8 Detection", placeholder)
-                key = cv2.waitKey(100) & 0xFF
-                if key == ord('q'):
-                    break
-                continue
+        try:
+            while True:
+                # Kiểm tra và cập nhật IP định kỳ
+                current_time = time.time()
+                if current_time - last_ip_check > ip_check_interval or self.ip_check_requested.is_set():
+                    self.ip_check_requested.clear()
+                    self.update_esp32_ip()
+                    last_ip_check = current_time
+                
+                duplicates = self.frame_source.duplicates
+                frame = self.get_frame_from_esp32()
+                if frame is None and self.frame_source.duplicates != duplicates:
+                    # Ảnh trùng byte với ảnh trước: không giải mã, inference hay gửi lại kết quả
+                    if display.poll_key() == ord('q'):
+                        break
+                    continue
+                distance_mm, pip_type = self.get_distance_from_esp32()
 
-            frame, detections = self.detect_objects(frame)
+                if frame is None:
+                    display.show(np.zeros((360, 640, 3), dtype=np.uint8))
+                    if display.poll_key() == ord('q'):
+                        break
+                    time.sleep(0.1)
+                    continue
 
-            # Tạo JSON kết quả
-            result_json = {
-                "distance_mm": distance_mm,
-                "pip": pip_type,
-                "pip_alert": pip_type not in ("NONE", "", None),
-                "objects": detections
-            }
+                results = self.infer(frame)
+                self.frame_rate.tick()
+                self.detection_counts.update(results['class_id'].tolist())
 
-            print(json.dumps(result_json))
-            self.send_results_to_esp32(result_json)
+                # Tạo JSON kết quả
+                result_json = {
+                    "distance_mm": distance_mm,
+                    "pip": pip_type,
+                    "pip_alert": pip_type not in ("NONE", "", None),
+                    "objects": self.to_detections(results)
+                }
 
-            # Hiển thị thông tin
-            cv2.putText(frame, f"Distance: {distance_mm} mm ({pip_type})", (10,30),
-                        cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255,255,0), 2)
-            cv2.imshow("ESP32-CAM YOLOv8 Detection", frame)
+                print(json.dumps(result_json))
+                self.send_results_to_esp32(result_json, (frame.shape[1], frame.shape[0]))
 
-            key = cv2.waitKey(1) & 0xFF
-            if key == ord('q'):
-                break
+                # Hiển thị thông tin (vẽ trên thread hiển thị)
+                display.show(frame, (results, distance_mm, pip_type))
+                self.latency.maybe_export()
 
-        cv2.destroyAllWindows()
+                if display.poll_key() == ord('q'):
+                    break
+        except KeyboardInterrupt:
+            # Cách thoát duy nhất khi headless
+            pass
+
+        if metrics is not None:
+            metrics.close()
+        self.frame_source.close()
+        self.engine.close()
+        display.close()
+
+        capture_stats = self.frame_source.stats()
+        if capture_stats:
+            print(f"📊 Capture: {capture_stats['captured']} frames, "
+                  f"dropped {capture_stats['dropped']}, errors {capture_stats['errors']}, "
+                  f"trùng (bỏ qua) {capture_stats['duplicates']}")
+        else:
+            print(f"📊 Capture: trùng (bỏ qua) {self.frame_source.duplicates}")
+        self.publisher.close()
+        publish_stats = self.publisher.stats()
+        print(f"📊 Results: {publish_stats['published']} sent, {publish_stats['dropped']} dropped, "
+              f"{publish_stats['failed']} failed, latency avg {publish_stats['latency_avg_ms']:.1f} ms "
+              f"/ max {publish_stats['latency_max_ms']:.1f} ms")
+        self._print_http_stats()
+        if self.tracking is not None:
+            tracking_stats = self.tracking.stats()
+            print(f"📊 Tracking: model {tracking_stats['detections']}/{tracking_stats['frames']} frames "
+                  f"({tracking_stats['detect_ratio'] * 100:.0f}%), detect {tracking_stats['detect_avg_ms']:.1f} ms, "
+                  f"track {tracking_stats['track_avg_ms']:.1f} ms")
+        if self.latency.export_path:
+            self.latency.export_jsonl()
+        self.latency.print_stats(indent="📊 ")
+        self.http.close()
+
+    def _print_http_stats(self):
+        """In thống kê kết nối HTTP tới ESP32"""
+        http_stats = self.http.stats()
+        print(f"📊 HTTP: {http_stats['requests']} requests, "
+              f"{http_stats['new_connections']} new connections, "
+              f"{http_stats['reused_connections']} reused, "
+              f"connect {http_stats['connect_s']:.2f}s / transfer {http_stats['transfer_s']:.2f}s")
+        for endpoint, stats in sorted(http_stats['endpoints'].items()):
+            print(f"   - /{endpoint}: {stats['requests']} requests, "
+                  f"{stats['errors']} errors ({stats['timeouts']} timeouts)")
+
+    def collect_metrics(self):
+        """
+        Metrics cho endpoint Prometheus (chạy trên thread của MetricsServer khi bị scrape)
+
+        Returns:
+            list: Metric family của esp32_metrics
+        """
+        camera = {'camera': self.esp32_ip}
+        capture_stats = self.frame_source.stats()
+        publish_stats = self.publisher.stats()
+        http_stats = self.http.stats()
+        families = [
+            counter('esp32_frames_processed_total', 'Frame đã chạy inference',
+                    [(camera, self.frame_rate.frames)]),
+            gauge('esp32_fps', 'FPS xử lý theo 30 frame gần nhất', [(camera, self.frame_rate.fps)]),
+            counter('esp32_frames_duplicate_total', 'Ảnh trùng với ảnh trước, bỏ qua trước khi giải mã',
+                    [(camera, self.frame_source.duplicates)]),
+        ]
+        if capture_stats:
+            families += [
+                counter('esp32_frames_captured_total', 'Frame thread capture đã lấy được',
+                        [(camera, capture_stats['captured'])]),
+                counter('esp32_frames_dropped_total', 'Frame bị frame mới hơn ghi đè trước khi inference',
+                        [(camera, capture_stats['dropped'])]),
+                counter('esp32_capture_errors_total', 'Lần lấy frame lỗi (HTTP/giải mã)',
+                        [(camera, capture_stats['errors'])]),
+                gauge('esp32_capture_queue_depth', 'Frame đang chờ vòng inference',
+                      [(camera, capture_stats['pending'])]),
+            ]
+        families += [
+            gauge('esp32_publish_queue_depth', 'Kết quả đang chờ gửi lên /results',
+                  [(camera, publish_stats['pending'])]),
+            counter('esp32_results_published_total', 'Kết quả đã gửi thành công',
+                    [(camera, publish_stats['published'])]),
+            counter('esp32_results_dropped_total', 'Kết quả bị thay bằng kết quả mới hoặc bỏ sau khi hết lần thử',
+                    [(camera, publish_stats['dropped'])]),
+            counter('esp32_results_failed_total', 'Lần gửi kết quả lỗi',
+                    [(camera, publish_stats['failed'])]),
+            counter('esp32_http_requests_total', 'Request tới ESP32 theo endpoint',
+                    [(dict(camera, endpoint=name), s['requests']) for name, s in http_stats['endpoints'].items()]),
+            counter('esp32_http_errors_total', 'Request tới ESP32 lỗi theo endpoint (gồm timeout)',
+                    [(dict(camera, endpoint=name), s['errors']) for name, s in http_stats['endpoints'].items()]),
+            counter('esp32_http_timeouts_total', 'Request tới ESP32 bị timeout theo endpoint',
+                    [(dict(camera, endpoint=name), s['timeouts']) for name, s in http_stats['endpoints'].items()]),
+            counter('esp32_detections_total', 'Số detection theo class',
+                    [(dict(camera, **{'class': self.engine.class_names[class_id]}), count)
+                     for class_id, count in sorted(self.detection_counts.snapshot().items())]),
+            latency_summary('esp32_stage_latency_seconds', 'Độ trễ theo công đoạn (p50/p95/p99)',
+                            self.latency, camera),
+        ]
+        return families
 
     def update_esp32_ip(self):
-        """Cập nhật IP của ESP32-CAM nếu thay đổi"""
+        """Cập nhật IP của ESP32-CAM nếu thay đổi (chỉ gọi trên thread chính)"""
         try:
-            response = requests.get(self.ip_url, timeout=2)
+            response = self.http.get('ip')
             if response.status_code == 200:
                 data = response.json()
                 new_ip = data.get("ip", "")
@@ -190,25 +357,50 @@ class ESP32CamYOLOv8Detector:
                     self.distance_url = f"http://{new_ip}/distance"
                     self.results_url = f"http://{new_ip}/results"
                     self.ip_url = f"http://{new_ip}/ip"
+                    self.http.set_host(new_ip)
+                    if self.use_stream:
+                        self.frame_source.set_url(f"http://{new_ip}:81/stream")
+                    else:
+                        self.frame_source.set_url(self.stream_url)
                     return True
         except:
             pass
         return False
     
-    def send_results_to_esp32(self, data):
-        """Gửi JSON kết quả về endpoint /results trên ESP32"""
-        try:
-            response = requests.post(self.results_url, json=data, timeout=1)
-            if response.status_code != 200:
-                print(f"[ESP32 Results] HTTP {response.status_code}: {response.text}")
-        except Exception as exc:
-            print(f"[ESP32 Results] Error sending data: {exc}")
-            # Thử cập nhật IP nếu lỗi kết nối
-            self.update_esp32_ip()
+    def send_results_to_esp32(self, data, frame_size=None):
+        """
+        Gửi JSON kết quả về endpoint /results trên ESP32 (không chặn vòng lặp)
+
+        frame_size (width, height) của frame đi cùng kết quả để encoder nhị phân
+        lượng tử bbox theo đúng frame đó.
+        """
+        self.publisher.publish(data, frame_size)
 
 
 if __name__ == "__main__":
-    # Tự động lấy IP từ ESP32-CAM AP
-    # Nếu muốn dùng IP cố định, truyền vào: ESP32CamYOLOv8Detector("192.168.1.100", ...)
-    detector = ESP32CamYOLOv8Detector(esp32_ip=None, model_path="yolov8n.pt")
+    parser = argparse.ArgumentParser(description="Nhận diện YOLOv8 từ ESP32-CAM, gửi kết quả về /results")
+    parser.add_argument('--ip', default=None,
+                        help='IP cố định của ESP32-CAM (mặc định tự lấy từ AP qua /ip)')
+    parser.add_argument('--ap-ip', default="192.168.4.1")
+    parser.add_argument('--model', default="yolov8n.pt",
+                        help='Model YOLOv8: .pt (ultralytics) hoặc .onnx (ONNX Runtime, esp32_onnx_export.py)')
+    parser.add_argument('--stream', action='store_true',
+                        help='Đọc luồng MJPEG http://IP:81/stream thay vì poll /capture')
+    parser.add_argument('--track', type=int, default=None, metavar='N',
+                        help='Chạy YOLOv8 tối đa mỗi N frame, giữa các lần dời box bằng optical flow')
+    parser.add_argument('--binary-results', action='store_true',
+                        help='Gửi /results dạng nhị phân gọn (esp32_result_codec) thay cho JSON')
+    parser.add_argument('--delta-results', action='store_true',
+                        help='Nhị phân, chỉ gửi thay đổi so với trạng thái ESP32 đã xác nhận')
+    parser.add_argument('--headless', action='store_true', help='Không vẽ, không mở cửa sổ (Ctrl+C để thoát)')
+    parser.add_argument('--latency-log', default=None, metavar='PATH',
+                        help='Ghi p50/p95/p99 từng công đoạn ra file JSON lines mỗi 10 giây')
+    parser.add_argument('--metrics-port', type=int, default=None, metavar='PORT',
+                        help='Mở endpoint Prometheus http://127.0.0.1:PORT/metrics')
+    args = parser.parse_args()
+    detector = ESP32CamYOLOv8Detector(esp32_ip=args.ip, esp32_ap_ip=args.ap_ip, model_path=args.model,
+                                      use_stream=args.stream, binary_results=args.binary_results,
+                                      delta_results=args.delta_results, track_interval=args.track,
+                                      headless=args.headless,
+                                      latency_log=args.latency_log, metrics_port=args.metrics_port)
     detector.run_detection()
@@ -0,0 +1,80 @@
+"""
+Benchmark: throughput và độ trễ của InferencePipeline với depth 1..4
+
+Mỗi vòng lặp giả lập phần việc của thread chính (lấy frame, vẽ, hiển thị)
+bằng --work-ms mili giây chờ, rồi gọi pipeline.process(frame). depth=1 tương
+đương setInput/forward đồng bộ như trước.
+
+Cần file model MobileNet SSD (không có trong repo, xem HUONG_DAN_TAI_MODEL.md).
+
+Chạy từ thư mục gốc của repo:
+    python benchmarks/bench_async_inference.py
+    python benchmarks/bench_async_inference.py --frames 200 --work-ms 20 --threads 2
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from esp32_inference import InferencePipeline
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--prototxt', default=os.path.join(ROOT, 'MobileNetSSD_deploy.prototxt'))
+    parser.add_argument('--model', default=os.path.join(ROOT, 'MobileNetSSD_deploy.caffemodel'))
+    parser.add_argument('--pattern', default='esp32_*.jpg')
+    parser.add_argument('--frames', type=int, default=100)
+    parser.add_argument('--work-ms', type=float, default=10.0, help='Thời gian việc khác mỗi frame')
+    parser.add_argument('--max-depth', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=None, help='cv2.setNumThreads')
+    args = parser.parse_args()
+
+    if not os.path.exists(args.model):
+        print(f"Không tìm thấy model: {args.model}")
+        return
+    if args.threads is not None:
+        cv2.setNumThreads(args.threads)
+
+    frames = [cv2.imread(path) for path in sorted(glob.glob(os.path.join(ROOT, args.pattern)))]
+    if not frames:
+        frames = [np.random.randint(0, 255, (480, 640, 3), dtype=np.uint8)]
+
+    print(f"{os.cpu_count()} CPU, cv2 threads {cv2.getNumThreads()}, "
+          f"{args.frames} frames, work {args.work_ms:.0f} ms/frame")
+    print(f"  {'depth':>5s} {'FPS':>7s} {'lat avg':>8s} {'lat p95':>8s} {'lat max':>8s}")
+    baseline = None
+    for depth in range(1, args.max_depth + 1):
+        nets = [cv2.dnn.readNetFromCaffe(args.prototxt, args.model) for _ in range(depth)]
+        pipeline = InferencePipeline(nets, depth=depth)
+        # Warm-up mỗi bản sao net
+        for _ in range(depth):
+            pipeline.submit(frames[0])
+        pipeline.drain()
+
+        latencies = []
+        start = time.perf_counter()
+        for i in range(args.frames):
+            time.sleep(args.work_ms / 1000)
+            result = pipeline.process(frames[i % len(frames)])
+            if result is not None:
+                latencies.append(result.latency)
+        latencies += [result.latency for result in pipeline.drain()]
+        elapsed = time.perf_counter() - start
+        pipeline.close()
+
+        fps = args.frames / elapsed
+        baseline = baseline or fps
+        lat = np.array(latencies) * 1000
+        print(f"  {depth:5d} {fps:7.1f} {lat.mean():7.1f}ms {np.percentile(lat, 95):7.1f}ms "
+              f"{lat.max():7.1f}ms  ({fps / baseline:.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
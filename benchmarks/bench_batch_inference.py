@@ -0,0 +1,92 @@
+"""
+Benchmark: BatchInferenceServer cho nhiều camera với các batch size khác nhau
+
+Mỗi camera là một thread gửi frame liên tục qua BatchClient.process().
+batch_size=1 tương đương mỗi camera forward riêng lẻ trên một net dùng chung.
+
+Cần file model MobileNet SSD (không có trong repo, xem HUONG_DAN_TAI_MODEL.md).
+
+Chạy từ thư mục gốc của repo:
+    python benchmarks/bench_batch_inference.py
+    python benchmarks/bench_batch_inference.py --cameras 6 --batch-sizes 1 2 4 6 --max-wait-ms 20
+"""
+import argparse
+import glob
+import os
+import sys
+import threading
+import time
+
+import cv2
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from esp32_inference import BatchInferenceServer
+
+
+def run_cameras(server, frames, cameras, per_camera):
+    latencies = []
+    lock = threading.Lock()
+
+    def camera(index):
+        client = server.connect()
+        for i in range(per_camera):
+            client.process(frames[(index + i) % len(frames)])
+        with lock:
+            latencies.append(client.stats()['latency_avg_ms'])
+
+    threads = [threading.Thread(target=camera, args=(i,)) for i in range(cameras)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - start, float(np.mean(latencies))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--prototxt', default=os.path.join(ROOT, 'MobileNetSSD_deploy.prototxt'))
+    parser.add_argument('--model', default=os.path.join(ROOT, 'MobileNetSSD_deploy.caffemodel'))
+    parser.add_argument('--pattern', default='esp32_*.jpg')
+    parser.add_argument('--cameras', type=int, default=4)
+    parser.add_argument('--frames', type=int, default=20, help='Số frame mỗi camera')
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--max-wait-ms', type=float, default=10.0)
+    parser.add_argument('--threads', type=int, default=None, help='cv2.setNumThreads')
+    args = parser.parse_args()
+
+    if not os.path.exists(args.model):
+        print(f"Không tìm thấy model: {args.model}")
+        return
+    if args.threads is not None:
+        cv2.setNumThreads(args.threads)
+
+    frames = [cv2.imread(path) for path in sorted(glob.glob(os.path.join(ROOT, args.pattern)))]
+    if not frames:
+        frames = [np.random.randint(0, 255, (480, 640, 3), dtype=np.uint8)]
+
+    cores = max(1, cv2.getNumThreads())
+    print(f"{args.cameras} camera(s) x {args.frames} frames, max wait {args.max_wait_ms:.0f} ms, "
+          f"{os.cpu_count()} CPU, cv2 threads {cores}")
+    print(f"  {'batch':>5s} {'avg':>5s} {'FPS':>7s} {'FPS/core':>9s} {'latency':>9s}")
+    for batch_size in args.batch_sizes:
+        net = cv2.dnn.readNetFromCaffe(args.prototxt, args.model)
+        server = BatchInferenceServer(net, batch_size=batch_size, max_wait=args.max_wait_ms / 1000)
+        # Warm-up với đúng batch size để OpenCV cấp phát bộ nhớ trước
+        futures = [server.submit(frames[0]) for _ in range(batch_size)]
+        for future in futures:
+            future.result()
+
+        elapsed, latency_ms = run_cameras(server, frames, args.cameras, args.frames)
+        stats = server.stats()
+        server.close()
+
+        fps = args.cameras * args.frames / elapsed
+        print(f"  {batch_size:5d} {stats['avg_batch']:5.1f} {fps:7.1f} {fps / cores:9.1f} "
+              f"{latency_ms:7.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+Benchmark: các cascade của ESP32CamCombinedDetector chạy tuần tự (cách cũ) so với CascadeEngine
+
+So sánh ba cách trên các ảnh mẫu đã chụp:
+    sequential  - mỗi cascade tự cvtColor và detectMultiScale lần lượt
+    threaded    - CascadeEngine: gray một lần, các cascade chạy song song
+    shared      - CascadeEngine(share_pyramid=True): thêm dùng chung pyramid
+
+Lợi ích của threaded phụ thuộc số core (OpenCV cũng tự song song hóa bên
+trong detectMultiScale qua cv2.setNumThreads).
+
+Chạy từ thư mục gốc của repo:
+    python benchmarks/bench_cascades.py
+    python benchmarks/bench_cascades.py --threads 1
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+
+import cv2
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from esp32_cascades import CascadeEngine, get_cascade
+
+
+def combined_jobs():
+    """Cùng bộ cascade và tham số với ESP32CamCombinedDetector"""
+    face = {'scaleFactor': 1.05, 'minNeighbors': 3, 'minSize': (20, 20)}
+    other = {'scaleFactor': 1.1, 'minNeighbors': 3, 'minSize': (20, 20)}
+    return {
+        'frontal': (get_cascade('haarcascade_frontalface_default.xml'), face),
+        'profile': (get_cascade('haarcascade_profileface.xml'), face),
+        'person': (get_cascade('haarcascade_fullbody.xml'),
+                   {'scaleFactor': 1.1, 'minNeighbors': 3, 'minSize': (40, 40)}),
+        'eye': (get_cascade('haarcascade_eye.xml'), other),
+    }
+
+
+def run_sequential(jobs, frame):
+    results = {}
+    for name, (cascade, params) in jobs.items():
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        results[name] = cascade.detectMultiScale(gray, **params)
+    return results
+
+
+def bench(fn, frames, repeat):
+    fn(frames[0])
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for frame in frames:
+            results = fn(frame)
+    elapsed = (time.perf_counter() - start) / (repeat * len(frames)) * 1000
+    return elapsed, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--pattern', default='esp32_*.jpg')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--threads', type=int, default=None, help='cv2.setNumThreads')
+    args = parser.parse_args()
+
+    if args.threads is not None:
+        cv2.setNumThreads(args.threads)
+
+    frames = [cv2.imread(path) for path in sorted(glob.glob(os.path.join(ROOT, args.pattern)))]
+    if not frames:
+        print(f"Không tìm thấy ảnh mẫu: {args.pattern}")
+        return
+
+    jobs = {name: job for name, job in combined_jobs().items() if job[0] is not None}
+    threaded = CascadeEngine(jobs)
+    shared = CascadeEngine(jobs, share_pyramid=True)
+
+    print(f"{len(frames)} frame(s) {frames[0].shape[1]}x{frames[0].shape[0]}, "
+          f"{len(jobs)} cascade(s), {os.cpu_count()} CPU, cv2 threads {cv2.getNumThreads()}")
+    baseline = None
+    print(f"  {'mode':<11s} {'ms/frame':>9s} {'speedup':>8s}  boxes (frame cuối)")
+    for mode, fn in (('sequential', lambda f: run_sequential(jobs, f)),
+                     ('threaded', threaded.run),
+                     ('shared', shared.run)):
+        elapsed, results = bench(fn, frames, args.repeat)
+        baseline = baseline or elapsed
+        counts = ', '.join(f"{name}={len(boxes)}" for name, boxes in results.items())
+        print(f"  {mode:<11s} {elapsed:9.1f} {baseline / elapsed:7.2f}x  {counts}")
+
+    threaded.close()
+    shared.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+Benchmark: engine inference cv2.dnn / ultralytics so với ONNX Runtime trên frame mẫu
+
+    MobileNet SSD  OpenCVSSDEngine (Caffe, cv2.dnn)  vs  OnnxSSDEngine (ONNX Runtime)
+    YOLOv8n        UltralyticsEngine (.pt)           vs  OnnxYoloEngine (ONNX Runtime)
+
+Cột "match" là tỉ lệ detection của engine tham chiếu (dòng đầu mỗi model) có
+detection cùng class, IoU > 0.5 ở engine đang đo. Model thiếu file được bỏ qua.
+Xuất ONNX trước bằng esp32_onnx_export.py.
+
+Chạy từ thư mục gốc của repo:
+    python esp32_onnx_export.py ssd
+    python benchmarks/bench_engines.py --threads 1 2 4
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from esp32_engines import (OnnxSSDEngine, OnnxYoloEngine, OpenCVSSDEngine, UltralyticsEngine)
+from esp32_postprocess import box_iou
+
+
+def boxes_of(detections):
+    return np.stack([detections[name] for name in ('x1', 'y1', 'x2', 'y2')], axis=1).astype(np.float64)
+
+
+def match_rate(reference, detections):
+    """Tỉ lệ detection tham chiếu được engine khác tìm lại (cùng class, IoU > 0.5)"""
+    matched = total = 0
+    for ref, det in zip(reference, detections):
+        total += len(ref)
+        if not len(ref) or not len(det):
+            continue
+        det_boxes = boxes_of(det)
+        for row, box in zip(ref, boxes_of(ref)):
+            same = det['class_id'] == row['class_id']
+            if same.any() and box_iou(box, det_boxes[same]).max() > 0.5:
+                matched += 1
+    return matched / total if total else 1.0
+
+
+def bench(engine, frames, repeat):
+    outputs = [engine.infer(frame) for frame in frames]
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for frame in frames:
+            engine.infer(frame)
+    return (time.perf_counter() - start) / (repeat * len(frames)) * 1000, outputs
+
+
+def run_group(title, factories, frames, repeat):
+    print(f"\n📊 {title}")
+    print(f"  {'engine':<34s} {'ms/frame':>9s} {'fps':>7s} {'dets':>6s} {'match':>7s}")
+    reference = None
+    for name, factory in factories:
+        try:
+            engine = factory()
+        except Exception as e:
+            print(f"  {name:<34s} bỏ qua: {e}")
+            continue
+        elapsed, outputs = bench(engine, frames, repeat)
+        engine.close()
+        if reference is None:
+            reference = outputs
+        detections = sum(len(output) for output in outputs)
+        print(f"  {name:<34s} {elapsed:9.2f} {1000 / elapsed:7.1f} {detections:6d} "
+              f"{match_rate(reference, outputs):7.1%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--pattern', default='esp32_*.jpg')
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--prototxt', default=os.path.join(ROOT, 'MobileNetSSD_deploy.prototxt'))
+    parser.add_argument('--caffemodel', default=os.path.join(ROOT, 'MobileNetSSD_deploy.caffemodel'))
+    parser.add_argument('--ssd-onnx', default=os.path.join(ROOT, 'MobileNetSSD_deploy.onnx'))
+    parser.add_argument('--yolo-pt', default=os.path.join(ROOT, 'api', 'yolov8n.pt'))
+    parser.add_argument('--yolo-onnx', default=os.path.join(ROOT, 'api', 'yolov8n.onnx'))
+    parser.add_argument('--threads', type=int, nargs='+', default=[os.cpu_count() or 1],
+                        help='Số intra-op thread của ONNX Runtime cần đo')
+    args = parser.parse_args()
+
+    frames = [cv2.imread(path) for path in sorted(glob.glob(os.path.join(ROOT, args.pattern)))]
+    if not frames:
+        frames = [np.random.randint(0, 255, (480, 640, 3), dtype=np.uint8)]
+    print(f"{len(frames)} frame(s) {frames[0].shape[1]}x{frames[0].shape[0]}, {os.cpu_count()} core(s)")
+
+    if os.path.exists(args.caffemodel):
+        factories = [('cv2.dnn (tuned)', lambda: OpenCVSSDEngine(args.prototxt, args.caffemodel))]
+        if os.path.exists(args.ssd_onnx):
+            factories += [(f'onnxruntime, {threads} thread(s)',
+                           lambda threads=threads: OnnxSSDEngine(args.ssd_onnx, intra_op_threads=threads))
+                          for threads in args.threads]
+        run_group('MobileNet SSD', factories, frames, args.repeat)
+    else:
+        print(f"Không tìm thấy model: {args.caffemodel}")
+
+    factories = []
+    if os.path.exists(args.yolo_pt):
+        factories.append(('ultralytics', lambda: UltralyticsEngine(args.yolo_pt)))
+    if os.path.exists(args.yolo_onnx):
+        factories += [(f'onnxruntime, {threads} thread(s)',
+                       lambda threads=threads: OnnxYoloEngine(args.yolo_onnx, intra_op_threads=threads))
+                      for threads in args.threads]
+    if factories:
+        run_group('YOLOv8n', factories, frames, args.repeat)
+    else:
+        print(f"Không tìm thấy model: {args.yolo_pt}")
+
+
+if __name__ == "__main__":
+    main()
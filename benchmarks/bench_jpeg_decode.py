@@ -0,0 +1,85 @@
+"""
+Micro-benchmark: giải mã JPEG qua PIL (cách cũ) so với cv2.imdecode
+
+Dòng crc32 là chi phí kiểm tra ảnh trùng (FrameSource dedup) thay cho giải mã.
+
+Chạy từ thư mục gốc của repo:
+    python benchmarks/bench_jpeg_decode.py
+    python benchmarks/bench_jpeg_decode.py --scale 4 --max-width 640
+"""
+import argparse
+import glob
+import io
+import os
+import sys
+import time
+import zlib
+
+import cv2
+import numpy as np
+from PIL import Image
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from esp32_frame_source import decode_jpeg
+
+
+def decode_jpeg_pil(data, max_width=640):
+    """Đường giải mã cũ: BytesIO -> PIL -> np.array -> cvtColor -> resize"""
+    image = Image.open(io.BytesIO(data))
+    frame = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
+    height, width = frame.shape[:2]
+    if max_width is not None and width > max_width:
+        scale = max_width / width
+        frame = cv2.resize(frame, (max_width, int(height * scale)))
+    return frame
+
+
+def load_samples(pattern, scale):
+    """Đọc các ảnh mẫu; scale > 1 phóng to để giả lập độ phân giải camera lớn hơn"""
+    samples = []
+    for path in sorted(glob.glob(os.path.join(ROOT, pattern))):
+        with open(path, 'rb') as f:
+            data = f.read()
+        if scale > 1:
+            image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+            image = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_CUBIC)
+            data = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, 85])[1].tobytes()
+        samples.append(data)
+    return samples
+
+
+def bench(fn, samples, max_width, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for data in samples:
+            fn(data, max_width)
+    return (time.perf_counter() - start) / (repeat * len(samples)) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--pattern', default='esp32_smart_objects_*.jpg')
+    parser.add_argument('--scale', type=int, default=1, help='Phóng to ảnh mẫu (ví dụ 4 ~ 960x960)')
+    parser.add_argument('--max-width', type=int, default=640)
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    samples = load_samples(args.pattern, args.scale)
+    if not samples:
+        print(f"Không tìm thấy ảnh mẫu: {args.pattern}")
+        return
+
+    h, w = decode_jpeg(samples[0], None).shape[:2]
+    print(f"{len(samples)} ảnh {w}x{h}, max_width={args.max_width}, repeat={args.repeat}")
+
+    for name, fn in (("PIL", decode_jpeg_pil), ("imdecode", decode_jpeg)):
+        ms = bench(fn, samples, args.max_width, args.repeat)
+        out = fn(samples[0], args.max_width)
+        print(f"  {name:10s} {ms:7.3f} ms/frame  -> {out.shape[1]}x{out.shape[0]}")
+    ms = bench(lambda data, max_width: zlib.crc32(data), samples, args.max_width, args.repeat)
+    print(f"  {'crc32':10s} {ms:7.3f} ms/frame  (ảnh trùng: bỏ qua giải mã)")
+
+
+if __name__ == "__main__":
+    main()
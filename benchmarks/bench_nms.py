@@ -0,0 +1,85 @@
+"""
+Benchmark: loại box trùng lặp bằng vòng lặp lồng nhau (cách cũ) so với NMS NumPy
+
+Box giả lập giống output của detectMultiScale với minNeighbors thấp: nhiều cụm
+box chồng nhau quanh vài vật thể.
+
+Chạy từ thư mục gốc của repo:
+    python benchmarks/bench_nms.py
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from esp32_postprocess import nms
+
+
+def remove_overlapping_loop(detections, threshold=0.3):
+    """Cách cũ của ESP32CamCombinedDetector: so sánh mọi cặp box"""
+    if len(detections) <= 1:
+        return detections
+    filtered = []
+    for i, det1 in enumerate(detections):
+        x1, y1, w1, h1 = det1
+        is_duplicate = False
+        for j, det2 in enumerate(detections):
+            if i == j:
+                continue
+            x2, y2, w2, h2 = det2
+            x_left = max(x1, x2)
+            y_top = max(y1, y2)
+            x_right = min(x1 + w1, x2 + w2)
+            y_bottom = min(y1 + h1, y2 + h2)
+            if x_right < x_left or y_bottom < y_top:
+                continue
+            intersection = (x_right - x_left) * (y_bottom - y_top)
+            union = w1 * h1 + w2 * h2 - intersection
+            if union > 0 and intersection / union > threshold:
+                is_duplicate = True
+                break
+        if not is_duplicate:
+            filtered.append(det1)
+    return filtered
+
+
+def fake_boxes(n, clusters, rng):
+    centers = rng.uniform(50, 550, (clusters, 2))
+    sizes = rng.uniform(30, 120, clusters)
+    idx = rng.integers(0, clusters, n)
+    jitter = rng.normal(0, 8, (n, 3))
+    w = np.maximum(10, sizes[idx] + jitter[:, 2])
+    x = centers[idx, 0] + jitter[:, 0] - w / 2
+    y = centers[idx, 1] + jitter[:, 1] - w / 2
+    return np.stack([x, y, w, w], axis=1).astype(np.int32)
+
+
+def bench(fn, boxes, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn(boxes)
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    print(f"  {'boxes':>6s} {'loop (ms)':>10s} {'nms (ms)':>9s} {'speedup':>8s} {'kept loop/nms':>14s}")
+    for n in (10, 50, 100, 300, 600):
+        boxes = fake_boxes(n, max(2, n // 20), rng)
+        as_tuples = [tuple(b) for b in boxes.tolist()]
+        loop_ms = bench(remove_overlapping_loop, as_tuples, args.repeat)
+        nms_ms = bench(lambda b: b[nms(b)], boxes, args.repeat)
+        kept = f"{len(remove_overlapping_loop(as_tuples))}/{len(nms(boxes))}"
+        print(f"  {n:6d} {loop_ms:10.3f} {nms_ms:9.3f} {loop_ms / nms_ms:7.1f}x {kept:>14s}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+Benchmark: tiền xử lý MobileNet SSD bằng cv2.dnn.blobFromImage (cách cũ) so với SSDPreprocessor
+
+So sánh thời gian, bộ nhớ NumPy cấp phát mỗi frame (tracemalloc) và số buffer
+output khác nhau trên toàn bộ frame mẫu:
+    blobFromImage         - detector class (esp32_smart_object_detector.py, ...)
+    resize+blobFromImage  - thêm cv2.resize trước (esp32_optimized_detector.py)
+    SSDPreprocessor       - buffer 300x300 uint8 và 1x3x300x300 float32 dùng lại
+
+Lưu ý: cách cũ truyền mean=127.5 (một số) nên OpenCV hiểu là Scalar(127.5, 0, 0),
+chỉ kênh B bị trừ mean. Cột "max diff" so với blobFromImage có mean đủ 3 kênh.
+
+Chạy từ thư mục gốc của repo:
+    python benchmarks/bench_preprocess.py
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from esp32_inference import SSDPreprocessor
+
+
+def blob_from_image(frame):
+    return cv2.dnn.blobFromImage(frame, 0.007843, (300, 300), 127.5)
+
+
+def resize_blob_from_image(frame):
+    return cv2.dnn.blobFromImage(cv2.resize(frame, (300, 300)), 0.007843, (300, 300), 127.5)
+
+
+def reference(frame):
+    return cv2.dnn.blobFromImage(frame, 0.007843, (300, 300), (127.5, 127.5, 127.5))
+
+
+def peak_allocated(fn, frames):
+    """Bytes NumPy cấp phát (đỉnh, qua tracemalloc) trung bình mỗi lần gọi"""
+    fn(frames[0])
+    tracemalloc.start()
+    allocated = 0
+    for frame in frames:
+        base, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        result = fn(frame)
+        _, peak = tracemalloc.get_traced_memory()
+        allocated += peak - base
+        del result
+    tracemalloc.stop()
+    return allocated / len(frames)
+
+
+def output_buffers(fn, frames):
+    """Số buffer output khác nhau khi giữ lại kết quả của mọi frame"""
+    results = [fn(frame) for frame in frames]
+    return len({result.__array_interface__['data'][0] for result in results})
+
+
+def bench(fn, frames, repeat):
+    fn(frames[0])
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for frame in frames:
+            fn(frame)
+    return (time.perf_counter() - start) / (repeat * len(frames)) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--pattern', default='esp32_*.jpg')
+    parser.add_argument('--repeat', type=int, default=100)
+    args = parser.parse_args()
+
+    frames = [cv2.imread(path) for path in sorted(glob.glob(os.path.join(ROOT, args.pattern)))]
+    if not frames:
+        frames = [np.random.randint(0, 255, (480, 640, 3), dtype=np.uint8)]
+
+    preprocess = SSDPreprocessor()
+    print(f"{len(frames)} frame(s) {frames[0].shape[1]}x{frames[0].shape[0]}")
+    print(f"  {'method':<22s} {'ms/frame':>9s} {'peak KB/frame':>14s} {'buffers':>8s} {'max diff':>9s}")
+    for name, fn in (('blobFromImage', blob_from_image),
+                     ('resize+blobFromImage', resize_blob_from_image),
+                     ('SSDPreprocessor', preprocess)):
+        elapsed = bench(fn, frames, args.repeat)
+        allocated = peak_allocated(fn, frames)
+        buffers = output_buffers(fn, frames)
+        diff = max(float(np.abs(fn(frame) - reference(frame)).max()) for frame in frames)
+        print(f"  {name:<22s} {elapsed:9.3f} {allocated / 1024:14.1f} {buffers:4d}/{len(frames):<3d} {diff:9.4f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Benchmark: hậu xử lý output MobileNet SSD bằng vòng lặp Python so với NumPy
+
+Output giả lập có keep_top_k = 100 hàng (như MobileNetSSD_deploy.prototxt),
+trong đó n hàng vượt ngưỡng confidence.
+
+Chạy từ thư mục gốc của repo:
+    python benchmarks/bench_ssd_postprocess.py
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from esp32_postprocess import postprocess_ssd
+
+CLASSES = ["background", "aeroplane", "bicycle", "bird", "boat",
+           "bottle", "bus", "car", "cat", "chair", "cow", "diningtable",
+           "dog", "horse", "motorbike", "person", "pottedplant", "sheep",
+           "sofa", "train", "tvmonitor"]
+
+
+def postprocess_loop(detections, w, h, threshold):
+    """Cách cũ: duyệt từng hàng và cấp phát np.array([w, h, w, h]) mỗi lần"""
+    result = []
+    for i in range(detections.shape[2]):
+        confidence = detections[0, 0, i, 2]
+        if confidence > threshold:
+            class_id = int(detections[0, 0, i, 1])
+            box = detections[0, 0, i, 3:7] * np.array([w, h, w, h])
+            (startX, startY, endX, endY) = box.astype("int")
+            startX = max(0, startX)
+            startY = max(0, startY)
+            endX = min(w, endX)
+            endY = min(h, endY)
+            result.append((CLASSES[class_id], confidence, startX, startY, endX, endY))
+    return result
+
+
+def postprocess_vectorized(detections, w, h, threshold):
+    results = postprocess_ssd(detections, w, h, threshold, num_classes=len(CLASSES))
+    return [(CLASSES[c], conf, x1, y1, x2, y2) for c, conf, x1, y1, x2, y2 in results.tolist()]
+
+
+def fake_detections(rows, kept, rng):
+    detections = np.zeros((1, 1, rows, 7), dtype=np.float32)
+    detections[0, 0, :, 1] = rng.integers(1, len(CLASSES), rows)
+    detections[0, 0, :, 2] = rng.uniform(0.25, 0.5, rows)
+    detections[0, 0, :kept, 2] = rng.uniform(0.5, 1.0, kept)
+    xy = rng.uniform(-0.05, 0.8, (rows, 2))
+    wh = rng.uniform(0.05, 0.3, (rows, 2))
+    detections[0, 0, :, 3:5] = xy
+    detections[0, 0, :, 5:7] = xy + wh
+    return detections
+
+
+def bench(fn, detections, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn(detections, 640, 480, 0.5)
+    return (time.perf_counter() - start) / repeat * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--rows', type=int, default=100)
+    parser.add_argument('--repeat', type=int, default=2000)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    print(f"{args.rows} hàng output, repeat={args.repeat}")
+    print(f"  {'kept':>5s} {'loop (us)':>10s} {'numpy (us)':>11s} {'speedup':>8s}")
+    for kept in (0, 3, 10, 30, 100):
+        detections = fake_detections(args.rows, min(kept, args.rows), rng)
+        assert postprocess_loop(detections, 640, 480, 0.5) == postprocess_vectorized(detections, 640, 480, 0.5)
+        loop_us = bench(postprocess_loop, detections, args.repeat)
+        vec_us = bench(postprocess_vectorized, detections, args.repeat)
+        print(f"  {kept:5d} {loop_us:10.1f} {vec_us:11.1f} {loop_us / vec_us:7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
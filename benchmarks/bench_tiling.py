@@ -0,0 +1,143 @@
+"""
+Benchmark: inference theo tile (TiledDetector) so với một lần MobileNet SSD trên cả frame
+
+Với mỗi cấu hình tile: số ảnh mỗi forward, thời gian CPU/frame, recall (tất cả
+và vật nhỏ, cạnh dài < 10% chiều rộng frame) và precision, cùng class và IoU >= 0.5.
+
+Tham chiếu: nhãn JSON (--labels, cùng định dạng esp32_quantize.py) hoặc, nếu không
+có nhãn, hợp các detection của mọi cấu hình (ghép bằng NMS) — khi đó recall là tỉ
+lệ vật mà cấu hình đó thấy trong số vật mà ít nhất một cấu hình thấy.
+
+Chạy từ thư mục gốc của repo:
+    python benchmarks/bench_tiling.py --images dataset/vga --labels dataset/vga/labels.json
+    python benchmarks/bench_tiling.py --width 1280 --tiles 300 400 --overlaps 0.2 0.3
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from esp32_engines import VOC_CLASSES
+from esp32_inference import SSDPreprocessor, forward_batch
+from esp32_postprocess import box_iou, postprocess_ssd
+from esp32_quantize import list_images, load_labels
+from esp32_roi import merge_detections
+from esp32_tiling import TiledDetector
+
+
+def boxes_of(detections):
+    return np.stack([detections[name] for name in ('x1', 'y1', 'x2', 'y2')], axis=1).astype(np.float64)
+
+
+def matched(gt_ids, gt_boxes, detections):
+    """Mảng bool: nhãn nào khớp được một detection (cùng class, IoU >= 0.5), mỗi detection khớp một lần"""
+    hits = np.zeros(len(gt_ids), dtype=bool)
+    if not len(detections):
+        return hits
+    boxes = boxes_of(detections)
+    used = np.zeros(len(detections), dtype=bool)
+    for i, (class_id, box) in enumerate(zip(gt_ids, gt_boxes)):
+        candidates = np.flatnonzero((detections['class_id'] == class_id) & ~used)
+        if len(candidates):
+            ious = box_iou(box, boxes[candidates])
+            if ious.max() >= 0.5:
+                used[candidates[ious.argmax()]] = True
+                hits[i] = True
+    return hits
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--images', default=None, help='Thư mục ảnh (mặc định ảnh mẫu esp32_*.jpg)')
+    parser.add_argument('--labels', default=None)
+    parser.add_argument('--width', type=int, default=640, help='Phóng ảnh mẫu tới chiều rộng này')
+    parser.add_argument('--tiles', type=int, nargs='+', default=[300])
+    parser.add_argument('--overlaps', type=float, nargs='+', default=[0.25])
+    parser.add_argument('--threshold', type=float, default=0.5)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--prototxt', default=os.path.join(ROOT, 'MobileNetSSD_deploy.prototxt'))
+    parser.add_argument('--caffemodel', default=os.path.join(ROOT, 'MobileNetSSD_deploy.caffemodel'))
+    args = parser.parse_args()
+
+    if not os.path.exists(args.caffemodel):
+        print(f"Không tìm thấy model: {args.caffemodel}")
+        return
+    net = cv2.dnn.readNetFromCaffe(args.prototxt, args.caffemodel)
+    preprocessor = SSDPreprocessor()
+
+    def detect(frames):
+        outputs = forward_batch(net, preprocessor, frames)
+        return [postprocess_ssd(output, frame.shape[1], frame.shape[0], args.threshold,
+                                num_classes=len(VOC_CLASSES))
+                for frame, output in zip(frames, outputs)]
+
+    if args.images:
+        frames = {os.path.basename(path): cv2.imread(path) for path in list_images(args.images)}
+    else:
+        frames = {}
+        for path in sorted(glob.glob(os.path.join(ROOT, 'esp32_*.jpg'))):
+            image = cv2.imread(path)
+            scale = args.width / image.shape[1]
+            frames[os.path.basename(path)] = cv2.resize(image, None, fx=scale, fy=scale,
+                                                        interpolation=cv2.INTER_CUBIC)
+    frames = {name: frame for name, frame in frames.items() if frame is not None}
+    if not frames:
+        print("Không có ảnh để đo")
+        return
+    sample = next(iter(frames.values()))
+    print(f"{len(frames)} ảnh, ví dụ {sample.shape[1]}x{sample.shape[0]}")
+
+    # mode -> (hàm frame -> detections, số ảnh mỗi forward)
+    modes = {'single': (lambda frame: detect([frame])[0], 1)}
+    for tile_size in args.tiles:
+        for overlap in args.overlaps:
+            tiled = TiledDetector(detect, tile_size=tile_size, overlap=overlap)
+            images = len(tiled.regions(sample.shape)) + (1 if tiled.include_full else 0)
+            modes[f"tile {tile_size}/{overlap:.2f}"] = (tiled.process, images)
+
+    results = {}
+    for mode, (run, _) in modes.items():
+        predictions = {name: run(frame) for name, frame in frames.items()}
+        cpu = time.process_time()
+        for _ in range(args.repeat):
+            for frame in frames.values():
+                run(frame)
+        results[mode] = (predictions, (time.process_time() - cpu) / (args.repeat * len(frames)) * 1000)
+
+    if args.labels:
+        labels = load_labels(args.labels, VOC_CLASSES)
+        reference = "nhãn"
+    else:
+        labels = {}
+        for name in frames:
+            union = merge_detections([predictions[name] for predictions, _ in results.values()])
+            labels[name] = (union['class_id'], boxes_of(union))
+        reference = "hợp detection mọi cấu hình"
+    names = [name for name in frames if name in labels]
+    print(f"Tham chiếu: {reference}")
+
+    print(f"  {'mode':>14s} {'ảnh/forward':>11s} {'cpu ms/frame':>13s} {'recall':>7s} {'small':>7s} {'precision':>10s}")
+    for mode, (predictions, cpu_ms) in results.items():
+        hits, small_hits, total_det = [], [], 0
+        for name in names:
+            gt_ids, gt_boxes = labels[name]
+            found = matched(gt_ids, gt_boxes, predictions[name])
+            small = np.maximum(gt_boxes[:, 2] - gt_boxes[:, 0], gt_boxes[:, 3] - gt_boxes[:, 1]) \
+                < 0.1 * frames[name].shape[1]
+            hits.append(found)
+            small_hits.append(found[small])
+            total_det += len(predictions[name])
+        hits, small_hits = np.concatenate(hits), np.concatenate(small_hits)
+        print(f"  {mode:>14s} {modes[mode][1]:11d} {cpu_ms:13.1f} "
+              f"{hits.mean() if len(hits) else 1:7.1%} {small_hits.mean() if len(small_hits) else 1:7.1%} "
+              f"{hits.sum() / total_det if total_det else 1:10.1%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""
+Benchmark: detect-then-track (DetectTrackScheduler) so với chạy MobileNet SSD mọi frame
+
+Với mỗi N tối đa: FPS hiệu dụng, thời gian CPU/frame (tiết kiệm so với N=1) và
+độ chính xác so với detection mọi frame (recall/precision, cùng class và IoU > 0.5).
+
+Chuỗi frame: video (--video), thư mục frame đã ghi (--frames, sắp theo tên) hoặc
+mặc định một chuỗi mô phỏng người đi bộ (lia ngang, đứng yên, tiến lại gần) tạo
+từ ảnh mẫu esp32_*.jpg.
+
+Chạy từ thư mục gốc của repo:
+    python benchmarks/bench_tracking.py --frames recordings/walk1 --intervals 1 3 5 10
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from esp32_engines import OpenCVSSDEngine
+from esp32_postprocess import box_iou
+from esp32_tracking import DetectTrackScheduler
+
+
+def load_sequence(args):
+    if args.video:
+        capture = cv2.VideoCapture(args.video)
+        frames = []
+        while len(frames) < args.limit:
+            ok, frame = capture.read()
+            if not ok:
+                break
+            frames.append(frame)
+        return frames
+    if args.frames:
+        paths = sorted(glob.glob(os.path.join(args.frames, '*.jpg')))[:args.limit]
+        return [cv2.imread(path) for path in paths]
+
+    # Mô phỏng: lia ngang 40 frame, đứng yên 40 frame, tiến lại gần 40 frame
+    source = cv2.imread(sorted(glob.glob(os.path.join(ROOT, 'esp32_*.jpg')))[0])
+    big = cv2.resize(source, (source.shape[1] * 2, source.shape[0] * 2))
+    height, width = source.shape[:2]
+    frames = []
+    for i in range(120):
+        if i < 40:
+            x, y, zoom = i * 4, height // 2, 1.0
+        elif i < 80:
+            x, y, zoom = 160, height // 2, 1.0
+        else:
+            x, y, zoom = 160, height // 2, 1.0 + (i - 80) * 0.01
+        w, h = int(width / zoom), int(height / zoom)
+        cx, cy = x + width // 2, y + height // 2
+        crop = big[cy - h // 2:cy - h // 2 + h, cx - w // 2:cx - w // 2 + w]
+        frames.append(cv2.resize(crop, (width, height)))
+    return frames[:args.limit]
+
+
+def boxes_of(detections):
+    return np.stack([detections[name] for name in ('x1', 'y1', 'x2', 'y2')], axis=1).astype(np.float64)
+
+
+def matches(reference, detections):
+    """Số cặp khớp (cùng class, IoU > 0.5) giữa detection tham chiếu và detection đo"""
+    if not len(reference) or not len(detections):
+        return 0
+    boxes, ref_boxes = boxes_of(detections), boxes_of(reference)
+    used = np.zeros(len(detections), dtype=bool)
+    matched = 0
+    for row, box in zip(reference, ref_boxes):
+        candidates = np.flatnonzero((detections['class_id'] == row['class_id']) & ~used)
+        if len(candidates):
+            ious = box_iou(box, boxes[candidates])
+            if ious.max() > 0.5:
+                used[candidates[ious.argmax()]] = True
+                matched += 1
+    return matched
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--video', default=None)
+    parser.add_argument('--frames', default=None)
+    parser.add_argument('--limit', type=int, default=300)
+    parser.add_argument('--intervals', type=int, nargs='+', default=[1, 3, 5, 10])
+    parser.add_argument('--prototxt', default=os.path.join(ROOT, 'MobileNetSSD_deploy.prototxt'))
+    parser.add_argument('--caffemodel', default=os.path.join(ROOT, 'MobileNetSSD_deploy.caffemodel'))
+    args = parser.parse_args()
+
+    if not os.path.exists(args.caffemodel):
+        print(f"Không tìm thấy model: {args.caffemodel}")
+        return
+    engine = OpenCVSSDEngine(args.prototxt, args.caffemodel)
+    frames = load_sequence(args)
+    print(f"{len(frames)} frame(s) {frames[0].shape[1]}x{frames[0].shape[0]}")
+
+    reference = [engine.infer(frame) for frame in frames]
+    total_ref = sum(len(r) for r in reference)
+
+    print(f"  {'N max':>5s} {'fps':>7s} {'cpu ms/frame':>13s} {'cpu saved':>10s} {'network':>8s} "
+          f"{'recall':>7s} {'precision':>10s}")
+    baseline_cpu = None
+    for interval in args.intervals:
+        scheduler = DetectTrackScheduler(engine.infer, max_interval=interval)
+        outputs = []
+        wall, cpu = time.perf_counter(), time.process_time()
+        for frame in frames:
+            outputs.append(scheduler.process(frame)[0])
+        wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+        cpu_ms = cpu / len(frames) * 1000
+        if baseline_cpu is None:
+            baseline_cpu = cpu_ms
+        matched = sum(matches(ref, out) for ref, out in zip(reference, outputs))
+        total_out = sum(len(out) for out in outputs)
+        stats = scheduler.stats()
+        print(f"  {interval:5d} {len(frames) / wall:7.1f} {cpu_ms:13.1f} {1 - cpu_ms / baseline_cpu:10.0%} "
+              f"{stats['detect_ratio']:8.0%} {matched / total_ref if total_ref else 1:7.1%} "
+              f"{matched / total_out if total_out else 1:10.1%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,298 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+_lock = threading.Lock()
+_registry = {}
+# Lock của các classifier không đến từ registry: id -> (cascade, lock)
+_other_locks = {}
+
+
+def resolve_cascade_path(cascade_file):
+    """Đường dẫn đầy đủ của file cascade (tên trần sẽ tìm trong cv2.data.haarcascades)"""
+    if os.path.dirname(cascade_file):
+        return os.path.abspath(cascade_file)
+    return os.path.join(cv2.data.haarcascades, cascade_file)
+
+
+def get_cascade(cascade_file):
+    """
+    Lấy CascadeClassifier dùng chung trong toàn process
+
+    Mỗi file chỉ được parse XML một lần (lazy, khi được yêu cầu lần đầu).
+    File không tồn tại/không hợp lệ cũng được ghi nhớ để không thử tải lại.
+    Mọi nơi gọi nhận cùng một instance, nên detectMultiScale phải chạy trong
+    cascade_lock(cascade).
+
+    Args:
+        cascade_file (str): Tên file trong cv2.data.haarcascades hoặc đường dẫn
+
+    Returns:
+        cv2.CascadeClassifier hoặc None nếu không tải được
+    """
+    path = resolve_cascade_path(cascade_file)
+    with _lock:
+        entry = _registry.get(path)
+        if entry is None:
+            start = time.perf_counter()
+            cascade = cv2.CascadeClassifier(path)
+            if cascade.empty():
+                cascade = None
+            entry = {
+                'cascade': cascade,
+                'load_ms': (time.perf_counter() - start) * 1000,
+                'file_bytes': os.path.getsize(path) if os.path.exists(path) else 0,
+                'requests': 0,
+                'lock': threading.Lock(),
+            }
+            _registry[path] = entry
+        entry['requests'] += 1
+        return entry['cascade']
+
+
+def cascade_lock(cascade):
+    """
+    Lock của một CascadeClassifier
+
+    CascadeClassifier không an toàn khi hai thread cùng gọi detectMultiScale,
+    mà instance của registry được dùng chung giữa các detector/CascadeEngine,
+    nên mọi lần detect phải giữ lock này.
+
+    Args:
+        cascade: cv2.CascadeClassifier (từ get_cascade hoặc tự tạo)
+
+    Returns:
+        threading.Lock
+    """
+    with _lock:
+        for entry in _registry.values():
+            if entry['cascade'] is cascade:
+                return entry['lock']
+        key = id(cascade)
+        if key not in _other_locks:
+            _other_locks[key] = (cascade, threading.Lock())
+        return _other_locks[key][1]
+
+
+def cascade_registry_info():
+    """
+    Thông tin các cascade đã tải
+
+    Returns:
+        dict: {'instances', 'missing', 'file_bytes', 'cascades': {tên file: chi tiết}}
+    """
+    with _lock:
+        cascades = {
+            os.path.basename(path): {
+                'loaded': entry['cascade'] is not None,
+                'load_ms': entry['load_ms'],
+                'file_bytes': entry['file_bytes'],
+                'requests': entry['requests'],
+            }
+            for path, entry in _registry.items()
+        }
+    loaded = [info for info in cascades.values() if info['loaded']]
+    return {
+        'instances': len(loaded),
+        'missing': len(cascades) - len(loaded),
+        'file_bytes': sum(info['file_bytes'] for info in loaded),
+        'cascades': cascades,
+    }
+
+
+def print_cascade_registry_info():
+    """In báo cáo cascade đã tải"""
+    info = cascade_registry_info()
+    print(f"\n📋 Cascade registry: {info['instances']} instance(s), "
+          f"{info['file_bytes'] / 1024:.0f} KB XML, {info['missing']} không tìm thấy")
+    for name, details in sorted(info['cascades'].items()):
+        status = f"{details['load_ms']:.1f} ms" if details['loaded'] else "không tìm thấy"
+        print(f"   - {name}: {status}, dùng {details['requests']} lần")
+
+
+# Hệ số nhóm rectangle mà detectMultiScale dùng nội bộ (GROUP_EPS của OpenCV)
+_GROUP_EPS = 0.2
+
+
+class CascadeEngine:
+    """
+    Chạy nhiều cascade trên cùng một frame
+
+    Frame được chuyển sang grayscale (và equalize nếu cần) một lần, sau đó
+    các cascade chạy song song trên thread pool (OpenCV nhả GIL trong
+    detectMultiScale; mỗi classifier chỉ một thread dùng một lúc, xem
+    cascade_lock). Với share_pyramid=True, các cascade có cùng scaleFactor
+    dùng chung một image pyramid tính sẵn: mỗi tầng chỉ quét ở kích thước cửa
+    sổ gốc, rồi các box được gom lại bằng cv2.groupRectangles như OpenCV làm
+    nội bộ.
+    """
+
+    def __init__(self, jobs, max_workers=None, equalize=False, share_pyramid=False):
+        """
+        Args:
+            jobs (dict): {tên: (cascade, params)} với params là tham số detectMultiScale
+                (scaleFactor, minNeighbors, minSize, maxSize, flags)
+            max_workers: Số thread (mặc định bằng số cascade)
+            equalize (bool): equalizeHist ảnh gray trước khi detect
+            share_pyramid (bool): Dùng chung pyramid cho các cascade cùng scaleFactor
+        """
+        self.jobs = {name: (cascade, dict(params)) for name, (cascade, params) in jobs.items()
+                     if cascade is not None}
+        self.equalize = equalize
+        self.share_pyramid = share_pyramid
+
+        # Các job dùng chung một classifier chạy tuần tự trong cùng một task
+        self._groups = {}
+        for name, (cascade, params) in self.jobs.items():
+            self._groups.setdefault(id(cascade), []).append(name)
+        # Classifier có thể đang được engine/detector khác dùng (registry chung)
+        self._locks = {name: cascade_lock(cascade) for name, (cascade, params) in self.jobs.items()}
+
+        workers = max_workers or max(1, len(self._groups))
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="cascade")
+        self._timings = {name: {'calls': 0, 'total_ms': 0.0, 'last_ms': 0.0} for name in self.jobs}
+        self._timings['_prepare'] = {'calls': 0, 'total_ms': 0.0, 'last_ms': 0.0}
+
+    def prepare(self, frame):
+        """Chuyển frame BGR sang gray (và equalize) một lần cho tất cả cascade"""
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+        if self.equalize:
+            gray = cv2.equalizeHist(gray)
+        return gray
+
+    def _build_pyramids(self, gray):
+        """Tính pyramid cho từng scaleFactor được dùng bởi ít nhất hai cascade"""
+        factors = {}
+        for cascade, params in self.jobs.values():
+            scale = params.get('scaleFactor', 1.1)
+            factors[scale] = factors.get(scale, 0) + 1
+
+        pyramids = {}
+        height, width = gray.shape[:2]
+        for scale, users in factors.items():
+            if users < 2:
+                continue
+            levels = []
+            factor = 1.0
+            while True:
+                size = (int(round(width / factor)), int(round(height / factor)))
+                if size[0] < 8 or size[1] < 8:
+                    break
+                level = gray if factor == 1.0 else cv2.resize(gray, size, interpolation=cv2.INTER_LINEAR)
+                levels.append((factor, level))
+                factor *= scale
+            pyramids[scale] = levels
+        return pyramids
+
+    def _detect_on_pyramid(self, cascade, params, levels):
+        """detectMultiScale trên pyramid tính sẵn, trả kết quả như detectMultiScale"""
+        win_w, win_h = cascade.getOriginalWindowSize()
+        min_w, min_h = params.get('minSize', (0, 0)) or (0, 0)
+        max_w, max_h = params.get('maxSize', (0, 0)) or (0, 0)
+        flags = params.get('flags', 0)
+
+        candidates = []
+        for factor, level in levels:
+            obj_w, obj_h = win_w * factor, win_h * factor
+            if obj_w < min_w or obj_h < min_h:
+                continue
+            if (max_w and obj_w > max_w) or (max_h and obj_h > max_h):
+                break
+            if level.shape[1] < win_w or level.shape[0] < win_h:
+                break
+            boxes = cascade.detectMultiScale(level, scaleFactor=1.1, minNeighbors=0, flags=flags,
+                                             minSize=(win_w, win_h), maxSize=(win_w, win_h))
+            for x, y, w, h in boxes:
+                candidates.append([int(round(x * factor)), int(round(y * factor)),
+                                   int(round(w * factor)), int(round(h * factor))])
+
+        min_neighbors = params.get('minNeighbors', 3)
+        if min_neighbors > 0 and candidates:
+            candidates, _ = cv2.groupRectangles(candidates, min_neighbors, _GROUP_EPS)
+        return np.asarray(candidates, dtype=np.int32).reshape(-1, 4)
+
+    def _run_group(self, names, gray, pyramids):
+        results = {}
+        for name in names:
+            cascade, params = self.jobs[name]
+            start = time.perf_counter()
+            levels = pyramids.get(params.get('scaleFactor', 1.1))
+            with self._locks[name]:
+                if levels is not None:
+                    boxes = self._detect_on_pyramid(cascade, params, levels)
+                else:
+                    boxes = np.asarray(cascade.detectMultiScale(gray, **params), dtype=np.int32).reshape(-1, 4)
+            results[name] = (boxes, (time.perf_counter() - start) * 1000)
+        return results
+
+    def run(self, frame, names=None):
+        """
+        Chạy các cascade trên một frame
+
+        Args:
+            frame: Frame BGR (hoặc ảnh gray)
+            names: Chỉ chạy các cascade này (mặc định tất cả)
+
+        Returns:
+            dict: {tên: numpy.ndarray các box (x, y, w, h)} theo thứ tự jobs
+        """
+        start = time.perf_counter()
+        gray = self.prepare(frame)
+        pyramids = self._build_pyramids(gray) if self.share_pyramid else {}
+        self._record('_prepare', (time.perf_counter() - start) * 1000)
+
+        selected = set(self.jobs if names is None else names)
+        groups = [[n for n in group if n in selected] for group in self._groups.values()]
+        groups = [group for group in groups if group]
+
+        results = {}
+        if len(groups) == 1:
+            results.update(self._run_group(groups[0], gray, pyramids))
+        else:
+            futures = [self._executor.submit(self._run_group, group, gray, pyramids) for group in groups]
+            for future in futures:
+                results.update(future.result())
+
+        output = {}
+        for name in self.jobs:
+            if name in results:
+                boxes, elapsed_ms = results[name]
+                self._record(name, elapsed_ms)
+                output[name] = boxes
+        return output
+
+    def _record(self, name, elapsed_ms):
+        timing = self._timings[name]
+        timing['calls'] += 1
+        timing['total_ms'] += elapsed_ms
+        timing['last_ms'] = elapsed_ms
+
+    def timings(self):
+        """
+        Thời gian chạy của từng cascade
+
+        Returns:
+            dict: {tên: {'calls', 'avg_ms', 'last_ms'}}, '_prepare' là bước gray/pyramid
+        """
+        return {
+            name: {
+                'calls': t['calls'],
+                'avg_ms': t['total_ms'] / t['calls'] if t['calls'] else 0.0,
+                'last_ms': t['last_ms'],
+            }
+            for name, t in self._timings.items()
+        }
+
+    def print_timings(self):
+        """In thời gian trung bình của từng cascade"""
+        print("   - Cascade timings (avg):")
+        for name, t in self.timings().items():
+            if t['calls']:
+                print(f"     {name}: {t['avg_ms']:.1f} ms ({t['calls']} lần)")
+
+    def close(self):
+        self._executor.shutdown(wait=False)
@@ -1,30 +1,48 @@
 import cv2
 import numpy as np
-import requests
-from PIL import Image
-import io
+import sys
 import time
 from collections import defaultdict, deque
 
+from esp32_cascades import CascadeEngine, get_cascade
+from esp32_display import create_display
+from esp32_frame_source import CaptureFrameSource, LatestFrameGrabber
+from esp32_latency import FrameRate, StageLatency
+from esp32_motion_gate import MotionGate
+from esp32_postprocess import nms
+
 class ESP32CamCombinedDetector:
-    def __init__(self, esp32_ip="192.168.1.14"):
+    def __init__(self, esp32_ip="192.168.1.14", frame_source=None, motion_threshold=None, headless=False):
         """
         Detector kết hợp người và đồ vật cho ESP32-CAM
         
         Args:
             esp32_ip (str): IP address của ESP32-CAM
+            frame_source (FrameSource): Nguồn frame (mặc định poll /capture trên thread riêng)
+            motion_threshold (float): Tỉ lệ pixel thumbnail thay đổi tối thiểu để chạy cascade,
+                dưới ngưỡng dùng lại kết quả trước (MotionGate); None = tắt
+            headless (bool): Không vẽ và không mở cửa sổ (thoát bằng Ctrl+C); khi hiển thị,
+                việc vẽ chạy trên thread riêng (esp32_display)
         """
         self.esp32_ip = esp32_ip
         self.stream_url = f"http://{esp32_ip}/capture"
+        self.frame_source = frame_source or LatestFrameGrabber(
+            CaptureFrameSource(self.stream_url, timeout=2)
+        )
+        self.stream_url = self.frame_source.url
+        
+        # Độ trễ theo công đoạn (fetch/decode đo trong frame source)
+        self.latency = StageLatency(esp32_ip)
+        self.frame_source.latency = self.latency
         
         # Khởi tạo cascade cho người
-        self.face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
-        self.profile_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_profileface.xml')
+        self.face_cascade = get_cascade('haarcascade_frontalface_default.xml')
+        self.profile_cascade = get_cascade('haarcascade_profileface.xml')
         
         # Cascade cho người
-        self.person_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_fullbody.xml')
-        if self.person_cascade.empty():
-            self.person_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_upperbody.xml')
+        self.person_cascade = get_cascade('haarcascade_fullbody.xml')
+        if self.person_cascade is None:
+            self.person_cascade = get_cascade('haarcascade_upperbody.xml')
         
         # Cascade cho đồ vật (loại bỏ smile vì quá nhạy)
         self.object_cascades = {}
@@ -36,11 +54,25 @@ class ESP32CamCombinedDetector:
         }
         
         for obj_name, (cascade_file, color) in object_info.items():
-            cascade_path = cv2.data.haarcascades + cascade_file
-            cascade = cv2.CascadeClassifier(cascade_path)
-            if not cascade.empty():
+            cascade = get_cascade(cascade_file)
+            if cascade is not None:
                 self.object_cascades[obj_name] = (cascade, color)
         
+        # Chạy tất cả cascade song song trên cùng một ảnh gray mỗi frame
+        jobs = {
+            'frontal': (self.face_cascade, {'scaleFactor': 1.05, 'minNeighbors': 3, 'minSize': (20, 20)}),
+            'profile': (self.profile_cascade, {'scaleFactor': 1.05, 'minNeighbors': 3, 'minSize': (20, 20)}),
+            'person': (self.person_cascade, {'scaleFactor': 1.1, 'minNeighbors': 3, 'minSize': (40, 40)}),
+        }
+        for obj_name, (cascade, color) in self.object_cascades.items():
+            jobs[obj_name] = (cascade, {'scaleFactor': 1.1, 'minNeighbors': 3, 'minSize': (20, 20)})
+        self.cascade_engine = CascadeEngine(jobs)
+        
+        # Bỏ qua cascade khi cảnh đứng yên (tắt mặc định)
+        self.motion_gate = MotionGate(motion_threshold) if motion_threshold else None
+        self.headless = headless
+        self.display = None
+        
         # Buffer để smoothing
         self.face_buffer = deque(maxlen=3)
         self.people_buffer = deque(maxlen=3)
@@ -59,38 +91,32 @@ class ESP32CamCombinedDetector:
         
     def get_frame_from_esp32(self):
         """Lấy frame từ ESP32-CAM"""
-        try:
-            response = requests.get(self.stream_url, timeout=2)
-            if response.status_code == 200:
-                image = Image.open(io.BytesIO(response.content))
-                frame = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
-                
-                # Resize để tối ưu
-                height, width = frame.shape[:2]
-                if width > 640:
-                    scale = 640 / width
-                    new_width = 640
-                    new_height = int(height * scale)
-                    frame = cv2.resize(frame, (new_width, new_height))
-                
-                return frame
-            else:
-                return None
-        except Exception as e:
-            return None
+        return self.frame_source.read()
+
+    def detect_people(self, frame, results=None):
+        """
+        Nhận diện người và mặt
+        
+        Args:
+            frame: Frame BGR (được vẽ bounding boxes lên)
+            results (dict): Kết quả CascadeEngine.run đã có cho frame này
+        """
+        if results is None:
+            results = self.cascade_engine.run(frame, ['frontal', 'profile', 'person'])
+        filtered_faces, people, estimated_people = self.find_people(results)
+        self.draw_people(frame, filtered_faces, people)
+        return len(filtered_faces), estimated_people
     
-    def detect_people(self, frame):
-        """Nhận diện người và mặt"""
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+    def find_people(self, results):
+        """
+        Mặt và người từ kết quả cascade (không vẽ)
         
+        Returns:
+            tuple: (faces, people, estimated_people)
+        """
         # Nhận diện mặt
-        faces_frontal = self.face_cascade.detectMultiScale(
-            gray, scaleFactor=1.05, minNeighbors=3, minSize=(20, 20)
-        )
-        
-        faces_profile = self.profile_cascade.detectMultiScale(
-            gray, scaleFactor=1.05, minNeighbors=3, minSize=(20, 20)
-        )
+        faces_frontal = results.get('frontal', ())
+        faces_profile = results.get('profile', ())
         
         # Kết hợp faces
         all_faces = []
@@ -104,86 +130,111 @@ class ESP32CamCombinedDetector:
         
         # Nhận diện người
         people = []
-        if not self.person_cascade.empty():
-            people = self.person_cascade.detectMultiScale(
-                gray, scaleFactor=1.1, minNeighbors=3, minSize=(40, 40)
-            )
-            people = self._remove_overlapping_detections(people)
+        if 'person' in results:
+            people = self._remove_overlapping_detections(results['person'])
         
         # Logic thông minh: ước tính người từ mặt
         estimated_people = len(people)
         if len(filtered_faces) > 0 and len(people) == 0:
             estimated_people = len(filtered_faces)
         
-        # Vẽ bounding boxes
-        for i, (x, y, w, h) in enumerate(filtered_faces):
+        return filtered_faces, people, estimated_people
+    
+    def draw_people(self, frame, faces, people):
+        """Vẽ bounding boxes của mặt và người"""
+        for i, (x, y, w, h) in enumerate(faces):
             cv2.rectangle(frame, (x, y), (x+w, y+h), (255, 0, 0), 2)
             cv2.putText(frame, f'Face {i+1}', (x, y-10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 0, 0), 2)
         
         for i, (x, y, w, h) in enumerate(people):
             cv2.rectangle(frame, (x, y), (x+w, y+h), (0, 255, 0), 2)
             cv2.putText(frame, f'Person {i+1}', (x, y-10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2)
-        
-        return len(filtered_faces), estimated_people
+        return frame
     
-    def detect_objects(self, frame):
-        """Nhận diện đồ vật"""
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        object_counts = defaultdict(int)
+    def detect_objects(self, frame, results=None):
+        """
+        Nhận diện đồ vật
         
+        Args:
+            frame: Frame BGR (được vẽ bounding boxes lên)
+            results (dict): Kết quả CascadeEngine.run đã có cho frame này
+        """
+        if results is None:
+            results = self.cascade_engine.run(frame, list(self.object_cascades))
+        self.draw_objects(frame, results)
+        return self.count_objects(results)
+    
+    def count_objects(self, results):
+        """Số đồ vật theo loại từ kết quả cascade (không vẽ)"""
+        return {obj_name: len(results[obj_name]) for obj_name in self.object_cascades
+                if len(results.get(obj_name, ()))}
+    
+    def draw_objects(self, frame, results):
+        """Vẽ bounding boxes của đồ vật"""
         for obj_name, (cascade, color) in self.object_cascades.items():
-            objects = cascade.detectMultiScale(
-                gray, scaleFactor=1.1, minNeighbors=3, minSize=(20, 20)
-            )
-            
-            for i, (x, y, w, h) in enumerate(objects):
+            for i, (x, y, w, h) in enumerate(results.get(obj_name, ())):
                 cv2.rectangle(frame, (x, y), (x+w, y+h), color, 2)
                 cv2.putText(frame, f'{obj_name.title()} {i+1}', 
                            (x, y-10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 2)
-                object_counts[obj_name] += 1
-        
-        return dict(object_counts)
+        return frame
     
-    def _remove_overlapping_detections(self, detections, threshold=0.3):
-        """Loại bỏ detections trùng lặp"""
+    def _remove_overlapping_detections(self, detections, threshold=0.3, scores=None):
+        """
+        Loại bỏ detections trùng lặp bằng NMS vector hóa
+        
+        Args:
+            detections: List/array các box (x, y, w, h)
+            threshold: Ngưỡng IoU để coi là trùng
+            scores: Score của từng box (None: ưu tiên theo thứ tự đầu vào)
+            
+        Returns:
+            numpy.ndarray: Các box được giữ
+        """
         if len(detections) <= 1:
             return detections
         
-        filtered = []
-        for i, det1 in enumerate(detections):
-            x1, y1, w1, h1 = det1
-            is_duplicate = False
-            
-            for j, det2 in enumerate(detections):
-                if i == j:
-                    continue
-                    
-                x2, y2, w2, h2 = det2
-                
-                # Tính IoU
-                x_left = max(x1, x2)
-                y_top = max(y1, y2)
-                x_right = min(x1 + w1, x2 + w2)
-                y_bottom = min(y1 + h1, y2 + h2)
-                
-                if x_right < x_left or y_bottom < y_top:
-                    continue
-                
-                intersection = (x_right - x_left) * (y_bottom - y_top)
-                area1 = w1 * h1
-                area2 = w2 * h2
-                union = area1 + area2 - intersection
-                
-                if union > 0:
-                    iou = intersection / union
-                    if iou > threshold:
-                        is_duplicate = True
-                        break
-            
-            if not is_duplicate:
-                filtered.append(det1)
+        boxes = np.asarray(detections).reshape(-1, 4)
+        return boxes[nms(boxes, scores, threshold)]
+    
+    def render_frame(self, frame, snapshot):
+        """
+        Vẽ frame để hiển thị (chạy trên thread hiển thị)
         
-        return filtered
+        Args:
+            frame: Frame đã chạy cascade
+            snapshot: (faces, people, cascade_results, object_counts,
+                (smoothed_faces, smoothed_people, smoothed_objects), fps, show_detailed)
+        """
+        faces, people, cascade_results, object_counts, smoothed, fps, show_detailed = snapshot
+        smoothed_faces, smoothed_people, smoothed_objects = smoothed
+        self.draw_people(frame, faces, people)
+        self.draw_objects(frame, cascade_results)
+        
+        # Hiển thị thông tin
+        cv2.putText(frame, f"Faces: {smoothed_faces}", (10, 30), 
+                   cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 0, 0), 2)
+        cv2.putText(frame, f"People: {smoothed_people}", (10, 60), 
+                   cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
+        cv2.putText(frame, f"Objects: {smoothed_objects}", (10, 90), 
+                   cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 255), 2)
+        
+        if fps > 0:
+            cv2.putText(frame, f"FPS: {fps:.1f}", (10, 120), 
+                       cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2)
+        
+        # Hiển thị chi tiết đồ vật
+        if show_detailed and object_counts:
+            y_offset = 150
+            for obj_name, count in sorted(object_counts.items(), key=lambda x: x[1], reverse=True):
+                cv2.putText(frame, f"{obj_name.title()}: {count}", 
+                           (10, y_offset), 
+                           cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 1)
+                y_offset += 20
+        
+        cv2.putText(frame, f"ESP32: {self.esp32_ip}", 
+                   (10, frame.shape[0] - 10), 
+                   cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1)
+        return frame
     
     def run_detection(self):
         """Chạy detection loop chính"""
@@ -194,105 +245,91 @@ class ESP32CamCombinedDetector:
         print("   - 'r': Reset thống kê")
         print("   - 't': Chuyển đổi hiển thị")
         
-        fps_counter = 0
-        fps_start_time = time.time()
+        frame_rate = FrameRate()
         last_print_time = time.time()
         show_detailed = True
+        cascade_results = None
+        # Vẽ và hiển thị trên thread riêng (hoặc không vẽ gì khi headless)
+        self.display = create_display('ESP32-CAM Combined Detection', self.render_frame,
+                                      headless=self.headless, latency=self.latency)
         
-        while True:
-            current_time = time.time()
-            
-            # Lấy frame
-            frame = self.get_frame_from_esp32()
-            
-            if frame is None:
-                time.sleep(0.1)
-                continue
-            
-            # Nhận diện người
-            face_count, people_count = self.detect_people(frame)
-            
-            # Nhận diện đồ vật
-            object_counts = self.detect_objects(frame)
-            
-            # Cập nhật buffer
-            self.face_buffer.append(face_count)
-            self.people_buffer.append(people_count)
-            self.object_buffer.append(sum(object_counts.values()))
-            
-            # Smoothing
-            smoothed_faces = int(np.mean(self.face_buffer))
-            smoothed_people = int(np.mean(self.people_buffer))
-            smoothed_objects = int(np.mean(self.object_buffer))
-            
-            # Tính FPS
-            fps_counter += 1
-            if fps_counter % 30 == 0:
-                fps = fps_counter / (current_time - fps_start_time)
-                fps_counter = 0
-                fps_start_time = current_time
-            else:
-                fps = 0
-            
-            # Hiển thị thông tin
-            cv2.putText(frame, f"Faces: {smoothed_faces}", (10, 30), 
-                       cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 0, 0), 2)
-            cv2.putText(frame, f"People: {smoothed_people}", (10, 60), 
-                       cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
-            cv2.putText(frame, f"Objects: {smoothed_objects}", (10, 90), 
-                       cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 255), 2)
-            
-            if fps > 0:
-                cv2.putText(frame, f"FPS: {fps:.1f}", (10, 120), 
-                           cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2)
-            
-            # Hiển thị chi tiết đồ vật
-            if show_detailed and object_counts:
-                y_offset = 150
-                for obj_name, count in sorted(object_counts.items(), key=lambda x: x[1], reverse=True):
-                    cv2.putText(frame, f"{obj_name.title()}: {count}", 
-                               (10, y_offset), 
-                               cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 1)
-                    y_offset += 20
-            
-            cv2.putText(frame, f"ESP32: {self.esp32_ip}", 
-                       (10, frame.shape[0] - 10), 
-                       cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1)
-            
-            # Hiển thị frame
-            cv2.imshow('ESP32-CAM Combined Detection', frame)
-            
-            # Cập nhật thống kê
-            self.stats['faces'] += smoothed_faces
-            self.stats['people'] += smoothed_people
-            self.stats['total_frames'] += 1
-            
-            for obj_name, count in object_counts.items():
-                self.stats['objects'][obj_name] += count
-            
-            # In thông tin định kỳ
-            if current_time - last_print_time > 5:
-                print(f"📊 Detections: Faces={smoothed_faces}, People={smoothed_people}, Objects={smoothed_objects}")
-                if object_counts:
-                    print(f"   Objects: {dict(list(sorted(object_counts.items(), key=lambda x: x[1], reverse=True))[:3])}")
-                last_print_time = current_time
-            
-            # Xử lý phím
-            key = cv2.waitKey(1) & 0xFF
-            if key == ord('q'):
-                break
-            elif key == ord('s'):
-                filename = f"esp32_combined_{int(time.time())}.jpg"
-                cv2.imwrite(filename, frame)
-                print(f"📸 Đã chụp ảnh: {filename}")
-            elif key == ord('r'):
-                self.stats = {'faces': 0, 'people': 0, 'objects': defaultdict(int), 'total_frames': 0}
-                print("🔄 Đã reset thống kê")
-            elif key == ord('t'):
-                show_detailed = not show_detailed
-                print(f"🔄 Hiển thị chi tiết: {'Bật' if show_detailed else 'Tắt'}")
-        
-        cv2.destroyAllWindows()
+        try:
+            while True:
+                current_time = time.time()
+                
+                # Lấy frame
+                frame = self.get_frame_from_esp32()
+                
+                if frame is None:
+                    time.sleep(0.1)
+                    continue
+                
+                # Chạy tất cả cascade một lần cho frame (hoặc dùng lại kết quả khi cảnh không đổi)
+                if self.motion_gate is None or self.motion_gate.check(frame) or cascade_results is None:
+                    start = time.perf_counter()
+                    cascade_results = self.cascade_engine.run(frame)
+                    self.latency.lap('forward', start)
+                
+                # Nhận diện người và đồ vật: NMS và đếm (vẽ trên thread hiển thị)
+                start = time.perf_counter()
+                faces, people, people_count = self.find_people(cascade_results)
+                object_counts = self.count_objects(cascade_results)
+                self.latency.lap('postprocess', start)
+                
+                # Cập nhật buffer
+                self.face_buffer.append(len(faces))
+                self.people_buffer.append(people_count)
+                self.object_buffer.append(sum(object_counts.values()))
+                
+                # Smoothing
+                smoothed_faces = int(np.mean(self.face_buffer))
+                smoothed_people = int(np.mean(self.people_buffer))
+                smoothed_objects = int(np.mean(self.object_buffer))
+                
+                # FPS theo 30 frame gần nhất
+                fps = frame_rate.tick()
+                
+                # Vẽ trên thread hiển thị từ snapshot của frame này
+                self.display.show(frame, (faces, people, cascade_results, object_counts,
+                                          (smoothed_faces, smoothed_people, smoothed_objects), fps, show_detailed))
+                
+                # Cập nhật thống kê
+                self.stats['faces'] += smoothed_faces
+                self.stats['people'] += smoothed_people
+                self.stats['total_frames'] += 1
+                
+                for obj_name, count in object_counts.items():
+                    self.stats['objects'][obj_name] += count
+                
+                # In thông tin định kỳ
+                if current_time - last_print_time > 5:
+                    print(f"📊 Detections: Faces={smoothed_faces}, People={smoothed_people}, Objects={smoothed_objects}")
+                    if object_counts:
+                        print(f"   Objects: {dict(list(sorted(object_counts.items(), key=lambda x: x[1], reverse=True))[:3])}")
+                    last_print_time = current_time
+                
+                # Xử lý phím
+                key = self.display.poll_key()
+                if key == ord('q'):
+                    break
+                elif key == ord('s') and self.display.last_image is not None:
+                    filename = f"esp32_combined_{int(time.time())}.jpg"
+                    cv2.imwrite(filename, self.display.last_image)
+                    print(f"📸 Đã chụp ảnh: {filename}")
+                elif key == ord('r'):
+                    self.stats = {'faces': 0, 'people': 0, 'objects': defaultdict(int), 'total_frames': 0}
+                    self.latency.reset()
+                    print("🔄 Đã reset thống kê")
+                elif key == ord('t'):
+                    show_detailed = not show_detailed
+                    print(f"🔄 Hiển thị chi tiết: {'Bật' if show_detailed else 'Tắt'}")
+        except KeyboardInterrupt:
+            # Cách thoát duy nhất khi headless
+            pass
+        
+        self.frame_source.close()
+        self.cascade_engine.close()
+        self.display.close()
         self._print_final_stats()
     
     def _print_final_stats(self):
@@ -302,6 +339,15 @@ class ESP32CamCombinedDetector:
         print(f"   - Tổng faces: {self.stats['faces']}")
         print(f"   - Tổng people: {self.stats['people']}")
         print(f"   - Tổng objects: {sum(self.stats['objects'].values())}")
+        capture_stats = self.frame_source.stats()
+        if capture_stats:
+            print(f"   - Capture: {capture_stats['captured']} frames, "
+                  f"dropped {capture_stats['dropped']}, errors {capture_stats['errors']}, "
+                  f"trùng (bỏ qua) {capture_stats['duplicates']}")
+        self.cascade_engine.print_timings()
+        self.latency.print_stats()
+        if self.motion_gate is not None:
+            self.motion_gate.print_stats(sum(t['avg_ms'] for t in self.cascade_engine.timings().values()))
         
         if self.stats['objects']:
             print("   - Top objects:")
@@ -310,5 +356,5 @@ class ESP32CamCombinedDetector:
                 print(f"     {obj_name.title()}: {count}")
 
 if __name__ == "__main__":
-    detector = ESP32CamCombinedDetector("192.168.1.14")
+    detector = ESP32CamCombinedDetector("192.168.1.14", headless="--headless" in sys.argv)
     detector.run_detection()
@@ -1,26 +1,46 @@
 import cv2
 import numpy as np
-import requests
-from PIL import Image
-import io
+import sys
 import time
 
+from esp32_display import create_display
+from esp32_dnn_config import load_tuned_net
+from esp32_engines import INT8_SSD_MODEL, OnnxSSDEngine
+from esp32_frame_source import CaptureFrameSource, LatestFrameGrabber
+from esp32_inference import InferencePipeline, SSDPreprocessor
+from esp32_latency import StageLatency
+from esp32_postprocess import postprocess_ssd
+
 class ESP32CamDetector:
-    def __init__(self, esp32_ip="192.168.1.14"):
+    def __init__(self, esp32_ip="192.168.1.14", frame_source=None, inference_depth=2, use_int8=False,
+                 headless=False):
         """
         Khởi tạo detector cho ESP32-CAM
         
         Args:
             esp32_ip (str): IP address của ESP32-CAM
+            frame_source (FrameSource): Nguồn frame (mặc định poll /capture trên thread riêng)
+            inference_depth (int): Số frame inference cùng lúc trong run_detection
+                (mỗi frame thêm một bản sao net; 1 = đồng bộ như trước)
+            use_int8 (bool): Dùng model INT8 (esp32_quantize.py) qua ONNX Runtime thay cho Caffe FP32
+            headless (bool): Không vẽ và không mở cửa sổ (thoát bằng Ctrl+C)
         """
         self.esp32_ip = esp32_ip
         self.stream_url = f"http://{esp32_ip}/capture"
+        self.frame_source = frame_source or LatestFrameGrabber(
+            CaptureFrameSource(self.stream_url, timeout=5, max_width=None, verbose=True)
+        )
+        self.stream_url = self.frame_source.url
+        # Độ trễ theo công đoạn (fetch/decode đo trong frame source)
+        self.latency = StageLatency(esp32_ip)
+        self.frame_source.latency = self.latency
         
         # Khởi tạo MobileNet SSD model cho nhận diện
-        self.net = cv2.dnn.readNetFromCaffe(
-            'MobileNetSSD_deploy.prototxt.txt',
-            'MobileNetSSD_deploy.caffemodel'
-        )
+        self.use_int8 = use_int8
+        self.inference_depth = inference_depth
+        self.net = self._load_net()
+        self.preprocess = SSDPreprocessor()
+        self.headless = headless
         
         # Danh sách các class có thể nhận diện
         self.classes = [
@@ -43,6 +63,16 @@ class ESP32CamDetector:
         # Màu sắc cho bounding box
         self.colors = np.random.uniform(0, 255, size=(len(self.classes), 3))
         
+    def _load_net(self):
+        """Đọc MobileNet SSD (Caffe) với backend/thread đã tune cho máy này, hoặc model INT8"""
+        if self.use_int8:
+            # Mỗi replica của InferencePipeline một phần số core, không spin
+            return OnnxSSDEngine(INT8_SSD_MODEL, replicas=self.inference_depth)
+        return load_tuned_net(
+            'MobileNetSSD_deploy.prototxt.txt',
+            'MobileNetSSD_deploy.caffemodel'
+        )
+    
     def get_frame_from_esp32(self):
         """
         Lấy frame từ ESP32-CAM
@@ -50,20 +80,7 @@ class ESP32CamDetector:
         Returns:
             numpy.ndarray: Frame image hoặc None nếu lỗi
         """
-        try:
-            response = requests.get(self.stream_url, timeout=5)
-            if response.status_code == 200:
-                # Chuyển đổi bytes thành image
-                image = Image.open(io.BytesIO(response.content))
-                # Chuyển đổi PIL Image thành OpenCV format
-                frame = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
-                return frame
-            else:
-                print(f"Lỗi kết nối ESP32-CAM: {response.status_code}")
-                return None
-        except Exception as e:
-            print(f"Lỗi khi lấy frame: {e}")
-            return None
+        return self.frame_source.read()
     
     def detect_objects(self, frame):
         """
@@ -75,103 +92,130 @@ class ESP32CamDetector:
         Returns:
             tuple: (frame_with_detections, detections_info)
         """
-        height, width = frame.shape[:2]
-        
-        # Chuẩn bị blob cho MobileNet SSD
-        blob = cv2.dnn.blobFromImage(
-            frame, 0.007843, (300, 300), 127.5
-        )
-        
-        # Đưa blob vào network
-        self.net.setInput(blob)
+        # Đưa blob cho MobileNet SSD vào network
+        self.net.setInput(self.preprocess(frame))
         detections = self.net.forward()
         
-        detections_info = []
+        return self.draw_detections(frame, detections)
+    
+    def draw_detections(self, frame, detections):
+        """
+        Lọc output của MobileNet SSD và vẽ lên frame
         
-        # Xử lý kết quả detection
-        for i in range(detections.shape[2]):
-            confidence = detections[0, 0, i, 2]
+        Args:
+            frame: Frame đã chạy inference
+            detections: Output của net.forward() cho frame này
             
-            # Chỉ hiển thị detections với confidence > 0.5
-            if confidence > 0.5:
-                class_id = int(detections[0, 0, i, 1])
-                
-                # Tính toán bounding box
-                x_left = int(detections[0, 0, i, 3] * width)
-                y_top = int(detections[0, 0, i, 4] * height)
-                x_right = int(detections[0, 0, i, 5] * width)
-                y_bottom = int(detections[0, 0, i, 6] * height)
-                
-                # Vẽ bounding box
-                color = self.colors[class_id]
-                cv2.rectangle(frame, (x_left, y_top), (x_right, y_bottom), color, 2)
-                
-                # Vẽ label
-                label = f"{self.classes[class_id]}: {confidence:.2f}"
-                label_size = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, 0.5, 2)[0]
-                
-                cv2.rectangle(
-                    frame, 
-                    (x_left, y_top - label_size[1] - 10),
-                    (x_left + label_size[0], y_top),
-                    color, -1
-                )
-                
-                cv2.putText(
-                    frame, label,
-                    (x_left, y_top - 5),
-                    cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 2
-                )
-                
-                detections_info.append({
-                    'class': self.classes[class_id],
-                    'confidence': confidence,
-                    'bbox': (x_left, y_top, x_right, y_bottom)
-                })
+        Returns:
+            tuple: (frame_with_detections, detections_info)
+        """
+        results = self._postprocess(frame, detections)
+        return self.draw_boxes(frame, results), self._detections_info(results)
+    
+    def _postprocess(self, frame, detections):
+        """Xử lý kết quả detection (vector hóa), chỉ giữ confidence > 0.5"""
+        start = time.perf_counter()
+        height, width = frame.shape[:2]
+        results = postprocess_ssd(detections, width, height, 0.5,
+                                  num_classes=len(self.classes), clip=False)
+        self.latency.lap('postprocess', start)
+        return results
+    
+    def _detections_info(self, results):
+        return [{
+            'class': self.classes[class_id],
+            'confidence': confidence,
+            'bbox': (x_left, y_top, x_right, y_bottom)
+        } for class_id, confidence, x_left, y_top, x_right, y_bottom in results.tolist()]
+    
+    def draw_boxes(self, frame, results):
+        """Vẽ bounding box và label của từng detection lên frame"""
+        for class_id, confidence, x_left, y_top, x_right, y_bottom in results.tolist():
+            # Vẽ bounding box
+            color = self.colors[class_id]
+            cv2.rectangle(frame, (x_left, y_top), (x_right, y_bottom), color, 2)
+            
+            # Vẽ label
+            label = f"{self.classes[class_id]}: {confidence:.2f}"
+            label_size = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, 0.5, 2)[0]
+            
+            cv2.rectangle(
+                frame, 
+                (x_left, y_top - label_size[1] - 10),
+                (x_left + label_size[0], y_top),
+                color, -1
+            )
+            
+            cv2.putText(
+                frame, label,
+                (x_left, y_top - 5),
+                cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 2
+            )
+        return frame
+    
+    def render_frame(self, frame, results):
+        """Vẽ frame để hiển thị (chạy trên thread hiển thị)"""
+        self.draw_boxes(frame, results)
         
-        return frame, detections_info
+        # Hiển thị số lượng detections
+        cv2.putText(
+            frame,
+            f"Detections: {len(results)}",
+            (10, 30),
+            cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2
+        )
+        return frame
     
     def run_detection(self):
         """
         Chạy detection loop chính
         """
         print("Bắt đầu nhận diện từ ESP32-CAM...")
-        print("Nhấn 'q' để thoát")
+        print("Nhấn 'q' để thoát" if not self.headless else "Nhấn Ctrl+C để thoát")
         
-        while True:
-            # Lấy frame từ ESP32-CAM
-            frame = self.get_frame_from_esp32()
-            
-            if frame is None:
-                print("Không thể lấy frame từ ESP32-CAM")
-                time.sleep(1)
-                continue
-            
-            # Nhận diện objects
-            frame_with_detections, detections = self.detect_objects(frame)
-            
-            # Hiển thị số lượng detections
-            cv2.putText(
-                frame_with_detections,
-                f"Detections: {len(detections)}",
-                (10, 30),
-                cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2
-            )
-            
-            # Hiển thị frame
-            cv2.imshow('ESP32-CAM Object Detection', frame_with_detections)
-            
-            # In thông tin detections
-            if detections:
-                print(f"\nDetections tại {time.strftime('%H:%M:%S')}:")
-                for det in detections:
-                    print(f"  - {det['class']}: {det['confidence']:.2f}")
-            
-            # Kiểm tra phím thoát
-            if cv2.waitKey(1) & 0xFF == ord('q'):
-                break
+        # Mỗi request đang xử lý dùng một bản sao net trên worker thread riêng
+        nets = [self.net] + [self._load_net() for _ in range(self.inference_depth - 1)]
+        inference = InferencePipeline(nets, depth=self.inference_depth, latency=self.latency)
+        # Vẽ và hiển thị trên thread riêng (hoặc không vẽ gì khi headless)
+        display = create_display('ESP32-CAM Object Detection', self.render_frame, headless=self.headless,
+                                 latency=self.latency)
         
-        cv2.destroyAllWindows()
+        try:
+            while True:
+                # Lấy frame từ ESP32-CAM
+                frame = self.get_frame_from_esp32()
+                
+                if frame is None:
+                    print("Không thể lấy frame từ ESP32-CAM")
+                    time.sleep(1)
+                    continue
+                
+                # Nhận diện objects (kết quả trả về theo thứ tự frame, trễ tối đa depth-1 frame)
+                result = inference.process(frame)
+                if result is None:
+                    continue
+                results = self._postprocess(result.frame, result.output)
+                detections = self._detections_info(results)
+                
+                # Hiển thị frame (vẽ trên thread hiển thị)
+                display.show(result.frame, results)
+                
+                # In thông tin detections
+                if detections:
+                    print(f"\nDetections tại {time.strftime('%H:%M:%S')}:")
+                    for det in detections:
+                        print(f"  - {det['class']}: {det['confidence']:.2f}")
+                
+                # Kiểm tra phím thoát
+                if display.poll_key() == ord('q'):
+                    break
+        except KeyboardInterrupt:
+            pass
+        
+        self.frame_source.close()
+        inference.close()
+        display.close()
+        self.latency.print_stats(indent="")
         print("Đã thoát chương trình")
 
 def download_model_files():
@@ -203,12 +247,18 @@ if __name__ == "__main__":
     # Kiểm tra và tải model files nếu cần
     import os
     
-    if not os.path.exists("MobileNetSSD_deploy.prototxt.txt") or not os.path.exists("MobileNetSSD_deploy.caffemodel"):
+    use_int8 = "--int8" in sys.argv
+    headless = "--headless" in sys.argv
+    if use_int8:
+        if not os.path.exists(INT8_SSD_MODEL):
+            print(f"Không tìm thấy {INT8_SSD_MODEL}. Chạy esp32_quantize.py trước.")
+            exit(1)
+    elif not os.path.exists("MobileNetSSD_deploy.prototxt.txt") or not os.path.exists("MobileNetSSD_deploy.caffemodel"):
         print("Model files chưa tồn tại. Đang tải xuống...")
         if not download_model_files():
             print("Không thể tải model files. Vui lòng kiểm tra kết nối internet.")
             exit(1)
     
     # Khởi tạo và chạy detector
-    detector = ESP32CamDetector("192.168.1.14")
+    detector = ESP32CamDetector("192.168.1.14", use_int8=use_int8, headless=headless)
     detector.run_detection()
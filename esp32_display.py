@@ -0,0 +1,191 @@
+"""
+Hiển thị kết quả tách khỏi vòng inference
+
+Vòng inference chỉ đưa (frame, snapshot detections) cho display rồi đi tiếp;
+việc vẽ box/label, cv2.imshow và cv2.waitKey chạy trên thread hiển thị riêng,
+tối đa bằng tần số làm tươi của màn hình. Frame mới đến khi frame trước chưa
+kịp vẽ thì frame trước bị bỏ (chỉ vẽ snapshot mới nhất), nên thời gian vẽ không
+bao giờ cộng vào độ trễ của detector.
+
+Chế độ headless (HeadlessDisplay) không vẽ và không mở cửa sổ nào.
+
+Lưu ý: mọi lời gọi HighGUI (namedWindow/imshow/waitKey/destroyAllWindows) đều
+nằm trên thread hiển thị; backend GTK/Win32 chấp nhận việc này, Cocoa (macOS)
+yêu cầu main thread.
+"""
+import re
+import subprocess
+import sys
+import threading
+import time
+
+import cv2
+
+
+def detect_refresh_rate(default=60.0):
+    """
+    Tần số làm tươi của màn hình chính (Hz)
+
+    Đọc qua GetDeviceCaps(VREFRESH) trên Windows hoặc `xrandr --current` trên
+    Linux/X11; không đọc được thì trả default.
+    """
+    try:
+        if sys.platform == 'win32':
+            import ctypes
+            user32, gdi32 = ctypes.windll.user32, ctypes.windll.gdi32
+            dc = user32.GetDC(0)
+            rate = gdi32.GetDeviceCaps(dc, 116)  # VREFRESH
+            user32.ReleaseDC(0, dc)
+            return float(rate) if rate > 1 else default
+        output = subprocess.run(['xrandr', '--current'], capture_output=True, text=True, timeout=2).stdout
+        # Mode đang dùng được đánh dấu '*', ví dụ "1920x1080  60.00*+  50.00"
+        match = re.search(r'(\d+(?:\.\d+)?)\*', output)
+        return float(match.group(1)) if match else default
+    except Exception:
+        return default
+
+
+class HeadlessDisplay:
+    """Không vẽ, không cửa sổ (server không có màn hình)"""
+
+    headless = True
+    last_image = None
+
+    def show(self, frame, snapshot=None):
+        """Bỏ qua frame"""
+
+    def poll_key(self):
+        """Không có bàn phím: luôn -1"""
+        return -1
+
+    def close(self):
+        """Không có gì để giải phóng"""
+
+    def stats(self):
+        return {}
+
+
+class DisplayThread:
+    """
+    Vẽ và hiển thị snapshot mới nhất trên thread riêng, tối đa refresh_rate lần/giây
+
+    render(frame, snapshot) được gọi trên thread hiển thị và trả về ảnh cần
+    hiển thị (có thể vẽ thẳng lên frame: vòng inference không dùng lại frame
+    sau khi show()).
+    """
+
+    headless = False
+
+    def __init__(self, window_name, render, refresh_rate=None, latency=None):
+        """
+        Args:
+            window_name (str): Tên cửa sổ
+            render: Hàm (frame, snapshot) -> ảnh BGR
+            refresh_rate: Số lần vẽ tối đa mỗi giây (mặc định theo màn hình, xem detect_refresh_rate)
+            latency (StageLatency): Ghi thời gian vẽ + imshow của mỗi frame (công đoạn draw)
+        """
+        self.window_name = window_name
+        self.render = render
+        self.latency = latency
+        self.refresh_rate = refresh_rate or detect_refresh_rate()
+        self.last_image = None
+
+        self._lock = threading.Lock()
+        self._item = None
+        self._seq = 0
+        self._rendered_seq = 0
+        self._key = -1
+        self._stopped = False
+
+        self.rendered = 0
+        self.skipped = 0
+        self.render_s = 0.0
+
+        self._thread = threading.Thread(target=self._run, name="esp32-display", daemon=True)
+        self._thread.start()
+
+    def show(self, frame, snapshot=None):
+        """Đưa frame và snapshot detections cho thread hiển thị (không chặn, không vẽ)"""
+        with self._lock:
+            if self._seq > self._rendered_seq:
+                # Snapshot trước chưa kịp vẽ đã bị thay
+                self.skipped += 1
+            self._item = (frame, snapshot)
+            self._seq += 1
+
+    def poll_key(self):
+        """
+        Phím bấm gần nhất trong cửa sổ (đọc xong thì xóa)
+
+        Returns:
+            int: Mã phím (& 0xFF) hoặc -1 nếu không có
+        """
+        with self._lock:
+            key, self._key = self._key, -1
+        return key
+
+    def _run(self):
+        cv2.namedWindow(self.window_name, cv2.WINDOW_NORMAL)
+        interval = 1.0 / self.refresh_rate
+        next_tick = time.perf_counter()
+        while not self._stopped:
+            item = None
+            with self._lock:
+                if self._seq > self._rendered_seq:
+                    item = self._item
+                    self._rendered_seq = self._seq
+
+            if item is not None:
+                start = time.perf_counter()
+                self.last_image = self.render(*item)
+                cv2.imshow(self.window_name, self.last_image)
+                elapsed = time.perf_counter() - start
+                self.render_s += elapsed
+                if self.latency is not None:
+                    self.latency.record('draw', elapsed)
+                self.rendered += 1
+
+            # waitKey vừa xử lý sự kiện cửa sổ vừa chờ tới lần vẽ kế tiếp
+            next_tick += interval
+            wait_ms = max(1, int((next_tick - time.perf_counter()) * 1000))
+            if wait_ms == 1:
+                next_tick = time.perf_counter()
+            key = cv2.waitKey(wait_ms)
+            if key != -1:
+                with self._lock:
+                    self._key = key & 0xFF
+        cv2.destroyWindow(self.window_name)
+        cv2.waitKey(1)
+
+    def close(self):
+        self._stopped = True
+        self._thread.join(timeout=2)
+
+    def stats(self):
+        """
+        Returns:
+            dict: {'rendered', 'skipped', 'render_avg_ms', 'refresh_rate'}
+        """
+        return {
+            'rendered': self.rendered,
+            'skipped': self.skipped,
+            'render_avg_ms': self.render_s / self.rendered * 1000 if self.rendered else 0.0,
+            'refresh_rate': self.refresh_rate,
+        }
+
+
+def create_display(window_name, render, headless=False, refresh_rate=None, latency=None):
+    """
+    Args:
+        window_name (str): Tên cửa sổ
+        render: Hàm (frame, snapshot) -> ảnh BGR, chạy trên thread hiển thị
+        headless (bool): Không vẽ, không mở cửa sổ
+        refresh_rate: Giới hạn số lần vẽ mỗi giây (mặc định theo màn hình)
+        latency (StageLatency): Ghi thời gian vẽ (công đoạn draw)
+
+    Returns:
+        DisplayThread hoặc HeadlessDisplay
+    """
+    if headless:
+        return HeadlessDisplay()
+    return DisplayThread(window_name, render, refresh_rate, latency)
@@ -0,0 +1,230 @@
+"""
+Tự chọn backend/target và số thread OpenCV DNN cho MobileNet SSD
+
+Lần chạy đầu tiên trên một máy, autotune() đo thời gian forward của từng cặp
+backend/target chạy trên CPU với các số thread khác nhau trên ảnh mẫu, rồi lưu
+cấu hình nhanh nhất vào file cache (theo CPU model, phiên bản OpenCV và model).
+Các lần sau cấu hình được đọc lại từ cache.
+
+Chạy từ thư mục gốc của repo để tune lại và xem bảng kết quả:
+    python esp32_dnn_config.py --force
+"""
+import argparse
+import glob
+import json
+import os
+import platform
+import time
+
+import cv2
+import numpy as np
+
+from esp32_inference import SSDPreprocessor
+
+DEFAULT_CACHE = os.path.join(os.path.expanduser('~'), '.cache', 'esp32_cam', 'dnn_config.json')
+
+# Cấu hình khi chưa tune được (giống hành vi mặc định của OpenCV)
+DEFAULT_CONFIG = {
+    'backend': cv2.dnn.DNN_BACKEND_OPENCV,
+    'target': cv2.dnn.DNN_TARGET_CPU,
+    'threads': None,
+}
+
+_CPU_TARGETS = {cv2.dnn.DNN_TARGET_CPU}
+if hasattr(cv2.dnn, 'DNN_TARGET_CPU_FP16'):
+    _CPU_TARGETS.add(cv2.dnn.DNN_TARGET_CPU_FP16)
+
+_BACKEND_NAMES = {
+    cv2.dnn.DNN_BACKEND_DEFAULT: 'default',
+    cv2.dnn.DNN_BACKEND_OPENCV: 'opencv',
+    cv2.dnn.DNN_BACKEND_INFERENCE_ENGINE: 'openvino',
+}
+
+
+def cpu_model():
+    """Tên CPU (model name trong /proc/cpuinfo nếu có)"""
+    try:
+        with open('/proc/cpuinfo') as f:
+            for line in f:
+                if line.startswith('model name'):
+                    return line.split(':', 1)[1].strip()
+    except OSError:
+        pass
+    return platform.processor() or platform.machine()
+
+
+def cache_key(model_path):
+    """Khóa cache: CPU model, số core, phiên bản OpenCV và tên model"""
+    return f"{cpu_model()}|{os.cpu_count()}|opencv-{cv2.__version__}|{os.path.basename(model_path)}"
+
+
+def cpu_backends():
+    """Các cặp (backend, target) chạy trên CPU mà bản OpenCV này hỗ trợ"""
+    pairs = []
+    for backend in _BACKEND_NAMES:
+        if backend == cv2.dnn.DNN_BACKEND_DEFAULT:
+            continue
+        for target in cv2.dnn.getAvailableTargets(backend):
+            if int(target) in _CPU_TARGETS:
+                pairs.append((backend, int(target)))
+    return pairs or [(DEFAULT_CONFIG['backend'], DEFAULT_CONFIG['target'])]
+
+
+def thread_candidates():
+    """Số thread cần thử: 1, 2, 4, ... và số core"""
+    cores = os.cpu_count() or 1
+    candidates = {cores}
+    threads = 1
+    while threads < cores:
+        candidates.add(threads)
+        threads *= 2
+    return sorted(candidates)
+
+
+def describe(config):
+    """Mô tả ngắn một cấu hình, ví dụ 'opencv/cpu, 4 thread(s)'"""
+    backend = _BACKEND_NAMES.get(config['backend'], str(config['backend']))
+    target = 'cpu_fp16' if config['target'] != cv2.dnn.DNN_TARGET_CPU else 'cpu'
+    threads = config.get('threads') or cv2.getNumThreads()
+    return f"{backend}/{target}, {threads} thread(s)"
+
+
+def apply_config(net, config):
+    """Áp dụng cấu hình cho net (và số thread OpenCV của process)"""
+    net.setPreferableBackend(config['backend'])
+    net.setPreferableTarget(config['target'])
+    if config.get('threads'):
+        cv2.setNumThreads(config['threads'])
+
+
+def _load_cache(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_cache(path, cache):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(cache, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def _sample_blobs(count=4):
+    """Blob từ ảnh ESP32 đã chụp trong repo (hoặc ảnh ngẫu nhiên)"""
+    root = os.path.dirname(os.path.abspath(__file__))
+    paths = sorted(glob.glob(os.path.join(root, 'esp32_*.jpg')))[:count]
+    frames = [frame for frame in (cv2.imread(path) for path in paths) if frame is not None]
+    if not frames:
+        rng = np.random.default_rng(0)
+        frames = [rng.integers(0, 255, (480, 640, 3), dtype=np.uint8) for _ in range(count)]
+    preprocess = SSDPreprocessor()
+    return [preprocess(frame).copy() for frame in frames]
+
+
+def _time_config(prototxt, caffemodel, config, blobs, repeat):
+    """Thời gian forward trung bình (ms) của một cấu hình, None nếu không chạy được"""
+    try:
+        net = cv2.dnn.readNetFromCaffe(prototxt, caffemodel)
+        apply_config(net, config)
+        # Warm-up: lần forward đầu khởi tạo backend
+        net.setInput(blobs[0])
+        net.forward()
+        start = time.perf_counter()
+        for i in range(repeat):
+            net.setInput(blobs[i % len(blobs)])
+            net.forward()
+        return (time.perf_counter() - start) / repeat * 1000
+    except cv2.error:
+        return None
+
+
+def autotune(prototxt="MobileNetSSD_deploy.prototxt", caffemodel="MobileNetSSD_deploy.caffemodel",
+             cache_path=DEFAULT_CACHE, force=False, repeat=10, verbose=True):
+    """
+    Lấy cấu hình DNN nhanh nhất cho máy này (từ cache hoặc đo mới)
+
+    Args:
+        prototxt: File prototxt của model
+        caffemodel: File trọng số
+        cache_path: File JSON lưu kết quả tune
+        force (bool): Bỏ qua cache và đo lại
+        repeat: Số lần forward đo cho mỗi cấu hình
+        verbose (bool): In bảng kết quả khi đo
+
+    Returns:
+        dict: {'backend', 'target', 'threads', 'ms'}
+    """
+    key = cache_key(caffemodel)
+    cache = _load_cache(cache_path)
+    if not force and key in cache:
+        return cache[key]
+
+    default_threads = cv2.getNumThreads()
+    blobs = _sample_blobs()
+    results = []
+    if verbose:
+        print(f"🔄 Đang tune OpenCV DNN cho {cpu_model()} (OpenCV {cv2.__version__})...")
+    for backend, target in cpu_backends():
+        for threads in thread_candidates():
+            config = {'backend': backend, 'target': target, 'threads': threads}
+            elapsed = _time_config(prototxt, caffemodel, config, blobs, repeat)
+            if verbose:
+                status = f"{elapsed:.1f} ms" if elapsed is not None else "không chạy được"
+                print(f"   - {describe(config)}: {status}")
+            if elapsed is not None:
+                results.append((elapsed, config))
+    cv2.setNumThreads(default_threads)
+
+    if not results:
+        return dict(DEFAULT_CONFIG)
+
+    elapsed, best = min(results, key=lambda item: item[0])
+    best = dict(best, ms=elapsed, tuned_at=time.strftime('%Y-%m-%d %H:%M:%S'))
+    cache[key] = best
+    try:
+        _save_cache(cache_path, cache)
+    except OSError as e:
+        if verbose:
+            print(f"⚠️ Không ghi được cache DNN: {e}")
+    if verbose:
+        print(f"✓ Chọn {describe(best)} ({elapsed:.1f} ms/frame)")
+    return best
+
+
+def load_tuned_net(prototxt="MobileNetSSD_deploy.prototxt", caffemodel="MobileNetSSD_deploy.caffemodel",
+                   cache_path=DEFAULT_CACHE, **kwargs):
+    """
+    Đọc model Caffe và áp dụng cấu hình backend/target/thread đã tune
+
+    Args:
+        prototxt: File prototxt của model
+        caffemodel: File trọng số
+        cache_path: File JSON lưu kết quả tune
+        **kwargs: Tham số thêm cho autotune()
+
+    Returns:
+        cv2.dnn.Net
+    """
+    net = cv2.dnn.readNetFromCaffe(prototxt, caffemodel)
+    apply_config(net, autotune(prototxt, caffemodel, cache_path=cache_path, **kwargs))
+    return net
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--prototxt', default="MobileNetSSD_deploy.prototxt")
+    parser.add_argument('--model', default="MobileNetSSD_deploy.caffemodel")
+    parser.add_argument('--cache', default=DEFAULT_CACHE)
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--force', action='store_true', help='Bỏ qua cache và đo lại')
+    args = parser.parse_args()
+
+    config = autotune(args.prototxt, args.model, cache_path=args.cache,
+                      force=args.force, repeat=args.repeat)
+    print(f"📋 {cache_key(args.model)}: {describe(config)}")
@@ -0,0 +1,420 @@
+"""
+Engine inference dùng chung cho các detector: cùng input (frame BGR) và cùng
+output (mảng DETECTION_DTYPE / list dict {'class', 'confidence', 'bbox'})
+
+    OpenCVSSDEngine    MobileNet SSD Caffe qua cv2.dnn (cấu hình đã tune)
+    OnnxSSDEngine      MobileNet SSD đã xuất ONNX (esp32_onnx_export.py) qua ONNX Runtime
+    OnnxYoloEngine     YOLOv8 đã xuất ONNX qua ONNX Runtime
+    UltralyticsEngine  YOLOv8 .pt qua ultralytics
+
+Các engine ONNX Runtime bind input/output vào buffer cấp phát sẵn (IO binding)
+nên mỗi frame không cấp phát tensor mới. Cần: pip install onnxruntime
+"""
+import abc
+import ast
+import os
+import time
+
+import cv2
+import numpy as np
+
+from esp32_dnn_config import load_tuned_net
+from esp32_inference import SSDPreprocessor
+from esp32_postprocess import DETECTION_DTYPE, nms, postprocess_ssd, to_detection_dicts
+
+try:
+    import onnxruntime as ort
+except ImportError:
+    ort = None
+
+# Model INT8 do esp32_quantize.py ghi ra, detector chọn bằng cờ use_int8
+INT8_SSD_MODEL = "MobileNetSSD_deploy.int8.onnx"
+
+VOC_CLASSES = ["background", "aeroplane", "bicycle", "bird", "boat",
+               "bottle", "bus", "car", "cat", "chair", "cow", "diningtable",
+               "dog", "horse", "motorbike", "person", "pottedplant", "sheep",
+               "sofa", "train", "tvmonitor"]
+
+
+def session_options(intra_op_threads=None, inter_op_threads=1, allow_spinning=None, replicas=1):
+    """
+    SessionOptions cho inference từng frame trên CPU
+
+    Args:
+        intra_op_threads: Số thread trong một operator (mặc định số core chia cho replicas)
+        inter_op_threads: Số thread chạy song song các nhánh của graph
+        allow_spinning (bool): Thread chờ việc bằng spin (độ trễ thấp hơn, tốn CPU hơn),
+            mặc định chỉ bật khi replicas == 1
+        replicas: Số session chạy song song trong cùng tiến trình (ví dụ depth của
+            InferencePipeline), để các session không tranh nhau core
+    """
+    if ort is None:
+        raise ImportError("Cần cài onnxruntime: pip install onnxruntime")
+    if allow_spinning is None:
+        # Thread spin của session này chiếm core mà replica khác đang cần
+        allow_spinning = replicas <= 1
+    options = ort.SessionOptions()
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+    options.intra_op_num_threads = intra_op_threads or max(1, (os.cpu_count() or 1) // max(1, replicas))
+    options.inter_op_num_threads = inter_op_threads
+    options.add_session_config_entry('session.intra_op.allow_spinning', '1' if allow_spinning else '0')
+    return options
+
+
+class DetectionEngine(abc.ABC):
+    """Giao diện chung: infer() trả DETECTION_DTYPE (pixel, x1 y1 x2 y2)"""
+
+    name = "engine"
+    # StageLatency nhận thời gian preprocess/forward/postprocess của infer() (None = không đo)
+    latency = None
+
+    def __init__(self, class_names, threshold):
+        self.class_names = list(class_names)
+        self.threshold = threshold
+
+    def _lap(self, stage, start):
+        """Ghi thời gian từ start cho stage (nếu đang đo), trả về thời điểm hiện tại"""
+        if self.latency is None:
+            return time.perf_counter()
+        return self.latency.lap(stage, start)
+
+    @abc.abstractmethod
+    def infer(self, frame):
+        """
+        Returns:
+            numpy.ndarray: Mảng DETECTION_DTYPE
+        """
+
+    def detect(self, frame, bbox_format='xywh'):
+        """
+        Returns:
+            list: [{'class', 'confidence', 'bbox'}, ...]
+        """
+        return to_detection_dicts(self.infer(frame), self.class_names, bbox_format=bbox_format)
+
+    def close(self):
+        pass
+
+
+class OpenCVSSDEngine(DetectionEngine):
+    """MobileNet SSD Caffe chạy bằng cv2.dnn"""
+
+    name = "opencv-dnn"
+
+    def __init__(self, prototxt="MobileNetSSD_deploy.prototxt", caffemodel="MobileNetSSD_deploy.caffemodel",
+                 class_names=VOC_CLASSES, threshold=0.5, net=None):
+        super().__init__(class_names, threshold)
+        self.net = net if net is not None else load_tuned_net(prototxt, caffemodel)
+        self.preprocess = SSDPreprocessor()
+
+    def infer(self, frame):
+        start = time.perf_counter()
+        self.net.setInput(self.preprocess(frame))
+        start = self._lap('preprocess', start)
+        detections = self.net.forward()
+        start = self._lap('forward', start)
+        result = postprocess_ssd(detections, frame.shape[1], frame.shape[0], threshold=self.threshold,
+                                 num_classes=len(self.class_names))
+        self._lap('postprocess', start)
+        return result
+
+
+class _OnnxEngine(DetectionEngine):
+    """Session ONNX Runtime với input/output bind vào buffer cố định"""
+
+    def __init__(self, onnx_path, class_names, threshold, intra_op_threads=None, inter_op_threads=1,
+                 allow_spinning=None, replicas=1, session=None):
+        """
+        Args:
+            intra_op_threads, inter_op_threads, allow_spinning, replicas: Xem session_options
+            session: InferenceSession đã mở sẵn cho onnx_path (bỏ qua các tham số thread)
+        """
+        super().__init__(class_names, threshold)
+        if session is None:
+            options = session_options(intra_op_threads, inter_op_threads, allow_spinning, replicas)
+            session = ort.InferenceSession(onnx_path, sess_options=options, providers=['CPUExecutionProvider'])
+        self.session = session
+        self.metadata = self.session.get_modelmeta().custom_metadata_map
+        self.input_name = self.session.get_inputs()[0].name
+        self.binding = self.session.io_binding()
+        self.outputs = {}
+
+    def _bind(self, blob, output_shapes):
+        """Bind blob đầu vào và cấp phát sẵn các output (shape cố định)"""
+        self._bound_input = blob
+        self.binding.bind_input(self.input_name, 'cpu', 0, np.float32, list(blob.shape), blob.ctypes.data)
+        for name, shape in output_shapes.items():
+            self.outputs[name] = np.empty(shape, dtype=np.float32)
+            self.binding.bind_output(name, 'cpu', 0, np.float32, list(shape), self.outputs[name].ctypes.data)
+
+    def _run(self, blob):
+        if blob.ctypes.data != self._bound_input.ctypes.data:
+            self._bind(blob, {name: output.shape for name, output in self.outputs.items()})
+        self.session.run_with_iobinding(self.binding)
+        return self.outputs
+
+
+class OnnxSSDEngine(_OnnxEngine):
+    """
+    MobileNet SSD ONNX (xuất bởi esp32_onnx_export.export_ssd)
+
+    ONNX không có DetectionOutput nên bước giải mã box theo prior (CENTER_SIZE)
+    và NMS theo từng class được làm bằng NumPy với tham số lưu trong metadata
+    của model, cho kết quả giống cv2.dnn.
+
+    setInput()/forward() có cùng dạng với cv2.dnn.Net nên engine dùng thay net
+    được trong InferencePipeline và các detector (ví dụ model INT8 từ esp32_quantize.py).
+    """
+
+    name = "onnxruntime-ssd"
+
+    def __init__(self, onnx_path="MobileNetSSD_deploy.onnx", class_names=VOC_CLASSES, threshold=0.5, **kwargs):
+        super().__init__(onnx_path, class_names, threshold, **kwargs)
+        self.preprocess = SSDPreprocessor()
+        self.num_classes = int(self.metadata.get('num_classes', len(self.class_names)))
+        self.background_id = int(self.metadata.get('background_label_id', 0))
+        self.nms_threshold = float(self.metadata.get('nms_threshold', 0.45))
+        self.top_k = int(self.metadata.get('top_k', 100))
+        self.keep_top_k = int(self.metadata.get('keep_top_k', 100))
+        self.confidence_threshold = float(self.metadata.get('confidence_threshold', 0.01))
+
+        # Prior box là hằng số của model: lấy một lần
+        blob = self.preprocess(np.zeros((300, 300, 3), dtype=np.uint8))
+        loc, conf, priors = self.session.run(['mbox_loc', 'mbox_conf_flatten', 'mbox_priorbox'],
+                                             {self.input_name: blob})
+        priors = priors.reshape(2, -1, 4)
+        self.prior_size = priors[0, :, 2:] - priors[0, :, :2]
+        self.prior_center = (priors[0, :, :2] + priors[0, :, 2:]) / 2
+        self.variances = priors[1]
+        self._bind(blob, {'mbox_loc': loc.shape, 'mbox_conf_flatten': conf.shape})
+
+    def decode(self, loc, conf):
+        """
+        Tương đương layer DetectionOutput của Caffe
+
+        Returns:
+            numpy.ndarray: shape (1, 1, N, 7) như output của cv2.dnn
+        """
+        loc = loc.reshape(-1, 4)
+        scores = conf.reshape(len(loc), self.num_classes)
+
+        prior_idx, class_ids = np.nonzero(scores > self.confidence_threshold)
+        keep = class_ids != self.background_id
+        prior_idx, class_ids = prior_idx[keep], class_ids[keep]
+        candidate_scores = scores[prior_idx, class_ids]
+
+        # Giữ top_k box điểm cao nhất của mỗi class trước NMS
+        order = np.lexsort((-candidate_scores, class_ids))
+        prior_idx, class_ids, candidate_scores = prior_idx[order], class_ids[order], candidate_scores[order]
+        _, first, counts = np.unique(class_ids, return_index=True, return_counts=True)
+        rank = np.arange(len(class_ids)) - np.repeat(first, counts)
+        keep = rank < self.top_k
+        prior_idx, class_ids, candidate_scores = prior_idx[keep], class_ids[keep], candidate_scores[keep]
+
+        # Giải mã CENTER_SIZE (variance nằm trong output của PriorBox)
+        offsets = loc[prior_idx]
+        variances = self.variances[prior_idx]
+        sizes = self.prior_size[prior_idx]
+        centers = self.prior_center[prior_idx] + offsets[:, :2] * variances[:, :2] * sizes
+        sizes = np.exp(offsets[:, 2:] * variances[:, 2:]) * sizes
+        boxes = np.concatenate([centers - sizes / 2, centers + sizes / 2], axis=1)
+
+        # NMS riêng từng class (mỗi class <= top_k box nên dùng được ma trận IoU của nms())
+        counts = np.minimum(counts, self.top_k)
+        keep = []
+        for start, count in zip(np.cumsum(counts) - counts, counts):
+            own = slice(start, start + count)
+            keep.append(start + nms(boxes[own], candidate_scores[own], self.nms_threshold, box_format='xyxy'))
+        keep = np.concatenate(keep) if keep else np.empty(0, dtype=np.intp)
+        keep = keep[np.argsort(-candidate_scores[keep], kind='stable')][:self.keep_top_k]
+
+        rows = np.zeros((len(keep), 7), dtype=np.float32)
+        rows[:, 1] = class_ids[keep]
+        rows[:, 2] = candidate_scores[keep]
+        rows[:, 3:] = boxes[keep]
+        return rows.reshape(1, 1, -1, 7)
+
+    def setInput(self, blob):
+        """Chép blob (1, 3, 300, 300) vào input đã bind, như cv2.dnn.Net.setInput"""
+        np.copyto(self._bound_input, blob)
+
+    def forward(self):
+        """
+        Returns:
+            numpy.ndarray: shape (1, 1, N, 7) như output DetectionOutput của cv2.dnn
+        """
+        outputs = self._run(self._bound_input)
+        return self.decode(outputs['mbox_loc'], outputs['mbox_conf_flatten'])
+
+    def infer(self, frame):
+        start = time.perf_counter()
+        blob = self.preprocess(frame)
+        start = self._lap('preprocess', start)
+        outputs = self._run(blob)
+        start = self._lap('forward', start)
+        detections = self.decode(outputs['mbox_loc'], outputs['mbox_conf_flatten'])
+        result = postprocess_ssd(detections, frame.shape[1], frame.shape[0], threshold=self.threshold,
+                                 num_classes=len(self.class_names))
+        self._lap('postprocess', start)
+        return result
+
+
+class LetterboxPreprocessor:
+    """
+    Tiền xử lý YOLOv8: letterbox về size x size (viền 114), BGR->RGB, chia 255
+
+    Ghi vào các buffer cố định như SSDPreprocessor; blob bị ghi đè ở lần gọi kế tiếp.
+    """
+
+    def __init__(self, size=640, pad_value=114):
+        self.size = size
+        self.pad_value = pad_value
+        self.canvas = np.full((size, size, 3), pad_value, dtype=np.uint8)
+        self._planes = [np.empty((size, size), dtype=np.uint8) for _ in range(3)]
+        self.blob = np.empty((1, 3, size, size), dtype=np.float32)
+        self._frame_shape = None
+        self._resized = None
+
+    def _layout(self, frame_shape):
+        """Tính tỉ lệ và vị trí ảnh trong canvas (chỉ khi kích thước frame đổi)"""
+        height, width = frame_shape[:2]
+        self.ratio = min(self.size / height, self.size / width)
+        new_w, new_h = int(round(width * self.ratio)), int(round(height * self.ratio))
+        self.left = (self.size - new_w) // 2
+        self.top = (self.size - new_h) // 2
+        self._resized = np.empty((new_h, new_w, 3), dtype=np.uint8)
+        self.canvas[:] = self.pad_value
+        self._frame_shape = frame_shape
+
+    def __call__(self, frame):
+        """
+        Returns:
+            numpy.ndarray: Blob shape (1, 3, size, size)
+        """
+        if frame.shape != self._frame_shape:
+            self._layout(frame.shape)
+        new_h, new_w = self._resized.shape[:2]
+        cv2.resize(frame, (new_w, new_h), dst=self._resized, interpolation=cv2.INTER_LINEAR)
+        self.canvas[self.top:self.top + new_h, self.left:self.left + new_w] = self._resized
+        cv2.split(self.canvas, self._planes)
+        # Kênh của blob theo thứ tự RGB
+        for channel, plane in enumerate(reversed(self._planes)):
+            cv2.addWeighted(plane, 1 / 255.0, plane, 0, 0, dst=self.blob[0, channel], dtype=cv2.CV_32F)
+        return self.blob
+
+    def restore(self, boxes, frame_shape):
+        """Đưa box (x1, y1, x2, y2) trên canvas về toạ độ frame gốc"""
+        boxes = (boxes - [self.left, self.top, self.left, self.top]) / self.ratio
+        height, width = frame_shape[:2]
+        return np.clip(boxes, 0, [width, height, width, height])
+
+
+def _load_names(path):
+    with open(path) as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+class OnnxYoloEngine(_OnnxEngine):
+    """YOLOv8 ONNX (xuất bởi ultralytics, output (1, 4 + số class, số anchor))"""
+
+    name = "onnxruntime-yolo"
+
+    def __init__(self, onnx_path="yolov8n.onnx", class_names=None, threshold=0.25, iou_threshold=0.7,
+                 max_det=300, **kwargs):
+        super().__init__(onnx_path, class_names or [], threshold, **kwargs)
+        if not self.class_names:
+            # ultralytics lưu tên class trong metadata dạng "{0: 'person', ...}"
+            names = ast.literal_eval(self.metadata.get('names', '{}'))
+            self.class_names = [names[i] for i in sorted(names)]
+        self.iou_threshold = iou_threshold
+        self.max_det = max_det
+
+        size = self.session.get_inputs()[0].shape[-1]
+        self.preprocess = LetterboxPreprocessor(size if isinstance(size, int) else 640)
+        output = self.session.get_outputs()[0]
+        blob = self.preprocess(np.zeros((self.preprocess.size, self.preprocess.size, 3), dtype=np.uint8))
+        shape = self.session.run([output.name], {self.input_name: blob})[0].shape
+        self.output_name = output.name
+        self._bind(blob, {output.name: shape})
+
+    def infer(self, frame):
+        start = time.perf_counter()
+        blob = self.preprocess(frame)
+        start = self._lap('preprocess', start)
+        predictions = self._run(blob)[self.output_name][0]
+        start = self._lap('forward', start)
+        scores = predictions[4:]
+        class_ids = scores.argmax(axis=0)
+        confidences = scores[class_ids, np.arange(scores.shape[1])]
+        mask = confidences > self.threshold
+        boxes, class_ids, confidences = predictions[:4, mask].T, class_ids[mask], confidences[mask]
+
+        boxes = np.concatenate([boxes[:, :2] - boxes[:, 2:] / 2, boxes[:, :2] + boxes[:, 2:] / 2], axis=1)
+        keep = nms(boxes, confidences, self.iou_threshold, class_ids=class_ids, box_format='xyxy')
+        keep = keep[:self.max_det]
+        boxes = self.preprocess.restore(boxes[keep], frame.shape)
+
+        result = np.empty(len(keep), dtype=DETECTION_DTYPE)
+        result['class_id'] = class_ids[keep]
+        result['confidence'] = confidences[keep]
+        for column, name in enumerate(('x1', 'y1', 'x2', 'y2')):
+            result[name] = boxes[:, column]
+        self._lap('postprocess', start)
+        return result
+
+
+class UltralyticsEngine(DetectionEngine):
+    """YOLOv8 .pt chạy bằng ultralytics (engine gốc của api/main.py)"""
+
+    name = "ultralytics"
+
+    def __init__(self, model_path="yolov8n.pt", threshold=0.25):
+        from ultralytics import YOLO
+
+        self.model = YOLO(model_path)
+        super().__init__([self.model.names[i] for i in sorted(self.model.names)], threshold)
+
+    def infer(self, frame):
+        prediction = self.model(frame, conf=self.threshold, verbose=False)[0]
+        if self.latency is not None:
+            # ultralytics tự đo từng bước (ms)
+            for stage, key in (('preprocess', 'preprocess'), ('forward', 'inference'),
+                               ('postprocess', 'postprocess')):
+                self.latency.record(stage, prediction.speed[key] / 1000)
+        boxes = prediction.boxes
+        result = np.empty(len(boxes), dtype=DETECTION_DTYPE)
+        result['class_id'] = boxes.cls.cpu().numpy()
+        result['confidence'] = boxes.conf.cpu().numpy()
+        xyxy = boxes.xyxy.cpu().numpy()
+        for column, name in enumerate(('x1', 'y1', 'x2', 'y2')):
+            result[name] = xyxy[:, column]
+        return result
+
+
+def create_engine(model_path, **kwargs):
+    """
+    Chọn engine theo file model
+
+    .caffemodel -> OpenCVSSDEngine, .pt -> UltralyticsEngine,
+    .onnx -> OnnxYoloEngine nếu metadata có tên class của ultralytics, ngược lại OnnxSSDEngine
+    (session dùng để đọc metadata được giao luôn cho engine, không mở lại model)
+
+    Returns:
+        DetectionEngine
+    """
+    extension = os.path.splitext(model_path)[1].lower()
+    if extension == '.caffemodel':
+        prototxt = kwargs.pop('prototxt', os.path.splitext(model_path)[0] + '.prototxt')
+        return OpenCVSSDEngine(prototxt, model_path, **kwargs)
+    if extension == '.onnx':
+        if ort is None:
+            raise ImportError("Cần cài onnxruntime: pip install onnxruntime")
+        options = session_options(**{key: kwargs.pop(key) for key in
+                                     ('intra_op_threads', 'inter_op_threads', 'allow_spinning', 'replicas')
+                                     if key in kwargs})
+        session = ort.InferenceSession(model_path, sess_options=options, providers=['CPUExecutionProvider'])
+        if 'names' in session.get_modelmeta().custom_metadata_map:
+            return OnnxYoloEngine(model_path, session=session, **kwargs)
+        return OnnxSSDEngine(model_path, session=session, **kwargs)
+    return UltralyticsEngine(model_path, **kwargs)
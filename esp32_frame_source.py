@@ -0,0 +1,499 @@
+import abc
+import threading
+import time
+import zlib
+
+import cv2
+import numpy as np
+import requests
+
+
+# Marker SOF (Start Of Frame) chứa kích thước ảnh; C4/C8/CC là DHT/JPG/DAC
+_SOF_MARKERS = frozenset(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+# Header firmware gửi kèm /capture: timestamp của frame buffer (giống ví dụ CameraWebServer)
+FRAME_ID_HEADER = 'X-Timestamp'
+
+# Hệ số thu nhỏ mà libjpeg làm sẵn trong bước IDCT
+_REDUCED_FLAGS = (
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+)
+
+
+def jpeg_size(data):
+    """
+    Đọc kích thước ảnh từ header JPEG mà không giải mã
+
+    Args:
+        data: Bytes JPEG
+
+    Returns:
+        tuple: (width, height) hoặc None nếu không tìm thấy marker SOF
+    """
+    i = 2
+    n = len(data)
+    while i + 9 < n:
+        if data[i] != 0xFF:
+            return None
+        marker = data[i + 1]
+        if marker == 0xFF:
+            # Byte đệm
+            i += 1
+            continue
+        if marker in _SOF_MARKERS:
+            height = (data[i + 5] << 8) | data[i + 6]
+            width = (data[i + 7] << 8) | data[i + 8]
+            return width, height
+        if marker == 0x01 or 0xD0 <= marker <= 0xD9:
+            i += 2
+            continue
+        i += 2 + ((data[i + 2] << 8) | data[i + 3])
+    return None
+
+
+def decode_jpeg(data, max_width=640):
+    """
+    Giải mã JPEG từ ESP32-CAM thành frame BGR
+
+    Giải mã thẳng sang BGR bằng cv2.imdecode trên buffer gốc (không copy qua
+    PIL). Khi ảnh rộng hơn max_width ít nhất 2 lần, dùng IMREAD_REDUCED_COLOR_*
+    để bộ giải mã JPEG tự thu nhỏ trong bước IDCT.
+
+    Args:
+        data: Bytes JPEG nhận được
+        max_width: Chiều rộng tối đa (None để giữ nguyên kích thước)
+
+    Returns:
+        numpy.ndarray: Frame BGR hoặc None nếu dữ liệu không hợp lệ
+    """
+    flag = cv2.IMREAD_COLOR
+    if max_width is not None:
+        size = jpeg_size(data)
+        if size is not None:
+            for factor, reduced_flag in _REDUCED_FLAGS:
+                if size[0] // factor >= max_width:
+                    flag = reduced_flag
+                    break
+
+    frame = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), flag)
+    if frame is None:
+        return None
+
+    # Resize phần còn lại để tối ưu
+    if max_width is not None:
+        height, width = frame.shape[:2]
+        if width > max_width:
+            scale = max_width / width
+            frame = cv2.resize(frame, (max_width, int(height * scale)))
+    return frame
+
+
+class FrameSource(abc.ABC):
+    """Giao diện chung cho các nguồn frame từ ESP32-CAM"""
+
+    # Số ảnh bị bỏ vì trùng với ảnh trước (xem _is_duplicate)
+    duplicates = 0
+    # StageLatency nhận thời gian fetch/decode (None = không đo)
+    latency = None
+
+    def __init__(self, url, timeout=3, max_width=640, verbose=False, dedup=True):
+        """
+        Args:
+            url (str): URL lấy ảnh trên ESP32-CAM
+            timeout: Timeout cho request (giây)
+            max_width: Chiều rộng tối đa của frame trả về
+            verbose (bool): In lỗi kết nối ra console
+            dedup (bool): Bỏ ảnh trùng byte với ảnh trước, không giải mã
+        """
+        self.url = url
+        self.timeout = timeout
+        self.max_width = max_width
+        self.verbose = verbose
+        self.dedup = dedup
+        self._last_key = None
+
+    @abc.abstractmethod
+    def read(self):
+        """
+        Lấy frame tiếp theo
+
+        Returns:
+            numpy.ndarray: Frame BGR hoặc None nếu lỗi hoặc ảnh trùng
+                (phân biệt bằng thay đổi của duplicates)
+        """
+
+    def _is_duplicate(self, data, frame_id=None):
+        """
+        Ảnh JPEG này có giống hệt ảnh trước không
+
+        Với CAMERA_GRAB_LATEST và fb_count = 2, poll /capture nhanh hơn sensor sẽ
+        nhận lại đúng frame buffer cũ. Dùng frame_id (header của firmware) nếu có,
+        không thì CRC32 của bytes (vài chục micro giây cho ảnh ~30 KB).
+        """
+        if not self.dedup:
+            return False
+        key = (frame_id, len(data)) if frame_id else (zlib.crc32(data), len(data))
+        if key == self._last_key:
+            self.duplicates += 1
+            return True
+        self._last_key = key
+        return False
+
+    def set_url(self, url):
+        """Đổi URL (ví dụ khi IP của ESP32-CAM thay đổi)"""
+        self.url = url
+
+    def close(self):
+        """Giải phóng kết nối"""
+
+    def stats(self):
+        """Thống kê của nguồn frame (dict rỗng nếu không có)"""
+        return {}
+
+    def _log(self, message):
+        if self.verbose:
+            print(message)
+
+
+class CaptureFrameSource(FrameSource):
+    """Lấy từng ảnh qua endpoint /capture (mỗi frame một request)"""
+
+    def __init__(self, url, timeout=3, max_width=640, verbose=False, client=None, dedup=True):
+        """
+        Args:
+            url (str): URL /capture trên ESP32-CAM
+            timeout: Timeout cho request (giây)
+            max_width: Chiều rộng tối đa của frame trả về
+            verbose (bool): In lỗi kết nối ra console
+            client (ESP32HttpClient): Client dùng chung (giữ kết nối) thay cho requests.get
+            dedup (bool): Bỏ ảnh trùng với ảnh trước (theo header X-Timestamp hoặc CRC32)
+        """
+        super().__init__(url, timeout, max_width, verbose, dedup)
+        self.client = client
+
+    def read(self):
+        try:
+            start = time.perf_counter()
+            if self.client is not None:
+                response = self.client.get('capture', url=self.url, timeout=self.timeout)
+            else:
+                response = requests.get(self.url, timeout=self.timeout)
+            if response.status_code == 200:
+                if self.latency is not None:
+                    start = self.latency.lap('fetch', start)
+                if self._is_duplicate(response.content, response.headers.get(FRAME_ID_HEADER)):
+                    return None
+                frame = decode_jpeg(response.content, self.max_width)
+                if self.latency is not None:
+                    self.latency.lap('decode', start)
+                return frame
+            self._log(f"[ESP32] HTTP {response.status_code} when requesting {self.url}")
+            return None
+        except Exception as e:
+            self._log(f"[ESP32] Error getting frame: {e}")
+            return None
+
+
+class MJPEGFrameSource(FrameSource):
+    """
+    Đọc luồng multipart/x-mixed-replace (MJPEG) qua một kết nối giữ mở
+
+    Ranh giới mỗi ảnh được tìm theo marker SOI (FFD8) / EOI (FFD9) trong
+    buffer nên không phụ thuộc vào header Content-Length của từng part.
+    Khi mất kết nối, lần gọi read() kế tiếp sẽ tự kết nối lại.
+    """
+
+    SOI = b'\xff\xd8'
+    EOI = b'\xff\xd9'
+
+    def __init__(self, url, timeout=3, max_width=640, verbose=False,
+                 chunk_size=4096, reconnect_delay=1.0, max_buffer=2 * 1024 * 1024, dedup=True):
+        """
+        Args:
+            url (str): URL stream MJPEG (ví dụ http://IP:81/stream)
+            timeout: Timeout kết nối/đọc (giây)
+            max_width: Chiều rộng tối đa của frame trả về
+            verbose (bool): In lỗi kết nối ra console
+            chunk_size: Số bytes đọc mỗi lần từ socket
+            reconnect_delay: Thời gian chờ tối thiểu giữa hai lần kết nối lại
+            max_buffer: Kích thước buffer tối đa trước khi bỏ dữ liệu rác
+            dedup (bool): Bỏ ảnh trùng byte với ảnh trước (CRC32)
+        """
+        super().__init__(url, timeout, max_width, verbose, dedup)
+        self.chunk_size = chunk_size
+        self.reconnect_delay = reconnect_delay
+        self.max_buffer = max_buffer
+
+        self._response = None
+        self._chunks = None
+        self._buffer = bytearray()
+        self._scan_pos = 0
+        self._last_connect = 0.0
+        self.reconnects = 0
+
+    def _connect(self):
+        """Mở kết nối stream, trả về True nếu thành công"""
+        wait = self.reconnect_delay - (time.time() - self._last_connect)
+        if wait > 0:
+            time.sleep(wait)
+        self._last_connect = time.time()
+
+        try:
+            response = requests.get(self.url, stream=True, timeout=self.timeout)
+        except Exception as e:
+            self._log(f"[ESP32] Error opening stream: {e}")
+            return False
+
+        if response.status_code != 200:
+            self._log(f"[ESP32] HTTP {response.status_code} when requesting {self.url}")
+            response.close()
+            return False
+
+        self._response = response
+        self._chunks = response.iter_content(chunk_size=self.chunk_size)
+        self._buffer.clear()
+        self._scan_pos = 0
+        self.reconnects += 1
+        return True
+
+    def _disconnect(self):
+        if self._response is not None:
+            self._response.close()
+        self._response = None
+        self._chunks = None
+
+    def _next_jpeg(self):
+        """Tách một ảnh JPEG hoàn chỉnh khỏi buffer (None nếu chưa đủ dữ liệu)"""
+        start = self._buffer.find(self.SOI)
+        if start < 0:
+            # Giữ lại byte cuối phòng trường hợp marker bị cắt giữa hai chunk
+            del self._buffer[:-1]
+            self._scan_pos = 0
+            return None
+        if start > 0:
+            del self._buffer[:start]
+            self._scan_pos = max(0, self._scan_pos - start)
+
+        end = self._buffer.find(self.EOI, max(len(self.SOI), self._scan_pos))
+        if end < 0:
+            # Lần sau chỉ quét phần dữ liệu mới
+            self._scan_pos = max(len(self.SOI), len(self._buffer) - 1)
+            return None
+
+        end += len(self.EOI)
+        jpeg = bytes(self._buffer[:end])
+        del self._buffer[:end]
+        self._scan_pos = 0
+        return jpeg
+
+    def read_jpeg(self):
+        """
+        Đọc bytes JPEG tiếp theo từ stream
+
+        Returns:
+            bytes: Dữ liệu JPEG hoặc None nếu mất kết nối
+        """
+        if self._chunks is None and not self._connect():
+            return None
+
+        while True:
+            jpeg = self._next_jpeg()
+            if jpeg is not None:
+                return jpeg
+
+            try:
+                chunk = next(self._chunks)
+            except StopIteration:
+                self._log("[ESP32] Stream closed by ESP32-CAM")
+                self._disconnect()
+                return None
+            except Exception as e:
+                self._log(f"[ESP32] Error reading stream: {e}")
+                self._disconnect()
+                return None
+
+            self._buffer += chunk
+            if len(self._buffer) > self.max_buffer:
+                self._log("[ESP32] Stream buffer overflow, resyncing")
+                self._buffer.clear()
+                self._scan_pos = 0
+
+    def read(self):
+        start = time.perf_counter()
+        jpeg = self.read_jpeg()
+        if jpeg is None:
+            return None
+        if self.latency is not None:
+            # Gồm cả thời gian chờ ESP32-CAM gửi ảnh kế tiếp trên stream
+            start = self.latency.lap('fetch', start)
+        if self._is_duplicate(jpeg):
+            return None
+        try:
+            frame = decode_jpeg(jpeg, self.max_width)
+            if self.latency is not None:
+                self.latency.lap('decode', start)
+            return frame
+        except Exception as e:
+            self._log(f"[ESP32] Error decoding frame: {e}")
+            return None
+
+    def set_url(self, url):
+        if url != self.url:
+            self._disconnect()
+        super().set_url(url)
+
+    def close(self):
+        self._disconnect()
+
+
+class LatestFrameGrabber(FrameSource):
+    """
+    Chạy một FrameSource trên thread riêng, chỉ giữ frame mới nhất
+
+    Thread capture ghi đè vào một slot duy nhất ("latest frame wins") nên
+    vòng lặp inference luôn xử lý frame mới nhất thay vì frame cũ trong hàng
+    đợi. Frame bị ghi đè trước khi được đọc sẽ được tính là dropped.
+    """
+
+    def __init__(self, source, wait_timeout=1.0, error_delay=0.1):
+        """
+        Args:
+            source (FrameSource): Nguồn frame thực tế (chạy trên thread capture)
+            wait_timeout: Thời gian tối đa read() chờ frame mới (giây)
+            error_delay: Thời gian nghỉ sau khi source trả về None
+        """
+        self.source = source
+        self.wait_timeout = wait_timeout
+        self.error_delay = error_delay
+
+        self._cond = threading.Condition()
+        self._frame = None
+        self._seq = 0
+        self._read_seq = 0
+        self._stopped = False
+        # URL mới chờ thread capture áp dụng giữa hai lần read()
+        self._pending_url = None
+
+        self.frames_captured = 0
+        self.frames_dropped = 0
+        self.capture_errors = 0
+
+        self._thread = threading.Thread(target=self._run, name="esp32-capture", daemon=True)
+        self._thread.start()
+
+    @property
+    def url(self):
+        return self.source.url
+
+    @property
+    def duplicates(self):
+        return self.source.duplicates
+
+    @property
+    def latency(self):
+        return self.source.latency
+
+    @latency.setter
+    def latency(self, latency):
+        # fetch/decode chạy trong source trên thread capture
+        self.source.latency = latency
+
+    def _run(self):
+        while not self._stopped:
+            with self._cond:
+                url, self._pending_url = self._pending_url, None
+            if url is not None:
+                self.source.set_url(url)
+            duplicates = self.source.duplicates
+            frame = self.source.read()
+            if frame is None and self.source.duplicates != duplicates:
+                # Ảnh trùng: không ghi vào slot nên vòng inference không chạy lại
+                continue
+            if frame is None:
+                self.capture_errors += 1
+                time.sleep(self.error_delay)
+                continue
+
+            with self._cond:
+                if self._seq > self._read_seq:
+                    # Frame trước chưa được đọc đã bị ghi đè
+                    self.frames_dropped += 1
+                self._frame = frame
+                self._seq += 1
+                self.frames_captured += 1
+                self._cond.notify_all()
+
+    def read_with_seq(self, timeout=None):
+        """
+        Chờ và lấy frame mới nhất chưa được đọc
+
+        Args:
+            timeout: Thời gian chờ tối đa (mặc định wait_timeout)
+
+        Returns:
+            tuple: (sequence number, frame) hoặc (None, None) nếu hết thời gian chờ
+        """
+        if timeout is None:
+            timeout = self.wait_timeout
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._seq > self._read_seq or self._stopped, timeout):
+                return None, None
+            if self._seq <= self._read_seq:
+                return None, None
+            self._read_seq = self._seq
+            return self._seq, self._frame
+
+    def read(self):
+        return self.read_with_seq()[1]
+
+    @property
+    def last_seq(self):
+        """Sequence number của frame đọc gần nhất"""
+        return self._read_seq
+
+    def set_url(self, url):
+        # Source chỉ được dùng trên thread capture nên không đổi URL giữa chừng một request
+        with self._cond:
+            self._pending_url = url
+
+    def close(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        self._thread.join(timeout=self.source.timeout + 1)
+        self.source.close()
+
+    def stats(self):
+        return {
+            'captured': self.frames_captured,
+            'consumed': self._read_seq,
+            'dropped': self.frames_dropped,
+            'errors': self.capture_errors,
+            'duplicates': self.source.duplicates,
+            # Frame đang chờ vòng inference đọc (0 hoặc 1)
+            'pending': self._seq - self._read_seq,
+        }
+
+
+def create_frame_source(esp32_ip, mode="capture", threaded=False, **kwargs):
+    """
+    Tạo nguồn frame cho ESP32-CAM
+
+    Args:
+        esp32_ip (str): IP address của ESP32-CAM
+        mode (str): "capture" (poll /capture) hoặc "stream" (MJPEG giữ kết nối)
+        threaded (bool): Đọc frame trên thread riêng, chỉ giữ frame mới nhất
+        **kwargs: Tham số truyền cho FrameSource
+
+    Returns:
+        FrameSource
+    """
+    if mode == "stream":
+        source = MJPEGFrameSource(f"http://{esp32_ip}:81/stream", **kwargs)
+    elif mode == "capture":
+        source = CaptureFrameSource(f"http://{esp32_ip}/capture", **kwargs)
+    else:
+        raise ValueError(f"Unknown frame source mode: {mode}")
+    return LatestFrameGrabber(source) if threaded else source
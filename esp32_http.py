@@ -0,0 +1,365 @@
+import threading
+import time
+from collections import defaultdict
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
+from urllib3.connectionpool import HTTPConnectionPool
+
+from esp32_result_codec import CONTENT_TYPE
+
+
+# Timeout (giây) và số lần thử lại mặc định cho từng endpoint của ESP32-CAM
+DEFAULT_ENDPOINTS = {
+    'capture':  {'timeout': 3, 'retries': 0},
+    'distance': {'timeout': 1, 'retries': 0},
+    'results':  {'timeout': 1, 'retries': 0},
+    'ip':       {'timeout': 2, 'retries': 1},
+}
+
+
+class _PooledAdapter(HTTPAdapter):
+    """HTTPAdapter đo thời gian connect của từng kết nối TCP mới"""
+
+    def __init__(self, client, **kwargs):
+        self._client = client
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, connections, maxsize, block=False, **pool_kwargs):
+        super().init_poolmanager(connections, maxsize, block=block, **pool_kwargs)
+        client = self._client
+
+        class TimedHTTPConnection(HTTPConnection):
+            def connect(self):
+                start = time.perf_counter()
+                super().connect()
+                client._record_connect(time.perf_counter() - start)
+
+        class TimedHTTPConnectionPool(HTTPConnectionPool):
+            ConnectionCls = TimedHTTPConnection
+
+        self.poolmanager.pool_classes_by_scheme = {
+            **self.poolmanager.pool_classes_by_scheme,
+            'http': TimedHTTPConnectionPool,
+        }
+
+
+class ESP32HttpClient:
+    """
+    Client HTTP dùng chung cho một ESP32-CAM
+
+    Giữ một requests.Session với pool kết nối nhỏ (keep-alive) cho tất cả
+    endpoint (/capture, /distance, /results, /ip), timeout và số lần thử lại
+    riêng cho từng endpoint, kèm thống kê tái sử dụng kết nối và thời gian
+    connect/transfer.
+    """
+
+    def __init__(self, host, endpoints=None, pool_maxsize=2, pool_block=True):
+        """
+        Args:
+            host (str): IP (hoặc host:port) của ESP32-CAM
+            endpoints (dict): Ghi đè cấu hình {'endpoint': {'timeout', 'retries'}}
+            pool_maxsize: Số kết nối tối đa giữ tới ESP32 (WebServer chỉ phục vụ vài socket)
+            pool_block: Chờ kết nối rảnh thay vì mở thêm socket khi pool đầy
+        """
+        self.host = host
+        self.endpoints = {name: dict(config) for name, config in DEFAULT_ENDPOINTS.items()}
+        for name, config in (endpoints or {}).items():
+            self.endpoints.setdefault(name, {'timeout': 2, 'retries': 0}).update(config)
+
+        self.session = requests.Session()
+        self.session.headers['Connection'] = 'keep-alive'
+        adapter = _PooledAdapter(self, pool_connections=1, pool_maxsize=pool_maxsize,
+                                 pool_block=pool_block, max_retries=0)
+        self.session.mount('http://', adapter)
+
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.reset_stats()
+
+    def url(self, endpoint):
+        """URL đầy đủ của một endpoint"""
+        return f"http://{self.host}/{endpoint}"
+
+    def set_host(self, host):
+        """Đổi host (khi IP của ESP32-CAM thay đổi), đóng các kết nối cũ"""
+        if host == self.host:
+            return
+        self.host = host
+        for adapter in self.session.adapters.values():
+            adapter.poolmanager.clear()
+
+    def request(self, method, endpoint, url=None, timeout=None, retries=None, **kwargs):
+        """
+        Gửi request tới một endpoint với timeout/retry theo cấu hình
+
+        Args:
+            method (str): 'GET' hoặc 'POST'
+            endpoint (str): Tên endpoint (ví dụ 'capture')
+            url (str): URL tùy chỉnh (mặc định http://host/endpoint)
+            timeout: Ghi đè timeout của endpoint
+            retries: Ghi đè số lần thử lại của endpoint
+            **kwargs: Tham số truyền cho requests (json, data, ...)
+
+        Returns:
+            requests.Response
+
+        Raises:
+            requests.exceptions.RequestException: Khi hết số lần thử lại
+        """
+        config = self.endpoints.get(endpoint, {'timeout': 2, 'retries': 0})
+        if timeout is None:
+            timeout = config['timeout']
+        if retries is None:
+            retries = config['retries']
+        if url is None:
+            url = self.url(endpoint)
+
+        attempt = 0
+        while True:
+            self._local.connect_time = 0.0
+            start = time.perf_counter()
+            try:
+                response = self.session.request(method, url, timeout=timeout, **kwargs)
+            except requests.exceptions.RequestException as e:
+                self._record(endpoint, time.perf_counter() - start, error=e)
+                if attempt >= retries:
+                    raise
+                attempt += 1
+                continue
+            self._record(endpoint, time.perf_counter() - start)
+            return response
+
+    def get(self, endpoint, **kwargs):
+        return self.request('GET', endpoint, **kwargs)
+
+    def post(self, endpoint, **kwargs):
+        return self.request('POST', endpoint, **kwargs)
+
+    def _record_connect(self, seconds):
+        self._local.connect_time = getattr(self._local, 'connect_time', 0.0) + seconds
+        with self._lock:
+            self.new_connections += 1
+
+    def _record(self, endpoint, elapsed, error=None):
+        connect_time = getattr(self._local, 'connect_time', 0.0)
+        with self._lock:
+            stats = self.endpoint_stats[endpoint]
+            stats['requests'] += 1
+            stats['connect_s'] += connect_time
+            stats['transfer_s'] += max(0.0, elapsed - connect_time)
+            if error is not None:
+                stats['errors'] += 1
+                if isinstance(error, requests.exceptions.Timeout):
+                    stats['timeouts'] += 1
+
+    def reset_stats(self):
+        """Xóa thống kê"""
+        with self._lock:
+            self.new_connections = 0
+            self.endpoint_stats = defaultdict(lambda: {
+                'requests': 0, 'errors': 0, 'timeouts': 0,
+                'connect_s': 0.0, 'transfer_s': 0.0,
+            })
+
+    def stats(self):
+        """
+        Thống kê kết nối
+
+        Returns:
+            dict: Tổng số request, kết nối mới, số lần tái sử dụng kết nối,
+                  thời gian connect/transfer và chi tiết theo endpoint
+        """
+        with self._lock:
+            endpoints = {name: dict(stats) for name, stats in self.endpoint_stats.items()}
+            new_connections = self.new_connections
+        total = sum(s['requests'] for s in endpoints.values())
+        return {
+            'requests': total,
+            'new_connections': new_connections,
+            'reused_connections': max(0, total - new_connections),
+            'connect_s': sum(s['connect_s'] for s in endpoints.values()),
+            'transfer_s': sum(s['transfer_s'] for s in endpoints.values()),
+            'endpoints': endpoints,
+        }
+
+    def close(self):
+        self.session.close()
+
+
+class ResultPublisher:
+    """
+    Gửi kết quả detection lên /results trên thread riêng
+
+    publish() không bao giờ chặn vòng lặp inference: kết quả được đặt vào
+    một slot duy nhất, kết quả cũ chưa kịp gửi sẽ bị thay thế (hoặc gộp qua
+    hàm merge) nên chỉ trạng thái mới nhất được gửi đi. Lỗi gửi được thử lại
+    với backoff tăng dần trên thread publisher.
+    """
+
+    def __init__(self, client, endpoint='results', merge=None, max_retries=3,
+                 backoff=0.2, max_backoff=5.0, on_error=None, verbose=True, encoder=None, latency=None):
+        """
+        Args:
+            client (ESP32HttpClient): Client HTTP của ESP32
+            endpoint (str): Endpoint nhận kết quả
+            merge: Hàm merge(old, new) -> payload khi kết quả mới thay thế kết quả cũ
+            max_retries: Số lần thử lại một kết quả trước khi bỏ
+            backoff: Thời gian chờ ban đầu sau lỗi (giây), nhân đôi mỗi lần lỗi liên tiếp
+            max_backoff: Thời gian chờ tối đa sau lỗi
+            on_error: Hàm gọi (trên thread publisher) khi lỗi kết nối; chỉ nên đặt cờ/Event
+                (ví dụ yêu cầu kiểm tra lại IP), việc đổi host/URL phải làm trên thread dùng chúng
+            verbose (bool): In lỗi gửi ra console
+            encoder (ResultEncoder): Gửi dạng nhị phân gọn thay cho JSON
+            latency (StageLatency): Ghi thời gian mã hóa + POST của mỗi lần gửi (công đoạn publish)
+        """
+        self.client = client
+        self.endpoint = endpoint
+        self.encoder = encoder
+        self.merge = merge
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.on_error = on_error
+        self.verbose = verbose
+        self.latency = latency
+
+        self._cond = threading.Condition()
+        self._pending = None
+        self._pending_time = 0.0
+        self._pending_frame_size = None
+        self._stopped = False
+
+        self.published = 0
+        self.failed = 0
+        self.dropped = 0
+        self.merged = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+
+        self._thread = threading.Thread(target=self._run, name="esp32-publisher", daemon=True)
+        self._thread.start()
+
+    def publish(self, data, frame_size=None):
+        """
+        Đưa kết quả mới vào hàng đợi (không chặn)
+
+        Args:
+            data (dict): Kết quả detection
+            frame_size: (width, height) của frame sinh ra data, đi cùng payload tới encoder
+        """
+        with self._cond:
+            if self._pending is not None:
+                if self.merge is not None:
+                    data = self.merge(self._pending, data)
+                    self.merged += 1
+                else:
+                    self.dropped += 1
+            else:
+                self._pending_time = time.perf_counter()
+            self._pending = data
+            self._pending_frame_size = frame_size
+            self._cond.notify()
+
+    def _take(self):
+        with self._cond:
+            self._cond.wait_for(lambda: self._pending is not None or self._stopped)
+            if self._stopped:
+                return None, 0.0, None
+            data, queued_at, frame_size = self._pending, self._pending_time, self._pending_frame_size
+            self._pending = None
+            return data, queued_at, frame_size
+
+    def _send(self, data, frame_size=None):
+        """
+        Gửi một payload
+
+        Returns:
+            tuple: (ok, connection_error) - ok khi ESP32 trả về HTTP 200
+        """
+        try:
+            if self.encoder is not None:
+                payload = self.encoder.encode(data, frame_size)
+                seq = self.encoder.seq
+                response = self.client.post(self.endpoint, data=payload,
+                                            headers={'Content-Type': CONTENT_TYPE})
+            else:
+                response = self.client.post(self.endpoint, json=data)
+        except Exception as exc:
+            if self.verbose:
+                print(f"[ESP32 Results] Error sending data: {exc}")
+            return False, True
+        if response.status_code != 200:
+            if self.verbose:
+                print(f"[ESP32 Results] HTTP {response.status_code}: {response.text}")
+            return False, False
+        if self.encoder is not None:
+            # ESP32 đã nhận, dùng làm gốc cho các delta tiếp theo
+            self.encoder.ack(seq)
+        return True, False
+
+    def _run(self):
+        failures = 0
+        while True:
+            data, queued_at, frame_size = self._take()
+            if data is None:
+                return
+
+            attempts = 0
+            while not self._stopped:
+                start = time.perf_counter()
+                ok, connection_error = self._send(data, frame_size)
+                if self.latency is not None:
+                    self.latency.lap('publish', start)
+                if ok:
+                    latency = time.perf_counter() - queued_at
+                    self.published += 1
+                    self.latency_total += latency
+                    self.latency_max = max(self.latency_max, latency)
+                    failures = 0
+                    break
+
+                self.failed += 1
+                failures += 1
+                attempts += 1
+                if connection_error and self.on_error is not None:
+                    # Báo lỗi kết nối (không đổi host trên thread này)
+                    self.on_error()
+
+                delay = min(self.max_backoff, self.backoff * (2 ** (failures - 1)))
+                with self._cond:
+                    self._cond.wait_for(lambda: self._stopped, delay)
+                    if self._pending is not None:
+                        # Đã có kết quả mới hơn, bỏ kết quả đang thử lại
+                        self.dropped += 1
+                        break
+                    if attempts > self.max_retries:
+                        self.dropped += 1
+                        break
+
+    def stats(self):
+        """
+        Thống kê gửi kết quả
+
+        Returns:
+            dict: Số kết quả đã gửi, lỗi, bị bỏ/gộp, đang chờ gửi (0 hoặc 1)
+                  và độ trễ trung bình/tối đa (ms)
+        """
+        avg = self.latency_total / self.published if self.published else 0.0
+        return {
+            'published': self.published,
+            'pending': int(self._pending is not None),
+            'failed': self.failed,
+            'dropped': self.dropped,
+            'merged': self.merged,
+            'latency_avg_ms': avg * 1000,
+            'latency_max_ms': self.latency_max * 1000,
+        }
+
+    def close(self, timeout=2.0):
+        """Dừng thread publisher"""
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        self._thread.join(timeout=timeout)
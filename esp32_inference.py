@@ -0,0 +1,532 @@
+import threading
+import time
+from collections import deque, namedtuple
+from concurrent.futures import Future
+
+import cv2
+import numpy as np
+
+# Kết quả một request: seq (thứ tự submit), frame gốc, output của net và độ trễ (giây)
+InferenceResult = namedtuple('InferenceResult', ['seq', 'frame', 'output', 'latency'])
+
+
+class SSDPreprocessor:
+    """
+    Tiền xử lý MobileNet SSD (300x300, scale 1/127.5, mean 127.5) dùng lại buffer cố định
+
+    Tương đương cv2.dnn.blobFromImage(frame, 0.007843, (300, 300), (127.5, 127.5, 127.5))
+    nhưng không cấp phát gì mỗi frame: resize vào buffer uint8 300x300, tách
+    kênh vào các buffer uint8, rồi mỗi kênh được đổi sang float32, nhân scale
+    và trừ mean trong một lần cv2.addWeighted ghi thẳng vào blob NCHW (dst=).
+
+    Blob trả về bị ghi đè ở lần gọi kế tiếp (net.setInput sao chép dữ liệu nên
+    có thể dùng lại ngay sau setInput). Mỗi thread cần một instance riêng.
+    """
+
+    def __init__(self, size=(300, 300), scale=0.007843, mean=(127.5, 127.5, 127.5), batch_size=1):
+        """
+        Args:
+            size: (width, height) đầu vào của net
+            scale: Hệ số nhân sau khi trừ mean
+            mean: Mean của từng kênh (B, G, R)
+            batch_size: Số ảnh tối đa của blob (tự tăng khi batch() nhận nhiều hơn)
+        """
+        self.size = tuple(size)
+        self.scale = scale
+        self.mean = tuple(mean)
+        width, height = self.size
+        self.resized = np.empty((height, width, 3), dtype=np.uint8)
+        self._planes = [np.empty((height, width), dtype=np.uint8) for _ in range(3)]
+        self.blob = np.empty((batch_size, 3, height, width), dtype=np.float32)
+
+    def _fill(self, frame, index):
+        cv2.resize(frame, self.size, dst=self.resized, interpolation=cv2.INTER_LINEAR)
+        cv2.split(self.resized, self._planes)
+        for channel, plane in enumerate(self._planes):
+            # (plane - mean) * scale = plane * scale - mean * scale, ghi float32 vào blob
+            cv2.addWeighted(plane, self.scale, plane, 0, -self.mean[channel] * self.scale,
+                            dst=self.blob[index, channel], dtype=cv2.CV_32F)
+
+    def __call__(self, frame):
+        """
+        Returns:
+            numpy.ndarray: Blob shape (1, 3, H, W) (view của buffer nội bộ)
+        """
+        self._fill(frame, 0)
+        return self.blob[:1]
+
+    def batch(self, frames):
+        """
+        Returns:
+            numpy.ndarray: Blob shape (len(frames), 3, H, W) (view của buffer nội bộ)
+        """
+        if len(frames) > len(self.blob):
+            self.blob = np.empty((len(frames),) + self.blob.shape[1:], dtype=np.float32)
+        for index, frame in enumerate(frames):
+            self._fill(frame, index)
+        return self.blob[:len(frames)]
+
+
+def split_batch_output(output, batch_size):
+    """
+    Tách output của một lần forward theo batch về từng ảnh
+
+    Output có trục batch thật được cắt theo trục 0. Output của SSD
+    DetectionOutput có shape (1, 1, N, 7) cho cả batch, với cột 0 là index ảnh,
+    nên được tách theo cột đó.
+
+    Returns:
+        list: Output của từng ảnh, cùng dạng với forward batch size 1
+    """
+    if output.shape[0] == batch_size:
+        return [output[i:i + 1] for i in range(batch_size)]
+    rows = output.reshape(-1, output.shape[-1])
+    image_ids = rows[:, 0]
+    outputs = []
+    for i in range(batch_size):
+        own = rows[image_ids == i]
+        own[:, 0] = 0
+        outputs.append(own.reshape(1, 1, -1, rows.shape[1]))
+    return outputs
+
+
+def forward_batch(net, preprocessor, frames, latency=None):
+    """
+    Chạy net cho nhiều ảnh (crop/tile) trong một lần forward
+
+    cv2.dnn.Net nhận cả batch trong một blob NCHW (như cv2.dnn.blobFromImages);
+    net không nhận batch (OnnxSSDEngine bind input cố định 1 ảnh) được chạy
+    lần lượt từng ảnh.
+
+    Args:
+        net: cv2.dnn.Net hoặc object có setInput/forward
+        preprocessor: SSDPreprocessor của thread gọi hàm
+        frames: Danh sách ảnh BGR
+        latency (StageLatency): Ghi thời gian preprocess/forward (cả batch)
+
+    Returns:
+        list: Output của từng ảnh, cùng dạng với forward batch size 1
+    """
+    if not frames:
+        return []
+    start = time.perf_counter()
+    if isinstance(net, cv2.dnn.Net):
+        net.setInput(preprocessor.batch(frames))
+        if latency is not None:
+            start = latency.lap('preprocess', start)
+        outputs = split_batch_output(net.forward(), len(frames))
+        if latency is not None:
+            latency.lap('forward', start)
+        return outputs
+    outputs = []
+    preprocess_s = 0.0
+    for frame in frames:
+        prepared = time.perf_counter()
+        net.setInput(preprocessor(frame))
+        preprocess_s += time.perf_counter() - prepared
+        outputs.append(net.forward())
+    if latency is not None:
+        latency.record('preprocess', preprocess_s)
+        latency.record('forward', time.perf_counter() - start - preprocess_s)
+    return outputs
+
+
+class InferencePipeline:
+    """
+    Chạy inference DNN bất đồng bộ với nhiều request đang xử lý cùng lúc
+
+    Mỗi cv2.dnn.Net trong `nets` được một worker thread dùng riêng (OpenCV nhả
+    GIL trong forward), nên trong khi net chạy, thread chính vẫn lấy frame và
+    vẽ kết quả. Với use_forward_async=True, một net duy nhất dùng
+    net.forwardAsync() (chỉ backend Inference Engine/OpenVINO hỗ trợ).
+
+    Kết quả luôn được trả về theo đúng thứ tự frame đã submit.
+    """
+
+    def __init__(self, nets, depth=None, preprocess_factory=SSDPreprocessor, use_forward_async=False,
+                 latency=None):
+        """
+        Args:
+            nets: Danh sách cv2.dnn.Net (các bản sao của cùng một model)
+            depth: Số request tối đa đang xử lý trong process() (mặc định len(nets))
+            preprocess_factory: Tạo hàm frame -> blob; mỗi worker thread có một bản riêng
+            use_forward_async (bool): Dùng net.forwardAsync() trên nets[0] thay cho worker thread
+            latency (StageLatency): Ghi thời gian preprocess/forward của từng request
+                (forwardAsync chỉ đo được preprocess)
+        """
+        self.nets = list(nets)
+        self.latency = latency
+        self.depth = max(1, depth or len(self.nets))
+        self.preprocess_factory = preprocess_factory
+        self.use_forward_async = use_forward_async
+        self._preprocess = preprocess_factory() if use_forward_async else None
+
+        self._cond = threading.Condition()
+        self._jobs = deque()
+        self._done = {}
+        self._async = deque()
+        self._stopped = False
+        self._next_seq = 0
+        self._next_result = 0
+
+        self.completed = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+
+        self._threads = []
+        # Số worker còn chạy; get() không chờ kết quả khi không còn worker nào
+        self._alive = 0 if use_forward_async else len(self.nets)
+        if not use_forward_async:
+            for i, net in enumerate(self.nets):
+                thread = threading.Thread(target=self._worker, args=(net,),
+                                          name=f"dnn-worker-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    @property
+    def in_flight(self):
+        """Số request đã submit nhưng chưa được lấy kết quả"""
+        return self._next_seq - self._next_result
+
+    def submit(self, frame):
+        """
+        Đưa một frame vào hàng đợi inference (không chặn)
+
+        Returns:
+            int: seq của request
+        """
+        submitted = time.perf_counter()
+        with self._cond:
+            seq = self._next_seq
+            self._next_seq += 1
+            if self.use_forward_async:
+                net = self.nets[0]
+                net.setInput(self._preprocess(frame))
+                if self.latency is not None:
+                    self.latency.lap('preprocess', submitted)
+                self._async.append((seq, frame, submitted, net.forwardAsync()))
+            else:
+                self._jobs.append((seq, frame, submitted))
+                self._cond.notify_all()
+        return seq
+
+    def _worker(self, net):
+        try:
+            self._work(net)
+        finally:
+            with self._cond:
+                self._alive -= 1
+                self._cond.notify_all()
+
+    def _work(self, net):
+        preprocess = self.preprocess_factory()
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._jobs or self._stopped)
+                if self._stopped:
+                    return
+                seq, frame, submitted = self._jobs.popleft()
+
+            try:
+                start = time.perf_counter()
+                net.setInput(preprocess(frame))
+                if self.latency is not None:
+                    start = self.latency.lap('preprocess', start)
+                output, error = net.forward(), None
+                if self.latency is not None:
+                    self.latency.lap('forward', start)
+            except Exception as e:
+                # Lỗi của cv2.dnn hoặc ONNX Runtime (OnnxSSDEngine): trả về cho get() của request này
+                output, error = None, e
+
+            with self._cond:
+                self._done[seq] = (frame, output, error, submitted)
+                self._cond.notify_all()
+
+    def get(self, block=True, timeout=None):
+        """
+        Lấy kết quả của request kế tiếp theo thứ tự submit
+
+        Args:
+            block (bool): Chờ đến khi request kế tiếp xong
+            timeout: Thời gian chờ tối đa (giây) khi block
+
+        Returns:
+            InferenceResult hoặc None nếu chưa có kết quả
+
+        Raises:
+            Exception: Lỗi của preprocess/net.forward() cho request này
+            RuntimeError: Không còn worker thread nào chạy
+        """
+        if self.in_flight == 0:
+            return None
+
+        if self.use_forward_async:
+            seq, frame, submitted, pending = self._async[0]
+            if not block:
+                timeout = 0
+            if timeout is None:
+                output = pending.get()
+            elif pending.wait_for(int(timeout * 1e9)):
+                output = pending.get()
+            else:
+                return None
+            self._async.popleft()
+            error = None
+        else:
+            with self._cond:
+                seq = self._next_result
+                if block:
+                    self._cond.wait_for(lambda: seq in self._done or self._stopped or self._alive == 0,
+                                        timeout)
+                if seq not in self._done:
+                    if self._alive == 0 and not self._stopped:
+                        raise RuntimeError("InferencePipeline: mọi worker thread đã dừng")
+                    return None
+                frame, output, error, submitted = self._done.pop(seq)
+
+        self._next_result += 1
+        if error is not None:
+            raise error
+
+        latency = time.perf_counter() - submitted
+        self.completed += 1
+        self.latency_total += latency
+        self.latency_max = max(self.latency_max, latency)
+        return InferenceResult(seq, frame, output, latency)
+
+    def process(self, frame):
+        """
+        Submit frame rồi trả kết quả cũ nhất nếu có
+
+        Chỉ chặn khi đã có `depth` request đang xử lý, nên với depth=1 hàm này
+        tương đương forward đồng bộ, với depth=N kết quả trễ tối đa N-1 frame.
+
+        Returns:
+            InferenceResult hoặc None khi pipeline còn đang được lấp đầy
+        """
+        self.submit(frame)
+        return self.get(block=self.in_flight >= self.depth)
+
+    def drain(self):
+        """Lấy nốt kết quả của mọi request còn đang xử lý (theo thứ tự)"""
+        results = []
+        while self.in_flight > 0:
+            results.append(self.get())
+        return results
+
+    def stats(self):
+        """
+        Thống kê inference
+
+        Returns:
+            dict: Số request đã xong, depth, số net và độ trễ trung bình/tối đa (ms)
+        """
+        avg = self.latency_total / self.completed if self.completed else 0.0
+        return {
+            'completed': self.completed,
+            'depth': self.depth,
+            'replicas': 1 if self.use_forward_async else len(self.nets),
+            'latency_avg_ms': avg * 1000,
+            'latency_max_ms': self.latency_max * 1000,
+        }
+
+    def close(self):
+        """Dừng các worker thread (request chưa xong bị bỏ)"""
+        with self._cond:
+            self._stopped = True
+            self._jobs.clear()
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join(timeout=2.0)
+
+
+class BatchInferenceServer:
+    """
+    Inference dùng chung cho nhiều camera, gộp frame thành batch
+
+    Các camera submit frame từ thread của mình; server gom tối đa batch_size
+    frame (hoặc chờ tối đa max_wait giây kể từ frame đầu tiên), tạo một blob
+    NCHW (buffer dùng lại của SSDPreprocessor), forward một lần rồi trả output về
+    Future của từng frame.
+    """
+
+    def __init__(self, net, batch_size=4, max_wait=0.01, preprocessor=None):
+        """
+        Args:
+            net: cv2.dnn.Net dùng chung
+            batch_size: Số frame tối đa mỗi lần forward
+            max_wait: Thời gian chờ tối đa để gom batch (giây)
+            preprocessor: Đối tượng có batch(frames) -> blob NCHW (mặc định SSDPreprocessor)
+        """
+        self.net = net
+        self.batch_size = max(1, batch_size)
+        self.max_wait = max_wait
+        self.preprocessor = preprocessor or SSDPreprocessor(batch_size=self.batch_size)
+
+        self._cond = threading.Condition()
+        self._queue = deque()
+        self._stopped = False
+        # Lỗi làm thread server dừng ngoài ý muốn (frame submit sau đó nhận ngay lỗi này)
+        self._error = None
+        self._batch = []
+
+        self.frames = 0
+        self.batches = 0
+        self.forward_s = 0.0
+        self._started = time.perf_counter()
+
+        self._thread = threading.Thread(target=self._run, name="dnn-batch-server", daemon=True)
+        self._thread.start()
+
+    def submit(self, frame):
+        """
+        Đưa một frame vào batch kế tiếp (không chặn)
+
+        Returns:
+            concurrent.futures.Future: Kết quả là output của net cho riêng frame này
+        """
+        future = Future()
+        with self._cond:
+            if self._stopped:
+                raise RuntimeError("BatchInferenceServer đã dừng")
+            if self._error is not None:
+                future.set_exception(self._error)
+                return future
+            self._queue.append((frame, future))
+            self._cond.notify()
+        return future
+
+    def connect(self, latency=None):
+        """
+        Tạo client cho một camera (cùng giao diện process/stats với InferencePipeline)
+
+        Args:
+            latency (StageLatency): Độ trễ của camera đó; forward được tính từ lúc
+                submit đến khi có output (gồm chờ gom batch và preprocess của server)
+        """
+        return BatchClient(self, latency)
+
+    def _take_batch(self):
+        with self._cond:
+            self._cond.wait_for(lambda: self._queue or self._stopped)
+            if self._stopped:
+                return []
+            deadline = time.perf_counter() + self.max_wait
+            while len(self._queue) < self.batch_size and not self._stopped:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            count = min(self.batch_size, len(self._queue))
+            return [self._queue.popleft() for _ in range(count)]
+
+    def _run(self):
+        try:
+            self._serve()
+        except BaseException as e:
+            # Thread server không còn: trả lỗi cho mọi frame đang chờ thay vì để caller chờ mãi
+            with self._cond:
+                self._error = RuntimeError(f"BatchInferenceServer dừng do lỗi: {e!r}")
+                pending = self._batch + list(self._queue)
+                self._queue.clear()
+            for _, future in pending:
+                if not future.done():
+                    future.set_exception(self._error)
+            raise
+
+    def _serve(self):
+        while True:
+            batch = self._batch = self._take_batch()
+            if not batch:
+                return
+            frames = [frame for frame, _ in batch]
+            start = time.perf_counter()
+            try:
+                self.net.setInput(self.preprocessor.batch(frames))
+                outputs = split_batch_output(self.net.forward(), len(frames))
+            except Exception as e:
+                # Lỗi của cv2.dnn, ONNX Runtime hoặc split_batch_output: trả về cho cả batch
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            self.forward_s += time.perf_counter() - start
+            self.frames += len(frames)
+            self.batches += 1
+            for (_, future), output in zip(batch, outputs):
+                future.set_result(output)
+
+    def stats(self):
+        """
+        Thống kê server
+
+        Returns:
+            dict: Số frame/batch, batch trung bình, throughput (frame/s theo thời
+                  gian thực và theo thời gian forward) và throughput trên mỗi core
+        """
+        elapsed = time.perf_counter() - self._started
+        fps = self.frames / elapsed if elapsed > 0 else 0.0
+        forward_fps = self.frames / self.forward_s if self.forward_s > 0 else 0.0
+        return {
+            'frames': self.frames,
+            'batches': self.batches,
+            'avg_batch': self.frames / self.batches if self.batches else 0.0,
+            'fps': fps,
+            'forward_fps': forward_fps,
+            'forward_fps_per_core': forward_fps / max(1, cv2.getNumThreads()),
+        }
+
+    def close(self):
+        """Dừng server, các frame chưa xử lý bị hủy"""
+        with self._cond:
+            self._stopped = True
+            pending = list(self._queue)
+            self._queue.clear()
+            self._cond.notify_all()
+        for _, future in pending:
+            future.cancel()
+        self._thread.join(timeout=2.0)
+
+
+class BatchClient:
+    """Client của một camera tới BatchInferenceServer"""
+
+    def __init__(self, server, latency=None):
+        self.server = server
+        self.latency = latency
+        self.depth = 1
+        self.completed = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+
+    def process(self, frame):
+        """
+        Chạy inference cho frame qua server (chặn đến khi batch chứa frame xong)
+
+        Returns:
+            InferenceResult
+        """
+        submitted = time.perf_counter()
+        output = self.server.submit(frame).result()
+        latency = time.perf_counter() - submitted
+        if self.latency is not None:
+            self.latency.record('forward', latency)
+        seq = self.completed
+        self.completed += 1
+        self.latency_total += latency
+        self.latency_max = max(self.latency_max, latency)
+        return InferenceResult(seq, frame, output, latency)
+
+    def stats(self):
+        """Thống kê của camera này (cùng khóa với InferencePipeline.stats)"""
+        avg = self.latency_total / self.completed if self.completed else 0.0
+        return {
+            'completed': self.completed,
+            'depth': self.depth,
+            'replicas': 1,
+            'latency_avg_ms': avg * 1000,
+            'latency_max_ms': self.latency_max * 1000,
+        }
+
+    def close(self):
+        """Server thuộc về nơi tạo ra nó nên không bị dừng ở đây"""
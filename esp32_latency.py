@@ -0,0 +1,304 @@
+"""
+Đo độ trễ theo từng công đoạn của pipeline detection
+
+Mỗi công đoạn (fetch, decode, preprocess, forward, postprocess, draw, publish)
+ghi thời gian theo đồng hồ monotonic (time.perf_counter) vào một histogram
+kiểu HDR: bucket log-tuyến tính theo micro giây, sai số tương đối < 1% trên
+cả dải 1 µs .. 60 s, ghi O(1) và không cấp phát. Từ histogram đọc được
+p50/p95/p99 của từng công đoạn cho mỗi camera, nên khi độ trễ tăng có thể biết
+ngay công đoạn nào chậm đi thay vì chỉ thấy FPS giảm.
+
+Các công đoạn chạy trên nhiều thread (capture, worker DNN, hiển thị,
+publisher); mỗi thread ghi vào histogram riêng của nó (không lock), các
+histogram chỉ được cộng lại khi đọc thống kê.
+"""
+import json
+import threading
+import time
+from collections import deque
+
+STAGES = ('fetch', 'decode', 'preprocess', 'forward', 'postprocess', 'draw', 'publish')
+
+
+class LatencyHistogram:
+    """
+    Histogram độ trễ kiểu HDR (micro giây)
+
+    Giá trị nhỏ hơn 2^sub_bucket_bits được đếm chính xác; từ đó trở lên mỗi
+    khoảng [2^k, 2^(k+1)) chia thành 2^(sub_bucket_bits-1) bucket đều nhau,
+    nên độ rộng bucket luôn nhỏ hơn 2^-(sub_bucket_bits-1) giá trị.
+    """
+
+    def __init__(self, sub_bucket_bits=8, max_us=60_000_000):
+        """
+        Args:
+            sub_bucket_bits: Số bit độ chính xác (8 = sai số < 0.8%)
+            max_us: Giá trị lớn nhất (lớn hơn bị ghi bằng max_us)
+        """
+        self.sub_bucket_bits = sub_bucket_bits
+        self.max_us = max_us
+        self._sub_count = 1 << sub_bucket_bits
+        self.counts = [0] * (self._index(max_us) + 1)
+        self.count = 0
+        self.total_us = 0
+        self.max_seen_us = 0
+
+    def _index(self, value):
+        if value < self._sub_count:
+            return value
+        shift = value.bit_length() - self.sub_bucket_bits
+        return (shift << (self.sub_bucket_bits - 1)) + (value >> shift)
+
+    def _bucket_range(self, index):
+        """Khoảng giá trị [low, high) của bucket"""
+        if index < self._sub_count:
+            return index, index + 1
+        shift = (index >> (self.sub_bucket_bits - 1)) - 1
+        low = (index - (shift << (self.sub_bucket_bits - 1))) << shift
+        return low, low + (1 << shift)
+
+    def record(self, seconds):
+        """Ghi một khoảng thời gian (giây)"""
+        value = min(max(int(seconds * 1e6), 0), self.max_us)
+        self.counts[self._index(value)] += 1
+        self.count += 1
+        self.total_us += value
+        if value > self.max_seen_us:
+            self.max_seen_us = value
+
+    def add(self, other):
+        """Cộng histogram khác (cùng cấu hình) vào histogram này"""
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.count += other.count
+        self.total_us += other.total_us
+        self.max_seen_us = max(self.max_seen_us, other.max_seen_us)
+        return self
+
+    def copy(self):
+        histogram = LatencyHistogram(self.sub_bucket_bits, self.max_us)
+        return histogram.add(self)
+
+    def since(self, earlier):
+        """
+        Histogram của các giá trị ghi sau `earlier` (một copy() trước đó)
+
+        Giá trị lớn nhất của khoảng được lấy theo bucket cao nhất.
+        """
+        histogram = LatencyHistogram(self.sub_bucket_bits, self.max_us)
+        histogram.counts = [a - b for a, b in zip(self.counts, earlier.counts)]
+        histogram.count = self.count - earlier.count
+        histogram.total_us = self.total_us - earlier.total_us
+        for index in range(len(histogram.counts) - 1, -1, -1):
+            if histogram.counts[index]:
+                histogram.max_seen_us = min(self._bucket_range(index)[1] - 1, self.max_seen_us)
+                break
+        return histogram
+
+    def percentiles(self, *ps):
+        """
+        Args:
+            *ps: Các percentile (0..100)
+
+        Returns:
+            list: Giá trị (ms) tại từng percentile, là điểm giữa bucket chứa nó
+        """
+        if self.count == 0:
+            return [0.0] * len(ps)
+        targets = sorted((max(1, -(-self.count * p // 100)), i) for i, p in enumerate(ps))
+        values = [0.0] * len(ps)
+        cumulative, t = 0, 0
+        for index, count in enumerate(self.counts):
+            if not count:
+                continue
+            cumulative += count
+            while t < len(targets) and cumulative >= targets[t][0]:
+                low, high = self._bucket_range(index)
+                values[targets[t][1]] = min((low + high - 1) / 2, self.max_seen_us) / 1000
+                t += 1
+            if t == len(targets):
+                break
+        return values
+
+    def percentile(self, p):
+        """Giá trị (ms) tại percentile p (0..100)"""
+        return self.percentiles(p)[0]
+
+    def summary(self):
+        """
+        Returns:
+            dict: {'count', 'mean_ms', 'p50_ms', 'p95_ms', 'p99_ms', 'max_ms'}
+        """
+        p50, p95, p99 = self.percentiles(50, 95, 99)
+        return {
+            'count': self.count,
+            'mean_ms': self.total_us / self.count / 1000 if self.count else 0.0,
+            'p50_ms': p50,
+            'p95_ms': p95,
+            'p99_ms': p99,
+            'max_ms': self.max_seen_us / 1000,
+        }
+
+
+class StageLatency:
+    """
+    Histogram độ trễ theo công đoạn cho một camera
+
+    record() có thể gọi từ bất kỳ thread nào: mỗi thread ghi vào bộ histogram
+    của riêng nó, stats()/histogram() cộng các bộ lại khi đọc.
+    """
+
+    def __init__(self, camera, stages=STAGES, export_path=None, export_interval=10.0):
+        """
+        Args:
+            camera (str): Tên/IP camera (ghi kèm mỗi dòng JSON)
+            stages: Thứ tự công đoạn khi in và export
+            export_path: File JSON lines nhận thống kê định kỳ (xem maybe_export), None = tắt
+            export_interval: Khoảng thời gian giữa hai lần export (giây)
+        """
+        self.camera = camera
+        self.stages = tuple(stages)
+        self.export_path = export_path
+        self.export_interval = export_interval
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._threads = []
+        self._exported = {}
+        self._last_export = time.perf_counter()
+
+    def _histograms(self):
+        try:
+            return self._local.histograms
+        except AttributeError:
+            histograms = self._local.histograms = {}
+            with self._lock:
+                self._threads.append(histograms)
+            return histograms
+
+    def record(self, stage, seconds):
+        """Ghi thời gian (giây) của một lần chạy công đoạn"""
+        histograms = self._histograms()
+        histogram = histograms.get(stage)
+        if histogram is None:
+            histogram = histograms[stage] = LatencyHistogram()
+        histogram.record(seconds)
+
+    def lap(self, stage, start):
+        """
+        Ghi thời gian từ start đến hiện tại cho stage
+
+        Returns:
+            float: time.perf_counter() hiện tại, dùng làm start của công đoạn kế tiếp
+        """
+        now = time.perf_counter()
+        self.record(stage, now - start)
+        return now
+
+    def histogram(self, stage):
+        """Histogram của stage, cộng từ mọi thread (None nếu chưa có lần ghi nào)"""
+        with self._lock:
+            threads = list(self._threads)
+        merged = None
+        for histograms in threads:
+            histogram = histograms.get(stage)
+            if histogram is not None:
+                merged = histogram.copy() if merged is None else merged.add(histogram)
+        return merged
+
+    def _ordered_stages(self):
+        with self._lock:
+            threads = list(self._threads)
+        seen = set()
+        for histograms in threads:
+            seen.update(list(histograms))
+        return [stage for stage in self.stages if stage in seen] + sorted(seen - set(self.stages))
+
+    def stats(self):
+        """
+        Returns:
+            dict: {stage: LatencyHistogram.summary()} của các công đoạn đã có số đo
+        """
+        return {stage: self.histogram(stage).summary() for stage in self._ordered_stages()}
+
+    def reset(self):
+        """Xóa số đo (histogram đang được thread khác ghi sẽ được thay ở lần ghi kế tiếp)"""
+        with self._lock:
+            for histograms in self._threads:
+                histograms.clear()
+            self._exported = {}
+
+    def export_jsonl(self, path=None):
+        """
+        Ghi thêm vào file JSON lines một dòng cho mỗi công đoạn
+
+        Mỗi dòng là thống kê của khoảng từ lần export trước (không phải cộng dồn),
+        nên so sánh các dòng liên tiếp sẽ thấy được công đoạn nào chậm đi:
+        {"ts", "camera", "stage", "interval_s", "count", "mean_ms", "p50_ms", "p95_ms", "p99_ms", "max_ms"}
+
+        Args:
+            path: File đích (mặc định export_path)
+
+        Returns:
+            int: Số dòng đã ghi
+        """
+        path = path or self.export_path
+        now = time.perf_counter()
+        interval = now - self._last_export
+        self._last_export = now
+        lines = []
+        for stage in self._ordered_stages():
+            histogram = self.histogram(stage)
+            previous = self._exported.get(stage)
+            self._exported[stage] = histogram
+            if previous is not None:
+                histogram = histogram.since(previous)
+            if histogram.count == 0:
+                continue
+            record = {'ts': round(time.time(), 3), 'camera': self.camera, 'stage': stage,
+                      'interval_s': round(interval, 3)}
+            record.update({key: round(value, 3) for key, value in histogram.summary().items()})
+            lines.append(json.dumps(record))
+        if lines:
+            with open(path, 'a', encoding='utf-8') as f:
+                f.write('\n'.join(lines) + '\n')
+        return len(lines)
+
+    def maybe_export(self):
+        """Export nếu có export_path và đã qua export_interval từ lần trước (gọi mỗi frame)"""
+        if self.export_path and time.perf_counter() - self._last_export >= self.export_interval:
+            self.export_jsonl()
+
+    def print_stats(self, indent="   - "):
+        """In p50/p95/p99/max của từng công đoạn"""
+        stats = self.stats()
+        if not stats:
+            return
+        print(f"{indent}Độ trễ theo công đoạn ({self.camera}), ms p50 / p95 / p99 / max:")
+        for stage, s in stats.items():
+            print(f"       {stage:<12s} {s['p50_ms']:7.1f} {s['p95_ms']:7.1f} {s['p99_ms']:7.1f} "
+                  f"{s['max_ms']:7.1f}  ({s['count']} lần)")
+
+
+class FrameRate:
+    """FPS theo cửa sổ trượt của các frame gần nhất (có giá trị ngay từ frame thứ 2)"""
+
+    def __init__(self, window=30):
+        self._times = deque(maxlen=window)
+        self.frames = 0
+
+    def tick(self):
+        """
+        Đánh dấu một frame đã xử lý xong
+
+        Returns:
+            float: FPS hiện tại
+        """
+        self._times.append(time.perf_counter())
+        self.frames += 1
+        return self.fps
+
+    @property
+    def fps(self):
+        if len(self._times) < 2:
+            return 0.0
+        elapsed = self._times[-1] - self._times[0]
+        return (len(self._times) - 1) / elapsed if elapsed > 0 else 0.0
@@ -0,0 +1,180 @@
+"""
+Endpoint metrics dạng text của Prometheus cho detector chạy lâu ngày
+
+MetricsServer chạy http.server (thư viện chuẩn) trên thread riêng, mặc định
+chỉ nghe 127.0.0.1. Metrics được lấy theo kiểu pull: hàm collect() chỉ chạy
+khi có request GET /metrics và đọc lại các bộ đếm mà pipeline vốn đã giữ
+(stats() của frame source, HTTP client, publisher, StageLatency), nên vòng
+inference không làm thêm việc gì cho mỗi frame ngoài các phép cộng sẵn có.
+Bộ đếm mới cần tăng trong vòng lặp (ví dụ số detection theo class) dùng
+Counters: mỗi thread tăng dict của riêng nó, không lock.
+
+    scrape_configs:
+      - job_name: esp32
+        static_configs:
+          - targets: ['localhost:9100']
+"""
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class Counters:
+    """Bộ đếm theo khóa, mỗi thread tăng dict riêng (không lock), cộng lại khi đọc"""
+
+    def __init__(self):
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def _counts(self):
+        try:
+            return self._local.counts
+        except AttributeError:
+            counts = self._local.counts = {}
+            with self._lock:
+                self._threads.append(counts)
+            return counts
+
+    def inc(self, key, amount=1):
+        counts = self._counts()
+        counts[key] = counts.get(key, 0) + amount
+
+    def update(self, keys):
+        """Tăng 1 cho mỗi khóa trong keys (có thể lặp lại)"""
+        counts = self._counts()
+        for key in keys:
+            counts[key] = counts.get(key, 0) + 1
+
+    def snapshot(self):
+        """
+        Returns:
+            dict: {khóa: tổng của mọi thread}
+        """
+        with self._lock:
+            threads = list(self._threads)
+        total = {}
+        for counts in threads:
+            for key, value in dict(counts).items():
+                total[key] = total.get(key, 0) + value
+        return total
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + '}'
+
+
+def counter(name, help_text, samples):
+    """
+    Args:
+        name: Tên metric (nên kết thúc bằng _total)
+        samples: [(labels dict, giá trị), ...]
+
+    Returns:
+        tuple: Metric family cho format_metrics
+    """
+    return name, 'counter', help_text, [('', labels, value) for labels, value in samples]
+
+
+def gauge(name, help_text, samples):
+    """Như counter, cho giá trị có thể tăng giảm"""
+    return name, 'gauge', help_text, [('', labels, value) for labels, value in samples]
+
+
+def latency_summary(name, help_text, latency, labels=None):
+    """
+    Summary p50/p95/p99 (giây) của từng công đoạn trong StageLatency
+
+    Args:
+        name: Tên metric (ví dụ esp32_stage_latency_seconds)
+        latency (StageLatency): Nguồn số đo
+        labels (dict): Nhãn thêm vào mọi sample (ví dụ camera)
+
+    Returns:
+        tuple: Metric family cho format_metrics
+    """
+    samples = []
+    for stage, stats in latency.stats().items():
+        stage_labels = dict(labels or {}, stage=stage)
+        for quantile, key in (('0.5', 'p50_ms'), ('0.95', 'p95_ms'), ('0.99', 'p99_ms')):
+            samples.append(('', dict(stage_labels, quantile=quantile), stats[key] / 1000))
+        samples.append(('_sum', stage_labels, stats['mean_ms'] * stats['count'] / 1000))
+        samples.append(('_count', stage_labels, stats['count']))
+    return name, 'summary', help_text, samples
+
+
+def format_metrics(families):
+    """
+    Ghi các metric family theo text exposition format 0.0.4 của Prometheus
+
+    Args:
+        families: [(name, type, help, [(suffix, labels, value), ...]), ...]
+
+    Returns:
+        str
+    """
+    lines = []
+    for name, metric_type, help_text, samples in families:
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        for suffix, labels, value in samples:
+            lines.append(f"{name}{suffix}{_labels(labels)} {float(value)!r}")
+    return '\n'.join(lines) + '\n'
+
+
+class MetricsServer:
+    """Phục vụ GET /metrics trên thread riêng (http.server, không thư viện ngoài)"""
+
+    def __init__(self, collect, port=9100, host='127.0.0.1'):
+        """
+        Args:
+            collect: Hàm không tham số trả về list metric family, gọi trên thread của server
+                mỗi lần scrape
+            port: Cổng HTTP (0 = cổng trống bất kỳ)
+            host: Địa chỉ nghe (mặc định chỉ máy này; '0.0.0.0' để Prometheus ở máy khác scrape)
+        """
+        self.collect = collect
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # Client treo không giữ server quá lâu (một scrape một lúc)
+            timeout = 5
+
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/metrics', '/'):
+                    self.send_error(404)
+                    return
+                try:
+                    body = format_metrics(server.collect()).encode('utf-8')
+                except Exception as e:
+                    self.send_error(500, explain=str(e))
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', CONTENT_TYPE)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._httpd = HTTPServer((host, port), Handler)
+        self.host, self.port = self._httpd.server_address[:2]
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="esp32-metrics", daemon=True)
+        self._thread.start()
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}/metrics"
+
+    def close(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        self._thread.join(timeout=2)
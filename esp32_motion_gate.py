@@ -0,0 +1,113 @@
+"""
+Bỏ qua inference khi cảnh gần như không đổi (người dùng đứng yên)
+
+Mỗi frame được thu nhỏ thành thumbnail gray (mặc định 64x48, vài trăm micro
+giây) và so với thumbnail của frame được inference gần nhất. Nếu tỉ lệ pixel
+thay đổi nhỏ hơn ngưỡng thì detector dùng lại detections cũ; sau
+refresh_interval frame bỏ qua liên tiếp thì luôn inference lại.
+"""
+import time
+
+import cv2
+import numpy as np
+
+
+class MotionGate:
+    """Quyết định frame nào cần chạy inference dựa trên độ khác biệt thumbnail"""
+
+    def __init__(self, change_ratio=0.02, pixel_threshold=12, size=(64, 48), refresh_interval=30):
+        """
+        Args:
+            change_ratio: Tỉ lệ pixel thumbnail thay đổi tối thiểu để chạy inference
+            pixel_threshold: Độ chênh gray (0..255) để coi một pixel là thay đổi
+            size: (width, height) của thumbnail
+            refresh_interval: Số frame bỏ qua liên tiếp tối đa trước khi bắt buộc inference
+        """
+        self.change_ratio = change_ratio
+        self.pixel_threshold = pixel_threshold
+        self.size = tuple(size)
+        self.refresh_interval = refresh_interval
+        width, height = self.size
+        self._small = np.empty((height, width, 3), dtype=np.uint8)
+        self._gray = np.empty((height, width), dtype=np.uint8)
+        self._diff = np.empty((height, width), dtype=np.uint8)
+        self._reference = None
+        self._skipped_in_row = 0
+        self.last_change = 1.0
+        self._stats = {'frames': 0, 'inferred': 0, 'skipped': 0, 'forced': 0, 'gate_s': 0.0}
+
+    def _thumbnail(self, frame):
+        if frame.ndim == 2:
+            cv2.resize(frame, self.size, dst=self._gray, interpolation=cv2.INTER_AREA)
+        else:
+            cv2.resize(frame, self.size, dst=self._small, interpolation=cv2.INTER_AREA)
+            cv2.cvtColor(self._small, cv2.COLOR_BGR2GRAY, dst=self._gray)
+        return self._gray
+
+    def check(self, frame):
+        """
+        Frame này có cần chạy inference không
+
+        Trả True thì thumbnail của frame trở thành mốc so sánh cho các frame sau,
+        nên chỉ gọi một lần mỗi frame và phải chạy inference khi nhận True.
+
+        Returns:
+            bool: True nếu cần inference, False nếu dùng lại detections trước
+        """
+        start = time.perf_counter()
+        self._stats['frames'] += 1
+        gray = self._thumbnail(frame)
+
+        if self._reference is None:
+            infer = True
+        elif self._skipped_in_row >= self.refresh_interval:
+            infer = True
+            self._stats['forced'] += 1
+        else:
+            cv2.absdiff(gray, self._reference, dst=self._diff)
+            self.last_change = np.count_nonzero(self._diff > self.pixel_threshold) / self._diff.size
+            infer = self.last_change >= self.change_ratio
+
+        if infer:
+            if self._reference is None:
+                self._reference = gray.copy()
+            else:
+                np.copyto(self._reference, gray)
+            self._skipped_in_row = 0
+            self._stats['inferred'] += 1
+        else:
+            self._skipped_in_row += 1
+            self._stats['skipped'] += 1
+        self._stats['gate_s'] += time.perf_counter() - start
+        return infer
+
+    def reset(self):
+        """Bắt buộc inference ở frame kế tiếp"""
+        self._reference = None
+
+    def stats(self, inference_ms=0.0):
+        """
+        Args:
+            inference_ms: Chi phí trung bình một lần inference (ms) để ước tính phần tiết kiệm
+
+        Returns:
+            dict: {'frames', 'inferred', 'skipped', 'forced', 'skip_rate', 'gate_avg_ms', 'saved_s'}
+        """
+        s = self._stats
+        return {
+            'frames': s['frames'],
+            'inferred': s['inferred'],
+            'skipped': s['skipped'],
+            'forced': s['forced'],
+            'skip_rate': s['skipped'] / s['frames'] if s['frames'] else 0.0,
+            'gate_avg_ms': s['gate_s'] / s['frames'] * 1000 if s['frames'] else 0.0,
+            # Phần inference không phải chạy trừ chi phí của chính gate
+            'saved_s': s['skipped'] * inference_ms / 1000 - s['gate_s'],
+        }
+
+    def print_stats(self, inference_ms=0.0):
+        """In một dòng thống kê cho _print_final_stats"""
+        s = self.stats(inference_ms)
+        print(f"   - Motion gate: bỏ qua {s['skipped']}/{s['frames']} frames ({s['skip_rate'] * 100:.0f}%), "
+              f"refresh bắt buộc {s['forced']} lần, gate {s['gate_avg_ms']:.2f} ms/frame, "
+              f"tiết kiệm ~{s['saved_s']:.1f}s inference")
@@ -1,24 +1,43 @@
 import cv2
 import numpy as np
-import requests
-from PIL import Image
-import io
 import time
 import threading
 from collections import deque
 import urllib.request
 import os
+import sys
+
+from esp32_cascades import cascade_lock, get_cascade
+from esp32_display import create_display
+from esp32_dnn_config import load_tuned_net
+from esp32_frame_source import CaptureFrameSource, LatestFrameGrabber
+from esp32_inference import SSDPreprocessor
+from esp32_latency import FrameRate, StageLatency
+from esp32_postprocess import postprocess_ssd
 
 class ESP32CamObjectDetector:
-    def __init__(self, esp32_ip="192.168.1.14"):
+    def __init__(self, esp32_ip="192.168.1.14", frame_source=None, headless=False):
         """
         Detector đồ vật cho ESP32-CAM sử dụng MobileNet SSD
         
         Args:
             esp32_ip (str): IP address của ESP32-CAM
+            frame_source (FrameSource): Nguồn frame (mặc định poll /capture trên thread riêng)
+            headless (bool): Không vẽ và không mở cửa sổ (thoát bằng Ctrl+C); khi hiển thị,
+                việc vẽ chạy trên thread riêng (esp32_display)
         """
         self.esp32_ip = esp32_ip
+        self.headless = headless
+        self.display = None
         self.stream_url = f"http://{esp32_ip}/capture"
+        self.frame_source = frame_source or LatestFrameGrabber(
+            CaptureFrameSource(self.stream_url, timeout=2)
+        )
+        self.stream_url = self.frame_source.url
+        
+        # Độ trễ theo công đoạn (fetch/decode đo trong frame source)
+        self.latency = StageLatency(esp32_ip)
+        self.frame_source.latency = self.latency
         
         # Danh sách các class có thể nhận diện
         self.classes = [
@@ -44,6 +63,7 @@ class ESP32CamObjectDetector:
         # Khởi tạo MobileNet SSD
         self.net = None
         self.model_loaded = False
+        self.preprocess = SSDPreprocessor()
         
         # Buffer để smoothing detections
         self.detection_buffer = deque(maxlen=3)
@@ -100,7 +120,7 @@ class ESP32CamObjectDetector:
     def _initialize_network(self):
         """Khởi tạo neural network"""
         try:
-            self.net = cv2.dnn.readNetFromCaffe(
+            self.net = load_tuned_net(
                 'MobileNetSSD_deploy.prototxt.txt',
                 'MobileNetSSD_deploy.caffemodel'
             )
@@ -117,26 +137,8 @@ class ESP32CamObjectDetector:
         Returns:
             numpy.ndarray: Frame image hoặc None nếu lỗi
         """
-        try:
-            response = requests.get(self.stream_url, timeout=2)
-            if response.status_code == 200:
-                image = Image.open(io.BytesIO(response.content))
-                frame = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
-                
-                # Resize để tối ưu hiệu suất
-                height, width = frame.shape[:2]
-                if width > 640:
-                    scale = 640 / width
-                    new_width = 640
-                    new_height = int(height * scale)
-                    frame = cv2.resize(frame, (new_width, new_height))
-                
-                return frame
-            else:
-                return None
-        except Exception as e:
-            return None
-    
+        return self.frame_source.read()
+
     def detect_objects_advanced(self, frame):
         """
         Nhận diện đồ vật bằng MobileNet SSD
@@ -150,76 +152,72 @@ class ESP32CamObjectDetector:
         if not self.model_loaded:
             return frame, []
         
-        height, width = frame.shape[:2]
+        detections_info, object_counts = self.find_objects_advanced(frame)
+        self.draw_objects_advanced(frame, detections_info)
+        return frame, detections_info, object_counts
+    
+    def find_objects_advanced(self, frame):
+        """
+        Chạy MobileNet SSD trên frame (không vẽ)
         
-        # Chuẩn bị blob cho MobileNet SSD
-        blob = cv2.dnn.blobFromImage(
-            frame, 0.007843, (300, 300), 127.5
-        )
+        Returns:
+            tuple: (detections_info, object_counts)
+        """
+        height, width = frame.shape[:2]
         
-        # Đưa blob vào network
-        self.net.setInput(blob)
+        # Chuẩn bị blob cho MobileNet SSD và đưa vào network
+        start = time.perf_counter()
+        self.net.setInput(self.preprocess(frame))
+        start = self.latency.lap('preprocess', start)
         detections = self.net.forward()
+        start = self.latency.lap('forward', start)
         
         detections_info = []
         object_counts = {}
         
-        # Xử lý kết quả detection
-        for i in range(detections.shape[2]):
-            confidence = detections[0, 0, i, 2]
+        # Xử lý kết quả detection (vector hóa), confidence > 0.4 để tăng độ nhạy
+        results = postprocess_ssd(detections, width, height, 0.4, num_classes=len(self.classes))
+        for class_id, confidence, x_left, y_top, x_right, y_bottom in results.tolist():
+            class_name = self.classes[class_id]
+            detections_info.append({
+                'class': class_name,
+                'confidence': confidence,
+                'bbox': (x_left, y_top, x_right, y_bottom)
+            })
             
-            # Chỉ hiển thị detections với confidence > 0.4 (giảm để tăng độ nhạy)
-            if confidence > 0.4:
-                class_id = int(detections[0, 0, i, 1])
-                class_name = self.classes[class_id]
-                
-                # Tính toán bounding box
-                x_left = int(detections[0, 0, i, 3] * width)
-                y_top = int(detections[0, 0, i, 4] * height)
-                x_right = int(detections[0, 0, i, 5] * width)
-                y_bottom = int(detections[0, 0, i, 6] * height)
-                
-                # Đảm bảo coordinates hợp lệ
-                x_left = max(0, x_left)
-                y_top = max(0, y_top)
-                x_right = min(width, x_right)
-                y_bottom = min(height, y_bottom)
-                
-                # Vẽ bounding box
-                color = self.colors[class_id]
-                cv2.rectangle(frame, (x_left, y_top), (x_right, y_bottom), color, 2)
-                
-                # Vẽ label
-                label = f"{class_name}: {confidence:.2f}"
-                label_size = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, 0.5, 2)[0]
-                
-                # Vẽ background cho label
-                cv2.rectangle(
-                    frame, 
-                    (x_left, y_top - label_size[1] - 10),
-                    (x_left + label_size[0], y_top),
-                    color, -1
-                )
-                
-                cv2.putText(
-                    frame, label,
-                    (x_left, y_top - 5),
-                    cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 2
-                )
-                
-                detections_info.append({
-                    'class': class_name,
-                    'confidence': confidence,
-                    'bbox': (x_left, y_top, x_right, y_bottom)
-                })
-                
-                # Đếm objects
-                if class_name in object_counts:
-                    object_counts[class_name] += 1
-                else:
-                    object_counts[class_name] = 1
+            # Đếm objects
+            object_counts[class_name] = object_counts.get(class_name, 0) + 1
         
-        return frame, detections_info, object_counts
+        self.latency.lap('postprocess', start)
+        return detections_info, object_counts
+    
+    def draw_objects_advanced(self, frame, detections_info):
+        """Vẽ bounding box và label của MobileNet SSD lên frame"""
+        for detection in detections_info:
+            x_left, y_top, x_right, y_bottom = detection['bbox']
+            
+            # Vẽ bounding box
+            color = self.colors[self.classes.index(detection['class'])]
+            cv2.rectangle(frame, (x_left, y_top), (x_right, y_bottom), color, 2)
+            
+            # Vẽ label
+            label = f"{detection['class']}: {detection['confidence']:.2f}"
+            label_size = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, 0.5, 2)[0]
+            
+            # Vẽ background cho label
+            cv2.rectangle(
+                frame, 
+                (x_left, y_top - label_size[1] - 10),
+                (x_left + label_size[0], y_top),
+                color, -1
+            )
+            
+            cv2.putText(
+                frame, label,
+                (x_left, y_top - 5),
+                cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 2
+            )
+        return frame
     
     def detect_objects_simple(self, frame):
         """
@@ -231,23 +229,36 @@ class ESP32CamObjectDetector:
         Returns:
             tuple: (frame_with_detections, detections_info)
         """
+        detections_info, object_counts = self.find_objects_simple(frame)
+        self.draw_objects_simple(frame, detections_info)
+        return frame, detections_info, object_counts
+    
+    def find_objects_simple(self, frame):
+        """
+        Chạy Haar Cascade xe hơi trên frame (không vẽ)
+        
+        Returns:
+            tuple: (detections_info, object_counts)
+        """
+        start = time.perf_counter()
         gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        start = self.latency.lap('preprocess', start)
         detections_info = []
         object_counts = {}
         
         # Nhận diện xe hơi
-        car_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_car.xml')
-        if not car_cascade.empty():
-            cars = car_cascade.detectMultiScale(
-                gray,
-                scaleFactor=1.1,
-                minNeighbors=3,
-                minSize=(30, 30)
-            )
+        car_cascade = get_cascade('haarcascade_car.xml')
+        if car_cascade is not None:
+            with cascade_lock(car_cascade):
+                cars = car_cascade.detectMultiScale(
+                    gray,
+                    scaleFactor=1.1,
+                    minNeighbors=3,
+                    minSize=(30, 30)
+                )
+            self.latency.lap('forward', start)
             
-            for i, (x, y, w, h) in enumerate(cars):
-                cv2.rectangle(frame, (x, y), (x+w, y+h), (0, 255, 0), 2)
-                cv2.putText(frame, f'Car {i+1}', (x, y-10), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
+            for x, y, w, h in cars:
                 detections_info.append({
                     'class': 'car',
                     'confidence': 1.0,
@@ -255,7 +266,56 @@ class ESP32CamObjectDetector:
                 })
                 object_counts['car'] = object_counts.get('car', 0) + 1
         
-        return frame, detections_info, object_counts
+        return detections_info, object_counts
+    
+    def draw_objects_simple(self, frame, detections_info):
+        """Vẽ bounding box (x, y, w, h) của Haar Cascade lên frame"""
+        for i, detection in enumerate(detections_info):
+            x, y, w, h = detection['bbox']
+            cv2.rectangle(frame, (x, y), (x+w, y+h), (0, 255, 0), 2)
+            cv2.putText(frame, f'Car {i+1}', (x, y-10), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
+        return frame
+    
+    def render_frame(self, frame, snapshot):
+        """
+        Vẽ frame để hiển thị (chạy trên thread hiển thị)
+        
+        Args:
+            frame: Frame đã chạy detection
+            snapshot: (detections, object_counts, fps, advanced)
+        """
+        detections, object_counts, fps, advanced = snapshot
+        if advanced:
+            self.draw_objects_advanced(frame, detections)
+            mode_text = "Advanced (MobileNet SSD)"
+        else:
+            self.draw_objects_simple(frame, detections)
+            mode_text = "Simple (Haar Cascade)"
+        
+        # Hiển thị thông tin
+        cv2.putText(frame, f"Objects: {len(detections)}", (10, 30), 
+                   cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 255), 2)
+        
+        if fps > 0:
+            cv2.putText(frame, f"FPS: {fps:.1f}", (10, 60), 
+                       cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2)
+        
+        cv2.putText(frame, f"Mode: {mode_text}", (10, 90), 
+                   cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 0), 2)
+        
+        cv2.putText(frame, f"ESP32: {self.esp32_ip}", 
+                   (10, frame.shape[0] - 10), 
+                   cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1)
+        
+        # Hiển thị top objects
+        if object_counts:
+            sorted_objects = sorted(object_counts.items(), key=lambda x: x[1], reverse=True)
+            y_offset = 120
+            for i, (obj_name, count) in enumerate(sorted_objects[:3]):  # Top 3
+                cv2.putText(frame, f"{obj_name}: {count}", 
+                           (10, y_offset + i*20), 
+                           cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 1)
+        return frame
     
     def run_detection(self):
         """
@@ -268,101 +328,80 @@ class ESP32CamObjectDetector:
         print("   - 'r': Reset thống kê")
         print("   - 'm': Chuyển đổi chế độ (Advanced/Simple)")
         
-        fps_counter = 0
-        fps_start_time = time.time()
+        frame_rate = FrameRate()
         last_print_time = time.time()
         use_advanced = self.model_loaded
+        # Vẽ và hiển thị trên thread riêng (hoặc không vẽ gì khi headless);
+        # thời gian vẽ ghi vào công đoạn draw
+        self.display = create_display('ESP32-CAM Object Detection', self.render_frame,
+                                      headless=self.headless, latency=self.latency)
         
-        while True:
-            current_time = time.time()
-            
-            # Lấy frame
-            frame = self.get_frame_from_esp32()
-            
-            if frame is None:
-                time.sleep(0.1)
-                continue
-            
-            # Nhận diện objects
-            if use_advanced and self.model_loaded:
-                frame_with_detections, detections, object_counts = self.detect_objects_advanced(frame)
-                mode_text = "Advanced (MobileNet SSD)"
-            else:
-                frame_with_detections, detections, object_counts = self.detect_objects_simple(frame)
-                mode_text = "Simple (Haar Cascade)"
-            
-            # Tính FPS
-            fps_counter += 1
-            if fps_counter % 30 == 0:
-                fps = fps_counter / (current_time - fps_start_time)
-                fps_counter = 0
-                fps_start_time = current_time
-            else:
-                fps = 0
-            
-            # Hiển thị thông tin
-            cv2.putText(frame_with_detections, f"Objects: {len(detections)}", (10, 30), 
-                       cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 255), 2)
-            
-            if fps > 0:
-                cv2.putText(frame_with_detections, f"FPS: {fps:.1f}", (10, 60), 
-                           cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2)
-            
-            cv2.putText(frame_with_detections, f"Mode: {mode_text}", (10, 90), 
-                       cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 0), 2)
-            
-            cv2.putText(frame_with_detections, f"ESP32: {self.esp32_ip}", 
-                       (10, frame_with_detections.shape[0] - 10), 
-                       cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1)
-            
-            # Hiển thị top objects
-            if object_counts:
-                sorted_objects = sorted(object_counts.items(), key=lambda x: x[1], reverse=True)
-                y_offset = 120
-                for i, (obj_name, count) in enumerate(sorted_objects[:3]):  # Top 3
-                    cv2.putText(frame_with_detections, f"{obj_name}: {count}", 
-                               (10, y_offset + i*20), 
-                               cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 1)
-            
-            # Hiển thị frame
-            cv2.imshow('ESP32-CAM Object Detection', frame_with_detections)
-            
-            # Cập nhật thống kê
-            self.detection_stats['total_objects'] += len(detections)
-            self.detection_stats['total_frames'] += 1
-            
-            for obj_name, count in object_counts.items():
-                if obj_name in self.detection_stats['object_counts']:
-                    self.detection_stats['object_counts'][obj_name] += count
-                else:
-                    self.detection_stats['object_counts'][obj_name] = count
-            
-            # In thông tin định kỳ
-            if current_time - last_print_time > 5:  # Mỗi 5 giây
-                print(f"📊 Detections: {len(detections)} objects")
-                if object_counts:
-                    print(f"   Top objects: {dict(list(sorted_objects)[:3])}")
-                last_print_time = current_time
-            
-            # Xử lý phím
-            key = cv2.waitKey(1) & 0xFF
-            if key == ord('q'):
-                break
-            elif key == ord('s'):
-                filename = f"esp32_objects_{int(time.time())}.jpg"
-                cv2.imwrite(filename, frame_with_detections)
-                print(f"📸 Đã chụp ảnh: {filename}")
-            elif key == ord('r'):
-                self.detection_stats = {'total_objects': 0, 'object_counts': {}, 'total_frames': 0}
-                print("🔄 Đã reset thống kê")
-            elif key == ord('m'):
-                if self.model_loaded:
-                    use_advanced = not use_advanced
-                    print(f"🔄 Chuyển sang chế độ: {'Advanced' if use_advanced else 'Simple'}")
+        try:
+            while True:
+                current_time = time.time()
+                
+                # Lấy frame
+                frame = self.get_frame_from_esp32()
+                
+                if frame is None:
+                    time.sleep(0.1)
+                    continue
+                
+                # Nhận diện objects (không vẽ trên thread này)
+                advanced = use_advanced and self.model_loaded
+                if advanced:
+                    detections, object_counts = self.find_objects_advanced(frame)
                 else:
-                    print("⚠️ Chế độ Advanced không khả dụng (model chưa tải)")
+                    detections, object_counts = self.find_objects_simple(frame)
+                
+                # FPS theo 30 frame gần nhất
+                fps = frame_rate.tick()
+                
+                # Vẽ trên thread hiển thị từ snapshot của frame này
+                self.display.show(frame, (detections, object_counts, fps, advanced))
+                
+                # Cập nhật thống kê
+                self.detection_stats['total_objects'] += len(detections)
+                self.detection_stats['total_frames'] += 1
+                
+                for obj_name, count in object_counts.items():
+                    if obj_name in self.detection_stats['object_counts']:
+                        self.detection_stats['object_counts'][obj_name] += count
+                    else:
+                        self.detection_stats['object_counts'][obj_name] = count
+                
+                # In thông tin định kỳ
+                if current_time - last_print_time > 5:  # Mỗi 5 giây
+                    print(f"📊 Detections: {len(detections)} objects")
+                    if object_counts:
+                        sorted_objects = sorted(object_counts.items(), key=lambda x: x[1], reverse=True)
+                        print(f"   Top objects: {dict(sorted_objects[:3])}")
+                    last_print_time = current_time
+                
+                # Xử lý phím
+                key = self.display.poll_key()
+                if key == ord('q'):
+                    break
+                elif key == ord('s') and self.display.last_image is not None:
+                    filename = f"esp32_objects_{int(time.time())}.jpg"
+                    cv2.imwrite(filename, self.display.last_image)
+                    print(f"📸 Đã chụp ảnh: {filename}")
+                elif key == ord('r'):
+                    self.detection_stats = {'total_objects': 0, 'object_counts': {}, 'total_frames': 0}
+                    self.latency.reset()
+                    print("🔄 Đã reset thống kê")
+                elif key == ord('m'):
+                    if self.model_loaded:
+                        use_advanced = not use_advanced
+                        print(f"🔄 Chuyển sang chế độ: {'Advanced' if use_advanced else 'Simple'}")
+                    else:
+                        print("⚠️ Chế độ Advanced không khả dụng (model chưa tải)")
+        except KeyboardInterrupt:
+            # Cách thoát duy nhất khi headless
+            pass
         
-        cv2.destroyAllWindows()
+        self.frame_source.close()
+        self.display.close()
         self._print_final_stats()
     
     def _print_final_stats(self):
@@ -370,6 +409,12 @@ class ESP32CamObjectDetector:
         print("\n📊 Thống kê cuối:")
         print(f"   - Tổng frames: {self.detection_stats['total_frames']}")
         print(f"   - Tổng objects: {self.detection_stats['total_objects']}")
+        capture_stats = self.frame_source.stats()
+        if capture_stats:
+            print(f"   - Capture: {capture_stats['captured']} frames, "
+                  f"dropped {capture_stats['dropped']}, errors {capture_stats['errors']}, "
+                  f"trùng (bỏ qua) {capture_stats['duplicates']}")
+        self.latency.print_stats()
         
         if self.detection_stats['object_counts']:
             print("   - Top objects được nhận diện:")
@@ -379,5 +424,5 @@ class ESP32CamObjectDetector:
                 print(f"     {obj_name}: {count}")
 
 if __name__ == "__main__":
-    detector = ESP32CamObjectDetector("192.168.1.14")
+    detector = ESP32CamObjectDetector("192.168.1.14", headless="--headless" in sys.argv)
     detector.run_detection()
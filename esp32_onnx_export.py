@@ -0,0 +1,279 @@
+"""
+Chuyển model sang ONNX (làm một lần) để chạy bằng ONNX Runtime (esp32_engines.py)
+
+    ssd   MobileNetSSD_deploy.prototxt + .caffemodel -> MobileNetSSD_deploy.onnx
+          Không cần Caffe: trọng số được đọc qua cv2.dnn, BatchNorm/Scale được gộp
+          vào Convolution. Phần PriorBox/DetectionOutput (không có trong ONNX chuẩn)
+          được thay bằng output hằng 'mbox_priorbox' và giải mã + NMS bằng NumPy
+          trong OnnxSSDEngine.
+    yolo  yolov8n.pt -> yolov8n.onnx qua exporter của ultralytics
+
+Cần: pip install onnx (ssd), pip install ultralytics (yolo)
+
+Chạy từ thư mục gốc của repo:
+    python esp32_onnx_export.py ssd
+    python esp32_onnx_export.py yolo --weights api/yolov8n.pt --imgsz 640
+"""
+import argparse
+import os
+import re
+
+import cv2
+import numpy as np
+
+# Các layer chỉ sinh prior box, được tính sẵn một lần bằng cv2.dnn
+_PRIOR_LAYERS = {'PriorBox'}
+
+
+def parse_prototxt(text):
+    """
+    Đọc prototxt (protobuf text format) thành list (key, value) lồng nhau
+
+    Returns:
+        list: [(key, str hoặc list con), ...] theo đúng thứ tự trong file
+    """
+    tokens = re.findall(r'"(?:[^"\\]|\\.)*"|[{}]|[^\s{}:]+:?', re.sub(r'#[^\n]*', '', text))
+    pos = 0
+
+    def block():
+        nonlocal pos
+        items = []
+        while pos < len(tokens) and tokens[pos] != '}':
+            key = tokens[pos].rstrip(':')
+            pos += 1
+            if tokens[pos] == '{':
+                pos += 1
+                value = block()
+                pos += 1
+            else:
+                value = tokens[pos].strip('"')
+                pos += 1
+            items.append((key, value))
+        return items
+
+    return block()
+
+
+def _get(items, key, default=None):
+    for name, value in items:
+        if name == key:
+            return value
+    return default
+
+
+def _get_all(items, key):
+    return [value for name, value in items if name == key]
+
+
+def _fold_batchnorm(weights, bias, bn_blobs, scale_blobs):
+    """Gộp BatchNorm (+ Scale) vào trọng số Convolution"""
+    channels = weights.shape[0]
+    if bias is None:
+        bias = np.zeros(channels, dtype=np.float32)
+    if bn_blobs is not None:
+        factor = float(bn_blobs[2].ravel()[0]) if len(bn_blobs) > 2 else 1.0
+        factor = 1.0 / factor if factor != 0 else 0.0
+        mean = bn_blobs[0].ravel() * factor
+        var = bn_blobs[1].ravel() * factor
+        std = np.sqrt(var + 1e-5)
+        weights = weights / std[:, None, None, None]
+        bias = (bias - mean) / std
+    if scale_blobs is not None:
+        gamma = scale_blobs[0].ravel()
+        beta = scale_blobs[1].ravel() if len(scale_blobs) > 1 else 0.0
+        weights = weights * gamma[:, None, None, None]
+        bias = bias * gamma + beta
+    return weights.astype(np.float32), bias.astype(np.float32)
+
+
+def export_ssd(prototxt="MobileNetSSD_deploy.prototxt", caffemodel="MobileNetSSD_deploy.caffemodel",
+               output=None, opset=13):
+    """
+    Chuyển MobileNet SSD Caffe sang ONNX
+
+    Output của graph: 'mbox_loc' (N, P*4), 'mbox_conf_flatten' (N, P*C) đã softmax
+    và 'mbox_priorbox' (1, 2, P*4) giống các blob cùng tên của Caffe.
+
+    Returns:
+        str: Đường dẫn file ONNX
+    """
+    import onnx
+    from onnx import TensorProto, helper, numpy_helper
+
+    output = output or os.path.splitext(caffemodel)[0] + '.onnx'
+    with open(prototxt) as f:
+        net_def = parse_prototxt(f.read())
+    net = cv2.dnn.readNetFromCaffe(prototxt, caffemodel)
+
+    # Prior box chỉ phụ thuộc kích thước input nên tính sẵn một lần
+    input_shape = [int(d) for d in _get_all(_get(net_def, 'input_shape', []), 'dim')] or [1, 3, 300, 300]
+    net.setInput(np.zeros(input_shape, dtype=np.float32))
+    layers = _get_all(net_def, 'layer')
+    prior_blob = None
+    for layer in layers:
+        if _get(layer, 'type') == 'DetectionOutput':
+            prior_blob = _get_all(layer, 'bottom')[2]
+    priors = net.forward(prior_blob) if prior_blob else None
+
+    def blobs(name):
+        return [np.asarray(b, dtype=np.float32) for b in net.getLayer(name).blobs]
+
+    input_name = _get(net_def, 'input', 'data')
+    nodes, initializers = [], []
+    prior_tops = set()
+    consumed = set()
+    # Layer in-place của Caffe (top == bottom) phải đổi tên output để graph ONNX là SSA
+    tensors = {input_name: input_name}
+
+    def add_init(name, array):
+        initializers.append(numpy_helper.from_array(np.ascontiguousarray(array, dtype=np.float32), name))
+        return name
+
+    for index, layer in enumerate(layers):
+        name, layer_type = _get(layer, 'name'), _get(layer, 'type')
+        bottoms, tops = _get_all(layer, 'bottom'), _get_all(layer, 'top')
+        if name in consumed:
+            continue
+
+        # Layer chỉ dẫn tới prior box: bỏ qua, thay bằng hằng số
+        if layer_type in _PRIOR_LAYERS or (bottoms and all(b in prior_tops for b in bottoms)):
+            prior_tops.update(tops)
+            continue
+        if layer_type == 'DetectionOutput':
+            continue
+        inputs = [tensors[b] for b in bottoms]
+        outputs = []
+        for top in tops:
+            tensors[top] = top if top not in tensors.values() else f'{top}/{name}'
+            outputs.append(tensors[top])
+
+        if layer_type == 'Convolution':
+            param = _get(layer, 'convolution_param', [])
+            conv_blobs = blobs(name)
+            weights = conv_blobs[0]
+            bias = conv_blobs[1].ravel() if len(conv_blobs) > 1 else None
+            # BatchNorm/Scale in-place ngay sau conv được gộp vào trọng số
+            bn_blobs = scale_blobs = None
+            for follower in layers[index + 1:index + 3]:
+                if _get_all(follower, 'bottom') != tops or _get_all(follower, 'top') != tops:
+                    break
+                if _get(follower, 'type') == 'BatchNorm' and bn_blobs is None:
+                    bn_blobs = blobs(_get(follower, 'name'))
+                elif _get(follower, 'type') == 'Scale' and scale_blobs is None:
+                    scale_blobs = blobs(_get(follower, 'name'))
+                else:
+                    break
+                consumed.add(_get(follower, 'name'))
+            weights, bias = _fold_batchnorm(weights, bias, bn_blobs, scale_blobs)
+
+            kernel = int(_get(param, 'kernel_size', 1))
+            pad = int(_get(param, 'pad', 0))
+            stride = int(_get(param, 'stride', 1))
+            group = int(_get(param, 'group', 1))
+            nodes.append(helper.make_node(
+                'Conv', [inputs[0], add_init(f'{name}_W', weights), add_init(f'{name}_B', bias)],
+                outputs, name=name, kernel_shape=[kernel, kernel], pads=[pad] * 4,
+                strides=[stride, stride], group=group))
+        elif layer_type == 'BatchNorm':
+            bn_blobs = blobs(name)
+            channels = bn_blobs[0].size
+            identity = np.ones((channels, 1, 1, 1), dtype=np.float32)
+            scale, shift = _fold_batchnorm(identity, None, bn_blobs, None)
+            nodes.append(helper.make_node('Mul', [inputs[0], add_init(f'{name}_s', scale.reshape(1, -1, 1, 1))],
+                                          [f'{name}_mul'], name=f'{name}_mul'))
+            nodes.append(helper.make_node('Add', [f'{name}_mul', add_init(f'{name}_b', shift.reshape(1, -1, 1, 1))],
+                                          outputs, name=name))
+        elif layer_type == 'Scale':
+            scale_blobs = blobs(name)
+            gamma = scale_blobs[0].reshape(1, -1, 1, 1)
+            beta = scale_blobs[1].reshape(1, -1, 1, 1) if len(scale_blobs) > 1 else np.zeros_like(gamma)
+            nodes.append(helper.make_node('Mul', [inputs[0], add_init(f'{name}_s', gamma)],
+                                          [f'{name}_mul'], name=f'{name}_mul'))
+            nodes.append(helper.make_node('Add', [f'{name}_mul', add_init(f'{name}_b', beta)],
+                                          outputs, name=name))
+        elif layer_type == 'ReLU':
+            nodes.append(helper.make_node('Relu', inputs, outputs, name=name))
+        elif layer_type == 'Permute':
+            order = [int(o) for o in _get_all(_get(layer, 'permute_param', []), 'order')]
+            nodes.append(helper.make_node('Transpose', inputs, outputs, name=name, perm=order))
+        elif layer_type == 'Flatten':
+            axis = int(_get(_get(layer, 'flatten_param', []), 'axis', 1))
+            nodes.append(helper.make_node('Flatten', inputs, outputs, name=name, axis=axis))
+        elif layer_type == 'Concat':
+            axis = int(_get(_get(layer, 'concat_param', []), 'axis', 1))
+            nodes.append(helper.make_node('Concat', inputs, outputs, name=name, axis=axis))
+        elif layer_type == 'Reshape':
+            dims = [int(d) for d in _get_all(_get(_get(layer, 'reshape_param', []), 'shape', []), 'dim')]
+            shape_name = f'{name}_shape'
+            initializers.append(numpy_helper.from_array(np.array(dims, dtype=np.int64), shape_name))
+            nodes.append(helper.make_node('Reshape', [inputs[0], shape_name], outputs, name=name))
+        elif layer_type == 'Softmax':
+            axis = int(_get(_get(layer, 'softmax_param', []), 'axis', 1))
+            nodes.append(helper.make_node('Softmax', inputs, outputs, name=name, axis=axis))
+        else:
+            raise ValueError(f"Layer {name}: chưa hỗ trợ chuyển loại {layer_type} sang ONNX")
+
+    detection = next(layer for layer in layers if _get(layer, 'type') == 'DetectionOutput')
+    loc_name, conf_name = _get_all(detection, 'bottom')[:2]
+    for blob in (loc_name, conf_name):
+        if tensors[blob] != blob:
+            nodes.append(helper.make_node('Identity', [tensors[blob]], [blob], name=f'{blob}_output'))
+    nodes.append(helper.make_node('Identity', [add_init('mbox_priorbox_const', priors)],
+                                  ['mbox_priorbox'], name='mbox_priorbox'))
+
+    graph = helper.make_graph(
+        nodes, 'MobileNetSSD',
+        [helper.make_tensor_value_info(input_name, TensorProto.FLOAT, ['batch'] + input_shape[1:])],
+        [helper.make_tensor_value_info(loc_name, TensorProto.FLOAT, ['batch', None]),
+         helper.make_tensor_value_info(conf_name, TensorProto.FLOAT, ['batch', None]),
+         helper.make_tensor_value_info('mbox_priorbox', TensorProto.FLOAT, list(priors.shape))],
+        initializers,
+    )
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid('', opset)],
+                              producer_name='esp32_onnx_export')
+    # IR version theo opset (không theo bản onnx đang cài) để ONNX Runtime cũ vẫn đọc được
+    model.ir_version = 8
+    # Thông số DetectionOutput để OnnxSSDEngine giải mã giống Caffe
+    detection_param = _get(detection, 'detection_output_param', [])
+    nms_param = _get(detection_param, 'nms_param', [])
+    metadata = {
+        'num_classes': _get(detection_param, 'num_classes', '21'),
+        'background_label_id': _get(detection_param, 'background_label_id', '0'),
+        'nms_threshold': _get(nms_param, 'nms_threshold', '0.45'),
+        'top_k': _get(nms_param, 'top_k', '100'),
+        'keep_top_k': _get(detection_param, 'keep_top_k', '100'),
+        'confidence_threshold': _get(detection_param, 'confidence_threshold', '0.01'),
+    }
+    onnx.helper.set_model_props(model, metadata)
+    onnx.checker.check_model(model)
+    onnx.save(model, output)
+    return output
+
+
+def export_yolo(weights="yolov8n.pt", imgsz=640, opset=12):
+    """
+    Xuất YOLOv8 sang ONNX bằng exporter của ultralytics (tên class lưu trong metadata)
+
+    Returns:
+        str: Đường dẫn file ONNX
+    """
+    from ultralytics import YOLO
+
+    return YOLO(weights).export(format='onnx', imgsz=imgsz, opset=opset, dynamic=False, simplify=False)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('model', choices=['ssd', 'yolo'])
+    parser.add_argument('--prototxt', default="MobileNetSSD_deploy.prototxt")
+    parser.add_argument('--caffemodel', default="MobileNetSSD_deploy.caffemodel")
+    parser.add_argument('--weights', default="yolov8n.pt")
+    parser.add_argument('--imgsz', type=int, default=640)
+    parser.add_argument('--output', default=None)
+    args = parser.parse_args()
+
+    if args.model == 'ssd':
+        path = export_ssd(args.prototxt, args.caffemodel, args.output)
+    else:
+        path = export_yolo(args.weights, args.imgsz)
+    print(f"✓ Đã xuất ONNX: {path}")
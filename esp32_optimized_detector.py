@@ -11,6 +11,12 @@ import cv2
 import numpy as np
 import urllib.request
 
+from esp32_display import create_display
+from esp32_dnn_config import load_tuned_net
+from esp32_frame_source import decode_jpeg
+from esp32_inference import SSDPreprocessor
+from esp32_postprocess import postprocess_ssd
+
 # Cấu hình ESP32-CAM
 ESP32_CAM_IP = "192.168.1.14"  # Thay đổi IP của bạn
 # Các endpoint có thể thử
@@ -23,6 +29,9 @@ model = "MobileNetSSD_deploy.caffemodel"
 # Thư mục MobileNet-SSD đã tải về
 MOBILENET_SSD_DIR = "MobileNet-SSD-master"
 
+# Không vẽ, không mở cửa sổ (thoát bằng Ctrl+C)
+HEADLESS = "--headless" in sys.argv
+
 def copy_from_local_directory():
     """Copy file từ thư mục MobileNet-SSD-master nếu có"""
     copied = False
@@ -150,7 +159,8 @@ if not os.path.exists(prototxt) or not os.path.exists(model):
             exit(1)
 
 print("[INFO] Đang tải model...")
-net = cv2.dnn.readNetFromCaffe(prototxt, model)
+net = load_tuned_net(prototxt, model)
+preprocess = SSDPreprocessor()
 print("[OK] Model đã sẵn sàng!")
 
 # Các class mà MobileNet-SSD có thể nhận diện
@@ -181,8 +191,7 @@ def get_frame():
         
         try:
             img_resp = urllib.request.urlopen(url, timeout=3)
-            img_np = np.array(bytearray(img_resp.read()), dtype=np.uint8)
-            frame = cv2.imdecode(img_np, -1)
+            frame = decode_jpeg(img_resp.read(), max_width=None)
             
             if frame is not None and frame.size > 0:
                 # Nếu thành công với endpoint này, dùng tiếp
@@ -195,88 +204,21 @@ def get_frame():
     # Nếu tất cả đều fail, in thông báo
     return None
 
-# FPS counter
-fps_start_time = cv2.getTickCount()
-fps = 0
-frame_count = 0
-
-while True:
-    # Lấy frame từ ESP32-CAM
-    frame = get_frame()
-    
-    if frame is None:
-        # In thông báo lỗi chi tiết lần đầu
-        if not hasattr(get_frame, 'error_shown'):
-            print(f"[WARNING] Không thể kết nối ESP32-CAM tại {ESP32_CAM_IP}")
-            print(f"[INFO] Đã thử các endpoint: {', '.join(ESP32_CAM_ENDPOINTS)}")
-            print(f"[INFO] Vui lòng kiểm tra:")
-            print(f"  1. IP ESP32-CAM có đúng không?")
-            print(f"  2. ESP32-CAM có đang chạy không?")
-            print(f"  3. Cùng mạng WiFi không?")
-            get_frame.error_shown = True
-        continue
-    
-    # Lấy kích thước frame
-    (h, w) = frame.shape[:2]
-    
-    # Tạo blob từ frame
-    blob = cv2.dnn.blobFromImage(cv2.resize(frame, (300, 300)),
-                                 0.007843, (300, 300), 127.5)
-    
-    # Đưa blob vào network
-    net.setInput(blob)
-    detections = net.forward()
-    
-    # Đếm số lượng object được phát hiện
-    detected_objects = {}
-    
-    # Duyệt qua các detection
-    for i in range(detections.shape[2]):
-        # Lấy confidence
-        confidence = detections[0, 0, i, 2]
+def render_frame(frame, snapshot):
+    """Vẽ bounding box, FPS và số lượng object (chạy trên thread hiển thị)"""
+    results, detected_objects, fps = snapshot
+    for idx, confidence, startX, startY, endX, endY in results:
+        # Vẽ bounding box và label
+        label_text = f"{CLASSES[idx]}: {confidence*100:.2f}%"
+        cv2.rectangle(frame, (startX, startY), (endX, endY),
+                     COLORS[idx], 2)
         
-        # Lọc các detection yếu
-        if confidence > confidence_threshold:
-            # Lấy class index
-            idx = int(detections[0, 0, i, 1])
-            
-            # Tính toán tọa độ bounding box
-            box = detections[0, 0, i, 3:7] * np.array([w, h, w, h])
-            (startX, startY, endX, endY) = box.astype("int")
-            
-            # Đảm bảo bounding box nằm trong frame
-            startX = max(0, startX)
-            startY = max(0, startY)
-            endX = min(w, endX)
-            endY = min(h, endY)
-            
-            # Đếm số lượng mỗi loại object
-            label = CLASSES[idx]
-            if label in detected_objects:
-                detected_objects[label] += 1
-            else:
-                detected_objects[label] = 1
-            
-            # Vẽ bounding box và label
-            label_text = f"{label}: {confidence*100:.2f}%"
-            cv2.rectangle(frame, (startX, startY), (endX, endY),
-                         COLORS[idx], 2)
-            
-            # Vẽ background cho text
-            y = startY - 15 if startY - 15 > 15 else startY + 15
-            cv2.rectangle(frame, (startX, y-15), (startX + len(label_text)*9, y+5),
-                         COLORS[idx], -1)
-            cv2.putText(frame, label_text, (startX, y),
-                       cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 2)
-    
-    # Tính FPS
-    frame_count += 1
-    if frame_count >= 10:
-        fps_end_time = cv2.getTickCount()
-        time_diff = (fps_end_time - fps_start_time) / cv2.getTickFrequency()
-        fps = frame_count / time_diff
-        frame_count = 0
-        fps_start_time = cv2.getTickCount()
+        # Vẽ background cho text
+        y = startY - 15 if startY - 15 > 15 else startY + 15
+        cv2.rectangle(frame, (startX, y-15), (startX + len(label_text)*9, y+5),
+                     COLORS[idx], -1)
+        cv2.putText(frame, label_text, (startX, y),
+                   cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 2)
     
     # Hiển thị FPS
     cv2.putText(frame, f"FPS: {fps:.2f}", (10, 30),
@@ -289,18 +231,75 @@ while True:
         cv2.putText(frame, text, (10, y_offset),
                    cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
         y_offset += 30
-    
-    # Hiển thị frame
-    cv2.imshow("ESP32-CAM Object Detection", frame)
-    
-    # Nhấn 'q' để thoát
-    key = cv2.waitKey(1) & 0xFF
-    if key == ord("q"):
-        break
-    elif key == ord("s"):
-        # Nhấn 's' để chụp ảnh
-        cv2.imwrite("captured_frame.jpg", frame)
-        print("[INFO] Đã lưu ảnh!")
+    return frame
+
+# Vẽ và hiển thị trên thread riêng (hoặc không vẽ gì khi headless)
+display = create_display("ESP32-CAM Object Detection", render_frame, headless=HEADLESS)
+print("[INFO] Nhấn 'q' để thoát, 's' để chụp ảnh" if not HEADLESS else "[INFO] Nhấn Ctrl+C để thoát")
+
+# FPS counter
+fps_start_time = cv2.getTickCount()
+fps = 0
+frame_count = 0
+
+try:
+    while True:
+        # Lấy frame từ ESP32-CAM
+        frame = get_frame()
+        
+        if frame is None:
+            # In thông báo lỗi chi tiết lần đầu
+            if not hasattr(get_frame, 'error_shown'):
+                print(f"[WARNING] Không thể kết nối ESP32-CAM tại {ESP32_CAM_IP}")
+                print(f"[INFO] Đã thử các endpoint: {', '.join(ESP32_CAM_ENDPOINTS)}")
+                print(f"[INFO] Vui lòng kiểm tra:")
+                print(f"  1. IP ESP32-CAM có đúng không?")
+                print(f"  2. ESP32-CAM có đang chạy không?")
+                print(f"  3. Cùng mạng WiFi không?")
+                get_frame.error_shown = True
+            continue
+        
+        # Lấy kích thước frame
+        (h, w) = frame.shape[:2]
+        
+        # Tạo blob từ frame (buffer resize/blob dùng lại giữa các frame) và đưa vào network
+        net.setInput(preprocess(frame))
+        detections = net.forward()
+        
+        # Lọc các detection yếu và tính bounding box (vector hóa, đã giới hạn trong frame)
+        results = postprocess_ssd(detections, w, h, confidence_threshold, num_classes=len(CLASSES)).tolist()
+        
+        # Đếm số lượng mỗi loại object được phát hiện
+        detected_objects = {}
+        for idx, *_ in results:
+            label = CLASSES[idx]
+            detected_objects[label] = detected_objects.get(label, 0) + 1
+        
+        # Tính FPS
+        frame_count += 1
+        if frame_count >= 10:
+            fps_end_time = cv2.getTickCount()
+            time_diff = (fps_end_time - fps_start_time) / cv2.getTickFrequency()
+            fps = frame_count / time_diff
+            frame_count = 0
+            fps_start_time = cv2.getTickCount()
+        
+        # Hiển thị frame (vẽ trên thread hiển thị)
+        display.show(frame, (results, detected_objects, fps))
+        if HEADLESS and detected_objects:
+            print(f"[INFO] {detected_objects}")
+        
+        # Nhấn 'q' để thoát
+        key = display.poll_key()
+        if key == ord("q"):
+            break
+        elif key == ord("s") and display.last_image is not None:
+            # Nhấn 's' để chụp ảnh
+            cv2.imwrite("captured_frame.jpg", display.last_image)
+            print("[INFO] Đã lưu ảnh!")
+except KeyboardInterrupt:
+    # Cách thoát duy nhất khi headless
+    pass
 
 print("[INFO] Dọn dẹp...")
-cv2.destroyAllWindows()
\ No newline at end of file
+display.close()
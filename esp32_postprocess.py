@@ -0,0 +1,168 @@
+import numpy as np
+
+# Một detection sau hậu xử lý: class, confidence và bbox (pixel, dạng x1, y1, x2, y2)
+DETECTION_DTYPE = np.dtype([
+    ('class_id', np.int32),
+    ('confidence', np.float32),
+    ('x1', np.int32),
+    ('y1', np.int32),
+    ('x2', np.int32),
+    ('y2', np.int32),
+])
+
+
+def postprocess_ssd(detections, width, height, threshold=0.5, num_classes=None, clip=True):
+    """
+    Hậu xử lý output của MobileNet SSD bằng các phép toán NumPy trên cả mảng
+
+    Args:
+        detections: Output của net.forward(), shape (1, 1, N, 7)
+            với mỗi hàng [image_id, class_id, confidence, x1, y1, x2, y2] (chuẩn hóa 0..1)
+        width: Chiều rộng frame
+        height: Chiều cao frame
+        threshold: Chỉ giữ detections có confidence > threshold
+        num_classes: Bỏ các class_id >= num_classes (None để giữ tất cả)
+        clip (bool): Giới hạn bbox trong frame
+
+    Returns:
+        numpy.ndarray: Mảng có cấu trúc DETECTION_DTYPE
+    """
+    rows = detections.reshape(-1, 7)
+    mask = rows[:, 2] > threshold
+    if num_classes is not None:
+        mask &= rows[:, 1] < num_classes
+    rows = rows[mask]
+
+    boxes = rows[:, 3:7] * np.array([width, height, width, height], dtype=np.float32)
+    if clip:
+        np.clip(boxes, 0, [width, height, width, height], out=boxes)
+    boxes = boxes.astype(np.int32)
+
+    result = np.empty(len(rows), dtype=DETECTION_DTYPE)
+    result['class_id'] = rows[:, 1]
+    result['confidence'] = rows[:, 2]
+    result['x1'] = boxes[:, 0]
+    result['y1'] = boxes[:, 1]
+    result['x2'] = boxes[:, 2]
+    result['y2'] = boxes[:, 3]
+    return result
+
+
+def to_detection_dicts(detections, classes, bbox_format='xyxy'):
+    """
+    Chuyển mảng detections thành list dict như các detector đang dùng
+
+    Args:
+        detections: Mảng DETECTION_DTYPE
+        classes: Danh sách tên class (index = class_id)
+        bbox_format (str): 'xyxy' -> (x1, y1, x2, y2), 'xywh' -> (x, y, w, h)
+
+    Returns:
+        list: [{'class', 'confidence', 'bbox'}, ...]
+    """
+    result = []
+    for class_id, confidence, x1, y1, x2, y2 in detections.tolist():
+        if bbox_format == 'xywh':
+            bbox = (x1, y1, x2 - x1, y2 - y1)
+        else:
+            bbox = (x1, y1, x2, y2)
+        result.append({
+            'class': classes[class_id],
+            'confidence': confidence,
+            'bbox': bbox,
+        })
+    return result
+
+
+# Số box tối đa để dùng ma trận IoU N x N trong nms()
+_NMS_MATRIX_LIMIT = 150
+
+
+def box_iou(box, boxes):
+    """
+    IoU giữa một box và nhiều box (dạng x1, y1, x2, y2)
+
+    Hai box chỉ chạm cạnh có IoU = 0; box có union = 0 được coi là không trùng.
+
+    Args:
+        box: Mảng shape (4,)
+        boxes: Mảng shape (N, 4)
+
+    Returns:
+        numpy.ndarray: IoU shape (N,)
+    """
+    inter_w = np.minimum(box[2], boxes[:, 2]) - np.maximum(box[0], boxes[:, 0])
+    inter_h = np.minimum(box[3], boxes[:, 3]) - np.maximum(box[1], boxes[:, 1])
+    intersection = np.clip(inter_w, 0, None) * np.clip(inter_h, 0, None)
+    area = (box[2] - box[0]) * (box[3] - box[1])
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    union = area + areas - intersection
+    iou = np.zeros(len(boxes), dtype=np.float64)
+    np.divide(intersection, union, out=iou, where=union > 0)
+    return iou
+
+
+def nms(boxes, scores=None, iou_threshold=0.3, class_ids=None, box_format='xywh'):
+    """
+    Non-maximum suppression vector hóa
+
+    Duyệt box theo score giảm dần (hoặc theo thứ tự đầu vào nếu không có
+    score); mỗi box được giữ sẽ loại các box còn lại có IoU > iou_threshold.
+
+    Args:
+        boxes: Mảng/list shape (N, 4)
+        scores: Score của từng box (None để giữ thứ tự đầu vào)
+        iou_threshold: Ngưỡng IoU để coi là trùng
+        class_ids: Nếu có, chỉ loại trùng giữa các box cùng class
+        box_format (str): 'xywh' (như detectMultiScale) hoặc 'xyxy'
+
+    Returns:
+        numpy.ndarray: Index các box được giữ (theo thứ tự ưu tiên)
+    """
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    if len(boxes) == 0:
+        return np.empty(0, dtype=np.intp)
+
+    if box_format == 'xywh':
+        boxes = np.concatenate([boxes[:, :2], boxes[:, :2] + boxes[:, 2:]], axis=1)
+    else:
+        boxes = boxes.copy()
+
+    if class_ids is not None:
+        # Dịch box của mỗi class sang vùng riêng để các class không bao giờ chồng nhau
+        offset = np.asarray(class_ids, dtype=np.float64) * (boxes.max() - boxes.min() + 1)
+        boxes += offset[:, None]
+
+    if scores is None:
+        order = np.arange(len(boxes))
+    else:
+        order = np.argsort(-np.asarray(scores, dtype=np.float64), kind='stable')
+
+    if len(boxes) > _NMS_MATRIX_LIMIT:
+        # Nhiều box: tránh ma trận N x N, tính IoU từng hàng với các box còn lại
+        keep = []
+        while len(order) > 0:
+            current = order[0]
+            keep.append(current)
+            rest = order[1:]
+            order = rest[box_iou(boxes[current], boxes[rest]) <= iou_threshold]
+        return np.array(keep, dtype=np.intp)
+
+    # Tính ma trận "trùng" một lần rồi duyệt tham lam theo thứ tự ưu tiên
+    boxes = boxes[order]
+    inter_w = np.minimum(boxes[:, None, 2], boxes[None, :, 2]) - np.maximum(boxes[:, None, 0], boxes[None, :, 0])
+    inter_h = np.minimum(boxes[:, None, 3], boxes[None, :, 3]) - np.maximum(boxes[:, None, 1], boxes[None, :, 1])
+    intersection = np.clip(inter_w, 0, None) * np.clip(inter_h, 0, None)
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    union = areas[:, None] + areas[None, :] - intersection
+    overlaps = intersection > iou_threshold * union
+    overlaps &= union > 0
+
+    suppressed = np.zeros(len(boxes), dtype=bool)
+    keep = []
+    for i in range(len(boxes)):
+        if suppressed[i]:
+            continue
+        keep.append(i)
+        suppressed |= overlaps[i]
+    return order[keep]
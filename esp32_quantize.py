@@ -0,0 +1,297 @@
+"""
+Lượng tử hóa INT8 (post-training) cho MobileNet SSD + báo cáo độ chính xác/tốc độ so với FP32
+
+1. Caffe -> ONNX FP32 (esp32_onnx_export.export_ssd) nếu đầu vào là .caffemodel
+2. Calibrate trên thư mục frame ESP32 đã chụp, lượng tử hóa tĩnh trọng số và
+   activation của các Convolution (QDQ, INT8 theo từng kênh) bằng ONNX Runtime
+3. Đo trên tập mẫu: mAP@0.5, recall từng class (ngưỡng 0.5) và thời gian/frame
+   của FP32 và INT8; báo cáo in ra và ghi vào <model int8>.report.json
+
+Nhãn (--labels) là file JSON {tên ảnh: [{"class": "person", "bbox": [x1, y1, x2, y2]}, ...]}.
+Không có nhãn thì detection của FP32 (confidence > 0.5) được dùng làm nhãn, tức
+báo cáo đo độ lệch của INT8 so với FP32.
+
+Detector chọn model INT8 bằng cờ use_int8 (ví dụ: python esp32_smart_object_detector.py --int8).
+Cần: pip install onnx onnxruntime
+
+Chạy từ thư mục gốc của repo:
+    python esp32_quantize.py --calib-dir captures/ --eval-dir samples/ --labels samples/labels.json
+"""
+import argparse
+import glob
+import json
+import os
+import time
+
+import cv2
+import numpy as np
+from onnxruntime.quantization import (CalibrationDataReader, CalibrationMethod, QuantFormat, QuantType,
+                                      quantize_static)
+
+from esp32_engines import INT8_SSD_MODEL, VOC_CLASSES, OnnxSSDEngine
+from esp32_inference import SSDPreprocessor
+from esp32_postprocess import box_iou
+
+DEFAULT_FP32_MODEL = "MobileNetSSD_deploy.onnx"
+
+_IMAGE_PATTERNS = ('*.jpg', '*.jpeg', '*.png')
+
+
+def list_images(directory):
+    """Các file ảnh trong thư mục (sắp theo tên)"""
+    paths = []
+    for pattern in _IMAGE_PATTERNS:
+        paths.extend(glob.glob(os.path.join(directory, pattern)))
+    return sorted(paths)
+
+
+class FrameCalibrationReader(CalibrationDataReader):
+    """Đưa lần lượt blob của các frame calibration cho ONNX Runtime"""
+
+    def __init__(self, paths, input_name, limit=None):
+        self.paths = paths[:limit] if limit else paths
+        self.input_name = input_name
+        self.preprocess = SSDPreprocessor()
+        self._iter = iter(self.paths)
+
+    def get_next(self):
+        for path in self._iter:
+            frame = cv2.imread(path)
+            if frame is not None:
+                # Blob của SSDPreprocessor bị ghi đè ở lần gọi sau nên phải sao chép
+                return {self.input_name: self.preprocess(frame).copy()}
+        return None
+
+    def rewind(self):
+        self._iter = iter(self.paths)
+
+
+def quantize_ssd(fp32_model, int8_model, calib_paths, method='minmax', limit=None):
+    """
+    Lượng tử hóa tĩnh model SSD ONNX sang INT8
+
+    Chỉ Convolution được lượng tử hóa (gần như toàn bộ thời gian chạy); softmax
+    và các output loc/conf giữ float để điểm số và box không mất độ phân giải.
+
+    Args:
+        fp32_model: Model ONNX FP32 (esp32_onnx_export.export_ssd)
+        int8_model: File model INT8 cần ghi
+        calib_paths: Ảnh dùng để calibrate
+        method (str): 'minmax', 'entropy' hoặc 'percentile'
+        limit: Số ảnh calibration tối đa
+
+    Returns:
+        str: Đường dẫn model INT8
+    """
+    import onnx
+
+    model = onnx.load(fp32_model)
+    reader = FrameCalibrationReader(calib_paths, model.graph.input[0].name, limit)
+    methods = {
+        'minmax': CalibrationMethod.MinMax,
+        'entropy': CalibrationMethod.Entropy,
+        'percentile': CalibrationMethod.Percentile,
+    }
+    quantize_static(fp32_model, int8_model, reader, quant_format=QuantFormat.QDQ,
+                    op_types_to_quantize=['Conv'], per_channel=True,
+                    activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8,
+                    calibrate_method=methods[method])
+
+    # Giữ tham số DetectionOutput (metadata) cho OnnxSSDEngine
+    quantized = onnx.load(int8_model)
+    onnx.helper.set_model_props(quantized, {prop.key: prop.value for prop in model.metadata_props})
+    onnx.save(quantized, int8_model)
+    return int8_model
+
+
+def load_labels(path, class_names):
+    """
+    Đọc nhãn JSON thành {tên ảnh: (class_ids, boxes)}
+    """
+    with open(path) as f:
+        data = json.load(f)
+    labels = {}
+    for name, objects in data.items():
+        class_ids = np.array([class_names.index(obj['class']) for obj in objects], dtype=np.int32)
+        boxes = np.array([obj['bbox'] for obj in objects], dtype=np.float64).reshape(-1, 4)
+        labels[os.path.basename(name)] = (class_ids, boxes)
+    return labels
+
+
+def _boxes(detections):
+    return np.stack([detections[name] for name in ('x1', 'y1', 'x2', 'y2')], axis=1).astype(np.float64)
+
+
+def _match(detections, gt_ids, gt_boxes, iou_threshold=0.5):
+    """Đánh dấu detection đúng (TP) theo thứ tự confidence giảm dần, mỗi nhãn chỉ khớp một lần"""
+    order = np.argsort(-detections['confidence'], kind='stable')
+    detections = detections[order]
+    boxes = _boxes(detections)
+    used = np.zeros(len(gt_ids), dtype=bool)
+    tp = np.zeros(len(detections), dtype=bool)
+    for i, det in enumerate(detections):
+        candidates = np.flatnonzero((gt_ids == det['class_id']) & ~used)
+        if len(candidates):
+            ious = box_iou(boxes[i], gt_boxes[candidates])
+            best = ious.argmax()
+            if ious[best] >= iou_threshold:
+                used[candidates[best]] = True
+                tp[i] = True
+    return detections, tp
+
+
+def average_precision(tp, confidences, num_gt):
+    """AP theo cách VOC (nội suy mọi điểm của đường precision/recall)"""
+    if num_gt == 0:
+        return None
+    order = np.argsort(-confidences, kind='stable')
+    tp = tp[order].astype(np.float64)
+    tp_cum = np.cumsum(tp)
+    recall = tp_cum / num_gt
+    precision = tp_cum / np.arange(1, len(tp) + 1)
+    recall = np.concatenate([[0.0], recall, [1.0]])
+    precision = np.concatenate([[0.0], precision, [0.0]])
+    precision = np.maximum.accumulate(precision[::-1])[::-1]
+    steps = np.flatnonzero(recall[1:] != recall[:-1])
+    return float(np.sum((recall[steps + 1] - recall[steps]) * precision[steps + 1]))
+
+
+def evaluate(predictions, labels, class_names, recall_threshold=0.5):
+    """
+    mAP@0.5 và recall từng class
+
+    Args:
+        predictions: {tên ảnh: mảng DETECTION_DTYPE (ngưỡng thấp)}
+        labels: {tên ảnh: (class_ids, boxes)}
+        recall_threshold: Ngưỡng confidence khi tính recall (như detector)
+
+    Returns:
+        dict: {'map', 'classes': {tên class: {'ap', 'recall', 'gt'}}}
+    """
+    per_class = {class_id: {'tp': [], 'conf': [], 'gt': 0} for class_id in range(1, len(class_names))}
+    for name, (gt_ids, gt_boxes) in labels.items():
+        detections, tp = _match(predictions[name], gt_ids, gt_boxes)
+        for class_id, stats in per_class.items():
+            own = detections['class_id'] == class_id
+            stats['tp'].append(tp[own])
+            stats['conf'].append(detections['confidence'][own])
+            stats['gt'] += int(np.sum(gt_ids == class_id))
+
+    classes = {}
+    for class_id, stats in per_class.items():
+        if stats['gt'] == 0:
+            continue
+        tp = np.concatenate(stats['tp'])
+        conf = np.concatenate(stats['conf'])
+        classes[class_names[class_id]] = {
+            'ap': average_precision(tp, conf, stats['gt']),
+            'recall': float(np.sum(tp[conf > recall_threshold])) / stats['gt'],
+            'gt': stats['gt'],
+        }
+    aps = [c['ap'] for c in classes.values()]
+    return {'map': float(np.mean(aps)) if aps else 0.0, 'classes': classes}
+
+
+def run_model(engine, frames, repeat=3):
+    """Detection của từng frame và thời gian trung bình (ms/frame)"""
+    predictions = {name: engine.infer(frame) for name, frame in frames.items()}
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for frame in frames.values():
+            engine.infer(frame)
+    return predictions, (time.perf_counter() - start) / (repeat * len(frames)) * 1000
+
+
+def compare(fp32_model, int8_model, eval_paths, labels_path=None, class_names=VOC_CLASSES, repeat=3):
+    """
+    Báo cáo INT8 so với FP32: mAP, recall từng class và thời gian
+
+    Returns:
+        dict: Báo cáo (cũng là nội dung file .report.json)
+    """
+    frames = {os.path.basename(path): cv2.imread(path) for path in eval_paths}
+    frames = {name: frame for name, frame in frames.items() if frame is not None}
+    if not frames:
+        raise ValueError("Không có ảnh để đánh giá")
+
+    # Ngưỡng thấp để tính được đường precision/recall cho mAP
+    engines = {'fp32': OnnxSSDEngine(fp32_model, class_names, threshold=0.01),
+               'int8': OnnxSSDEngine(int8_model, class_names, threshold=0.01)}
+    results = {kind: run_model(engine, frames, repeat) for kind, engine in engines.items()}
+
+    if labels_path:
+        labels = {name: gt for name, gt in load_labels(labels_path, class_names).items() if name in frames}
+        reference = 'labels'
+    else:
+        labels = {}
+        for name, detections in results['fp32'][0].items():
+            confident = detections[detections['confidence'] > 0.5]
+            labels[name] = (confident['class_id'], _boxes(confident))
+        reference = 'fp32'
+
+    report = {'reference': reference, 'images': len(labels), 'models': {}}
+    for kind, (predictions, latency) in results.items():
+        metrics = evaluate({name: predictions[name] for name in labels}, labels, class_names)
+        report['models'][kind] = dict(metrics, latency_ms=latency,
+                                      path=fp32_model if kind == 'fp32' else int8_model,
+                                      size_kb=os.path.getsize(fp32_model if kind == 'fp32' else int8_model) / 1024)
+    fp32, int8 = report['models']['fp32'], report['models']['int8']
+    report['speedup'] = fp32['latency_ms'] / int8['latency_ms'] if int8['latency_ms'] else 0.0
+    report['map_drop'] = fp32['map'] - int8['map']
+    report['recall_drift'] = {name: int8['classes'][name]['recall'] - stats['recall']
+                              for name, stats in fp32['classes'].items()}
+    return report
+
+
+def print_report(report):
+    """In báo cáo so sánh FP32/INT8"""
+    fp32, int8 = report['models']['fp32'], report['models']['int8']
+    source = "nhãn" if report['reference'] == 'labels' else "detection FP32"
+    print(f"\n📊 INT8 vs FP32 trên {report['images']} ảnh (so với {source}):")
+    print(f"   - Latency: FP32 {fp32['latency_ms']:.1f} ms, INT8 {int8['latency_ms']:.1f} ms "
+          f"(x{report['speedup']:.2f})")
+    print(f"   - Model: FP32 {fp32['size_kb']:.0f} KB, INT8 {int8['size_kb']:.0f} KB")
+    print(f"   - mAP@0.5: FP32 {fp32['map']:.3f}, INT8 {int8['map']:.3f} (giảm {report['map_drop']:.3f})")
+    print("   - Recall từng class (confidence > 0.5):")
+    for name, stats in sorted(fp32['classes'].items()):
+        drift = report['recall_drift'][name]
+        flag = " ⚠️" if drift < -0.05 else ""
+        print(f"     {name:<12s} FP32 {stats['recall']:.2f}  INT8 {int8['classes'][name]['recall']:.2f}  "
+              f"({drift:+.2f}, {stats['gt']} nhãn){flag}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--model', default="MobileNetSSD_deploy.caffemodel",
+                        help='.caffemodel (xuất ONNX trước) hoặc .onnx FP32')
+    parser.add_argument('--prototxt', default="MobileNetSSD_deploy.prototxt")
+    parser.add_argument('--output', default=INT8_SSD_MODEL)
+    parser.add_argument('--calib-dir', default='.', help='Thư mục frame ESP32 để calibrate')
+    parser.add_argument('--calib-limit', type=int, default=200)
+    parser.add_argument('--method', choices=['minmax', 'entropy', 'percentile'], default='minmax')
+    parser.add_argument('--eval-dir', default=None, help='Thư mục ảnh đánh giá (mặc định calib-dir)')
+    parser.add_argument('--labels', default=None, help='File nhãn JSON của ảnh đánh giá')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    fp32_model = args.model
+    if fp32_model.endswith('.caffemodel'):
+        from esp32_onnx_export import export_ssd
+
+        fp32_model = export_ssd(args.prototxt, args.model, DEFAULT_FP32_MODEL)
+        print(f"✓ Đã xuất ONNX FP32: {fp32_model}")
+
+    calib_paths = list_images(args.calib_dir)
+    if not calib_paths:
+        raise SystemExit(f"Không có ảnh calibration trong {args.calib_dir}")
+    print(f"🔄 Calibrate trên {min(len(calib_paths), args.calib_limit)} ảnh ({args.method})...")
+    quantize_ssd(fp32_model, args.output, calib_paths, method=args.method, limit=args.calib_limit)
+    print(f"✓ Đã ghi model INT8: {args.output}")
+
+    report = compare(fp32_model, args.output, list_images(args.eval_dir or args.calib_dir),
+                     labels_path=args.labels, repeat=args.repeat)
+    print_report(report)
+    report_path = os.path.splitext(args.output)[0] + '.report.json'
+    with open(report_path, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"📋 Báo cáo: {report_path}")
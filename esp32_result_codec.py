@@ -0,0 +1,281 @@
+"""
+Mã hóa nhị phân gọn cho kết quả detection gửi lên /results của ESP32
+
+Định dạng (little-endian):
+
+    Header (13 bytes + pip):
+        uint8   type         0x01 = FULL, 0x02 = DELTA
+        uint16  seq          số thứ tự frame
+        uint16  base_seq     seq của trạng thái đã được ESP32 xác nhận (DELTA)
+        uint16  frame_w      kích thước frame dùng để lượng tử hóa bbox
+        uint16  frame_h
+        int16   distance_mm
+        uint8   flags        bit0 = pip_alert
+        uint8   pip_len      + pip_len bytes ASCII
+
+    FULL:  uint8 count, sau đó count x OBJECT
+    DELTA: uint8 count (tổng số object mới), uint8 n_changed,
+           sau đó n_changed x (uint8 slot, OBJECT)
+
+    OBJECT (6 bytes):
+        uint8   class_id     chỉ số trong danh sách class dùng chung
+        uint8   x, y, w, h   bbox chuẩn hóa theo frame, lượng tử 0..255
+        uint8   confidence   0..255
+"""
+import json
+import struct
+from collections import OrderedDict
+
+TYPE_FULL = 0x01
+TYPE_DELTA = 0x02
+
+CONTENT_TYPE = 'application/octet-stream'
+
+_HEADER = struct.Struct('<BHHHHhBB')
+_OBJECT = struct.Struct('<BBBBBB')
+_SLOT = struct.Struct('<B')
+
+MAX_OBJECTS = 255
+UNKNOWN_CLASS = 255
+
+
+def _quantize(value, scale):
+    return max(0, min(255, int(round(value * 255.0 / scale))))
+
+
+def _dequantize(value, scale):
+    return int(round(value * scale / 255.0))
+
+
+class ResultEncoder:
+    """
+    Mã hóa kết quả detection (dict giống JSON gửi /results) thành bytes
+
+    Ở chế độ delta, chỉ các slot object thay đổi so với trạng thái ESP32 đã
+    xác nhận (ack) gần nhất được gửi; cứ keyframe_interval frame sẽ gửi FULL
+    một lần để đồng bộ lại.
+    """
+
+    def __init__(self, class_names, frame_size=(640, 480), delta=False, keyframe_interval=30):
+        """
+        Args:
+            class_names: Danh sách tên class dùng chung với ESP32 (index = class id)
+            frame_size: (width, height) của frame để lượng tử hóa bbox
+            delta (bool): Bật chế độ chỉ gửi thay đổi
+            keyframe_interval: Số frame tối đa giữa hai lần gửi FULL
+        """
+        self.class_names = list(class_names)
+        self.class_ids = {name: i for i, name in enumerate(self.class_names)}
+        self.frame_size = frame_size
+        self.delta = delta
+        self.keyframe_interval = keyframe_interval
+
+        self.seq = 0
+        self._sent = OrderedDict()
+        self._acked_seq = None
+        self._acked_objects = None
+        self._acked_full_seq = None
+
+    def _pack_objects(self, objects, frame_size):
+        """Lượng tử hóa danh sách object thành các tuple 6 bytes"""
+        frame_w, frame_h = frame_size
+        packed = []
+        for obj in objects[:MAX_OBJECTS]:
+            x, y, w, h = obj['bbox']
+            packed.append((
+                self.class_ids.get(obj['class'], UNKNOWN_CLASS),
+                _quantize(x, frame_w), _quantize(y, frame_h),
+                _quantize(w, frame_w), _quantize(h, frame_h),
+                _quantize(float(obj['confidence']), 1.0),
+            ))
+        return packed
+
+    def encode(self, result, frame_size=None):
+        """
+        Args:
+            result (dict): {'distance_mm', 'pip', 'pip_alert', 'objects': [...]}
+            frame_size: (width, height) của frame sinh ra result (mặc định self.frame_size)
+
+        Returns:
+            bytes: Payload nhị phân
+        """
+        frame_size = frame_size or self.frame_size
+        self.seq = (self.seq + 1) & 0xFFFF
+        objects = self._pack_objects(result.get('objects', []), frame_size)
+
+        use_delta = (
+            self.delta and self._acked_objects is not None
+            and (self.seq - self._acked_full_seq) & 0xFFFF < self.keyframe_interval
+        )
+        msg_type = TYPE_DELTA if use_delta else TYPE_FULL
+        base_seq = self._acked_seq if use_delta else 0
+
+        frame_w, frame_h = frame_size
+        distance = max(-32768, min(32767, int(result.get('distance_mm', -1))))
+        pip = str(result.get('pip', 'NONE')).encode('ascii', 'replace')[:255]
+        flags = 0x01 if result.get('pip_alert') else 0x00
+
+        parts = [_HEADER.pack(msg_type, self.seq, base_seq, frame_w, frame_h,
+                              distance, flags, len(pip)), pip]
+        if use_delta:
+            base = self._acked_objects
+            changed = [i for i, obj in enumerate(objects) if i >= len(base) or base[i] != obj]
+            parts.append(bytes((len(objects), len(changed))))
+            for i in changed:
+                parts.append(_SLOT.pack(i) + _OBJECT.pack(*objects[i]))
+        else:
+            parts.append(bytes((len(objects),)))
+            for obj in objects:
+                parts.append(_OBJECT.pack(*obj))
+
+        # Giữ lại vài trạng thái gần nhất để ack sau
+        self._sent[self.seq] = (objects, use_delta)
+        while len(self._sent) > 8:
+            self._sent.popitem(last=False)
+        return b''.join(parts)
+
+    def ack(self, seq=None):
+        """
+        Đánh dấu payload đã được ESP32 nhận (làm gốc cho các delta sau)
+
+        Args:
+            seq: Seq được xác nhận (mặc định payload vừa mã hóa)
+        """
+        if seq is None:
+            seq = self.seq
+        if seq not in self._sent:
+            return
+        objects, was_delta = self._sent[seq]
+        self._acked_seq = seq
+        self._acked_objects = objects
+        if not was_delta:
+            self._acked_full_seq = seq
+
+    def reset(self):
+        """Quên trạng thái đã ack (payload tiếp theo sẽ là FULL)"""
+        self._sent.clear()
+        self._acked_seq = None
+        self._acked_objects = None
+        self._acked_full_seq = None
+
+
+class ResultDecoder:
+    """Bộ giải mã tham chiếu (Python) cho định dạng của ResultEncoder"""
+
+    def __init__(self, class_names, history=8):
+        """
+        Args:
+            class_names: Danh sách tên class dùng chung (index = class id)
+            history: Số trạng thái gần nhất giữ lại làm gốc cho delta
+        """
+        self.class_names = list(class_names)
+        self.history = history
+        self._states = OrderedDict()
+
+    def decode(self, payload):
+        """
+        Args:
+            payload (bytes): Dữ liệu từ ResultEncoder.encode
+
+        Returns:
+            dict: Kết quả cùng dạng với JSON gửi /results, kèm 'seq'
+
+        Raises:
+            ValueError: Khi payload hỏng hoặc thiếu trạng thái gốc cho delta
+        """
+        try:
+            (msg_type, seq, base_seq, frame_w, frame_h,
+             distance, flags, pip_len) = _HEADER.unpack_from(payload, 0)
+            offset = _HEADER.size
+            pip = payload[offset:offset + pip_len].decode('ascii')
+            offset += pip_len
+
+            count = payload[offset]
+            offset += 1
+            if msg_type == TYPE_FULL:
+                objects = []
+                for _ in range(count):
+                    objects.append(_OBJECT.unpack_from(payload, offset))
+                    offset += _OBJECT.size
+            elif msg_type == TYPE_DELTA:
+                if base_seq not in self._states:
+                    raise ValueError(f"Missing base state {base_seq} for delta {seq}")
+                base = self._states[base_seq]
+                objects = list(base[:count]) + [None] * max(0, count - len(base))
+                n_changed = payload[offset]
+                offset += 1
+                for _ in range(n_changed):
+                    slot = payload[offset]
+                    objects[slot] = _OBJECT.unpack_from(payload, offset + 1)
+                    offset += 1 + _OBJECT.size
+                if any(obj is None for obj in objects):
+                    raise ValueError(f"Incomplete delta {seq}")
+            else:
+                raise ValueError(f"Unknown message type {msg_type}")
+        except (struct.error, IndexError, UnicodeDecodeError) as e:
+            raise ValueError(f"Malformed result payload: {e}") from e
+
+        if offset != len(payload):
+            raise ValueError("Trailing bytes in result payload")
+
+        self._states[seq] = objects
+        while len(self._states) > self.history:
+            self._states.popitem(last=False)
+
+        return {
+            'seq': seq,
+            'distance_mm': distance,
+            'pip': pip,
+            'pip_alert': bool(flags & 0x01),
+            'objects': [self._unpack_object(obj, frame_w, frame_h) for obj in objects],
+        }
+
+    def _unpack_object(self, obj, frame_w, frame_h):
+        class_id, x, y, w, h, confidence = obj
+        if class_id < len(self.class_names):
+            class_name = self.class_names[class_id]
+        else:
+            class_name = 'unknown'
+        return {
+            'class': class_name,
+            'bbox': [_dequantize(x, frame_w), _dequantize(y, frame_h),
+                     _dequantize(w, frame_w), _dequantize(h, frame_h)],
+            'confidence': confidence / 255.0,
+        }
+
+
+if __name__ == "__main__":
+    # So sánh kích thước với JSON (kiểm tra round-trip: python -m pytest test_esp32_result_codec.py)
+    import random
+
+    classes = ['person', 'bicycle', 'car', 'chair', 'bottle']
+    random.seed(0)
+
+    def random_result(n):
+        objects = []
+        for _ in range(n):
+            x, y = random.randint(0, 500), random.randint(0, 350)
+            objects.append({
+                'class': random.choice(classes),
+                'bbox': [x, y, random.randint(10, 640 - x), random.randint(10, 480 - y)],
+                'confidence': random.random(),
+            })
+        return {'distance_mm': random.randint(-1, 4000), 'pip': 'FRONT',
+                'pip_alert': True, 'objects': objects}
+
+    for delta in (False, True):
+        encoder = ResultEncoder(classes, delta=delta)
+        result = random_result(5)
+        json_bytes = packed_bytes = 0
+        for step in range(100):
+            if step % 3 == 0:
+                result = random_result(random.randint(0, 8))
+            elif result['objects']:
+                # Chỉ một object di chuyển
+                result['objects'][0]['bbox'][0] = random.randint(0, 300)
+            payload = encoder.encode(result)
+            encoder.ack()
+            json_bytes += len(json.dumps(result))
+            packed_bytes += len(payload)
+        mode = 'delta' if delta else 'full'
+        print(f"{mode:5s}: JSON {json_bytes / 100:.0f} B/frame -> packed {packed_bytes / 100:.0f} B/frame")
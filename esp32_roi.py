@@ -0,0 +1,188 @@
+"""
+Inference theo vùng quan tâm (ROI): full frame thưa, giữa các lần chỉ chạy crop
+
+Với người đi bộ chỉ đoạn đường phía trước là quan trọng, nhưng nén cả frame
+640 px về 300x300 làm mất vật cản nhỏ ở xa. RoiScheduler chạy full frame mỗi
+full_interval frame; các frame giữa chỉ chạy network trên crop quanh các vật đã
+thấy ở lần trước và một "hành lang đi bộ" cố định, ở độ phân giải gần gốc
+(crop vuông cỡ input của net), rồi ghép kết quả về tọa độ full frame và
+loại trùng giữa các crop bằng NMS theo class.
+
+Vật mới xuất hiện ngoài hành lang chỉ được thấy ở lần full frame kế tiếp.
+"""
+import time
+
+import numpy as np
+
+from esp32_postprocess import DETECTION_DTYPE, nms
+
+
+def _square_region(x1, y1, x2, y2, width, height, min_size):
+    """Mở rộng vùng thành hình vuông (ít nhất min_size) và dời vào trong frame"""
+    side = max(x2 - x1, y2 - y1, min_size)
+    side_x, side_y = min(side, width), min(side, height)
+    cx, cy = (x1 + x2) / 2, (y1 + y2) / 2
+    left = int(min(max(cx - side_x / 2, 0), width - side_x))
+    top = int(min(max(cy - side_y / 2, 0), height - side_y))
+    return left, top, left + int(side_x), top + int(side_y)
+
+
+def _merge_regions(regions, width, height, min_size, overlap=0.5):
+    """Gộp các vùng chồng nhau hơn `overlap` diện tích vùng nhỏ hơn"""
+    merged = []
+    for region in regions:
+        for index, other in enumerate(merged):
+            inter_w = min(region[2], other[2]) - max(region[0], other[0])
+            inter_h = min(region[3], other[3]) - max(region[1], other[1])
+            if inter_w <= 0 or inter_h <= 0:
+                continue
+            smaller = min((region[2] - region[0]) * (region[3] - region[1]),
+                          (other[2] - other[0]) * (other[3] - other[1]))
+            if inter_w * inter_h > overlap * smaller:
+                merged[index] = _square_region(min(region[0], other[0]), min(region[1], other[1]),
+                                               max(region[2], other[2]), max(region[3], other[3]),
+                                               width, height, min_size)
+                break
+        else:
+            merged.append(region)
+    return merged
+
+
+def offset_detections(detections, dx, dy):
+    """Dời detections của một crop về tọa độ frame gốc (tại chỗ)"""
+    for name, delta in (('x1', dx), ('y1', dy), ('x2', dx), ('y2', dy)):
+        detections[name] += delta
+    return detections
+
+
+def merge_detections(parts, iou_threshold=0.45):
+    """
+    Ghép detections của nhiều crop/tile (đã ở tọa độ frame gốc) và loại trùng
+
+    Args:
+        parts: Danh sách mảng DETECTION_DTYPE
+        iou_threshold: IoU để coi hai box cùng class là một vật
+
+    Returns:
+        numpy.ndarray: Mảng DETECTION_DTYPE theo confidence giảm dần
+    """
+    if not parts:
+        return np.empty(0, dtype=DETECTION_DTYPE)
+    detections = np.concatenate(parts)
+    if len(detections) < 2:
+        return detections
+    boxes = np.stack([detections[name] for name in ('x1', 'y1', 'x2', 'y2')], axis=1)
+    keep = nms(boxes, detections['confidence'], iou_threshold,
+               class_ids=detections['class_id'], box_format='xyxy')
+    return detections[keep]
+
+
+class RoiScheduler:
+    """
+    Chạy detect(frames) trên full frame mỗi full_interval frame, giữa các lần chỉ trên các ROI
+
+    ROI gồm hành lang đi bộ (corridor, tỉ lệ theo frame) và vùng quanh từng
+    detection của frame trước, mở rộng theo margin, vuông, cạnh ít nhất min_size.
+    """
+
+    def __init__(self, detect, full_interval=10, corridor=(0.2, 0.3, 0.8, 1.0), margin=0.5,
+                 min_size=300, max_rois=4, iou_threshold=0.45):
+        """
+        Args:
+            detect: Hàm list ảnh -> list mảng DETECTION_DTYPE (tọa độ của từng ảnh),
+                nên chạy cả list trong một lần forward
+            full_interval: Chạy full frame mỗi N frame (1 = luôn full frame)
+            corridor: (x1, y1, x2, y2) tỉ lệ 0..1 của frame, None để tắt hành lang
+            margin: Mở rộng mỗi cạnh box trước theo tỉ lệ kích thước box
+            min_size: Cạnh nhỏ nhất của crop (pixel), nên bằng input của net (300)
+            max_rois: Số crop tối đa mỗi frame (hành lang trước, rồi box có confidence cao)
+            iou_threshold: IoU để loại trùng giữa các crop
+        """
+        self.detect = detect
+        self.full_interval = max(1, full_interval)
+        self.corridor = corridor
+        self.margin = margin
+        self.min_size = min_size
+        self.max_rois = max_rois
+        self.iou_threshold = iou_threshold
+        self.detections = np.empty(0, dtype=DETECTION_DTYPE)
+        self._since_full = None
+        self._stats = {'frames': 0, 'full': 0, 'rois': 0, 'roi_pixels': 0, 'frame_pixels': 0,
+                       'full_s': 0.0, 'roi_s': 0.0}
+
+    def regions(self, frame_shape):
+        """
+        Các ROI cho frame kế tiếp
+
+        Returns:
+            list: [(x1, y1, x2, y2), ...] theo pixel của frame
+        """
+        height, width = frame_shape[:2]
+        min_size = min(self.min_size, width, height)
+        regions = []
+        if self.corridor is not None:
+            cx1, cy1, cx2, cy2 = self.corridor
+            regions.append(_square_region(cx1 * width, cy1 * height, cx2 * width, cy2 * height,
+                                          width, height, min_size))
+        for row in np.sort(self.detections, order='confidence')[::-1]:
+            pad_x = (row['x2'] - row['x1']) * self.margin
+            pad_y = (row['y2'] - row['y1']) * self.margin
+            regions.append(_square_region(row['x1'] - pad_x, row['y1'] - pad_y,
+                                          row['x2'] + pad_x, row['y2'] + pad_y, width, height, min_size))
+        return _merge_regions(regions, width, height, min_size)[:self.max_rois]
+
+    def process(self, frame):
+        """
+        Returns:
+            tuple: (mảng DETECTION_DTYPE tọa độ full frame, full) với full=True
+                nếu frame này chạy full frame
+        """
+        self._stats['frames'] += 1
+        self._stats['frame_pixels'] += frame.shape[0] * frame.shape[1]
+        start = time.perf_counter()
+        regions = None
+        if self._since_full is not None and self._since_full < self.full_interval:
+            regions = self.regions(frame.shape)
+            if sum((x2 - x1) * (y2 - y1) for x1, y1, x2, y2 in regions) >= frame.shape[0] * frame.shape[1]:
+                # Các crop phủ hết frame: chạy full frame rẻ hơn
+                regions = None
+
+        if not regions:
+            self.detections = self.detect([frame])[0]
+            self._since_full = 1
+            self._stats['full'] += 1
+            self._stats['roi_pixels'] += frame.shape[0] * frame.shape[1]
+            self._stats['full_s'] += time.perf_counter() - start
+            return self.detections, True
+
+        crops = [frame[y1:y2, x1:x2] for x1, y1, x2, y2 in regions]
+        parts = [offset_detections(detections, x1, y1)
+                 for detections, (x1, y1, _, _) in zip(self.detect(crops), regions)]
+        self.detections = merge_detections(parts, self.iou_threshold)
+        self._since_full += 1
+        self._stats['rois'] += len(regions)
+        self._stats['roi_pixels'] += sum((x2 - x1) * (y2 - y1) for x1, y1, x2, y2 in regions)
+        self._stats['roi_s'] += time.perf_counter() - start
+        return self.detections, False
+
+    def reset(self):
+        """Bắt buộc chạy full frame ở frame kế tiếp"""
+        self._since_full = None
+
+    def stats(self):
+        """
+        Returns:
+            dict: {'frames', 'full', 'roi_frames', 'rois_avg', 'pixel_ratio', 'full_avg_ms', 'roi_avg_ms'}
+        """
+        s = self._stats
+        roi_frames = s['frames'] - s['full']
+        return {
+            'frames': s['frames'],
+            'full': s['full'],
+            'roi_frames': roi_frames,
+            'rois_avg': s['rois'] / roi_frames if roi_frames else 0.0,
+            # Tỉ lệ pixel đưa vào network so với chạy full frame mọi frame
+            'pixel_ratio': s['roi_pixels'] / s['frame_pixels'] if s['frame_pixels'] else 0.0,
+            'full_avg_ms': s['full_s'] / s['full'] * 1000 if s['full'] else 0.0,
+            'roi_avg_ms': s['roi_s'] / roi_frames * 1000 if roi_frames else 0.0,
+        }
@@ -1,7 +1,12 @@
 import cv2
-import numpy as np
+import sys
 import time
 
+from esp32_display import create_display
+from esp32_dnn_config import load_tuned_net
+from esp32_inference import SSDPreprocessor
+from esp32_postprocess import postprocess_ssd
+
 # ==== CẤU HÌNH ====
 # Đổi thành IP của bạn nếu khác
 ESP32_IP = "192.168.1.14"
@@ -29,9 +34,13 @@ CLASSES = ["background", "aeroplane", "bicycle", "bird", "boat",
 # Bạn có thể chỉ quan tâm 1 vài lớp (ví dụ person + bottle + chair)
 INTERESTING = {"person", "bottle", "chair", "tvmonitor", "car", "dog", "cat"}
 
+# Không vẽ, không mở cửa sổ (thoát bằng Ctrl+C)
+HEADLESS = "--headless" in sys.argv
+
 # ==== LOAD MODEL ====
 print("[INFO] Loading model...")
-net = cv2.dnn.readNetFromCaffe(PROTOTXT, MODEL)
+net = load_tuned_net(PROTOTXT, MODEL)
+preprocess = SSDPreprocessor()
 
 # ==== MỞ CAMERA (thử các URL) ====
 cap = None
@@ -51,47 +60,54 @@ if cap is None:
     print("[ERROR] Không mở được stream nào. Kiểm tra URL/ESP32.")
     exit(1)
 
+
+
+def render_frame(frame, detections):
+    """Vẽ bbox và nhãn (chạy trên thread hiển thị)"""
+    for label, confidence, startX, startY, endX, endY in detections:
+        text = f"{label}: {confidence:.2f}"
+        y = startY - 10 if startY - 10 > 10 else startY + 10
+        cv2.rectangle(frame, (startX, startY), (endX, endY), (0, 255, 0), 2)
+        cv2.putText(frame, text, (startX, y),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2)
+    return frame
+
+
+# Vẽ và hiển thị trên thread riêng (hoặc không vẽ gì khi headless)
+display = create_display("ESP32-CAM Detection", render_frame, headless=HEADLESS)
+print("[INFO] Nhấn 'q' để thoát" if not HEADLESS else "[INFO] Nhấn Ctrl+C để thoát")
+
 # ==== VÒNG LẶP NHẬN DIỆN ====
-while True:
-    ret, frame = cap.read()
-    if not ret or frame is None:
-        # nếu stream dùng /capture (trả về single jpeg), cần thử lại
-        print("[WARN] Không nhận frame, thử reconnect...")
-        time.sleep(0.5)
-        continue
-
-    (h, w) = frame.shape[:2]
-    # chuẩn bị blob cho DNN
-    blob = cv2.dnn.blobFromImage(cv2.resize(frame, (300, 300)),
-                                 0.007843, (300, 300), 127.5)
-    net.setInput(blob)
-    detections = net.forward()
-
-    # duyệt detections
-    for i in range(0, detections.shape[2]):
-        confidence = detections[0, 0, i, 2]
-        if confidence > CONF_THRESHOLD:
-            idx = int(detections[0, 0, i, 1])
-            label = CLASSES[idx] if idx < len(CLASSES) else str(idx)
-            if label not in INTERESTING:
-                continue  # bỏ qua những lớp không quan tâm
-
-            box = detections[0, 0, i, 3:7] * np.array([w, h, w, h])
-            (startX, startY, endX, endY) = box.astype("int")
-
-            # vẽ bbox và nhãn
-            text = f"{label}: {confidence:.2f}"
-            y = startY - 10 if startY - 10 > 10 else startY + 10
-            cv2.rectangle(frame, (startX, startY), (endX, endY), (0, 255, 0), 2)
-            cv2.putText(frame, text, (startX, y),
-                        cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2)
-
-    # hiển thị
-    cv2.imshow("ESP32-CAM Detection", frame)
-    key = cv2.waitKey(1) & 0xFF
-    if key == ord("q"):
-        break
+try:
+    while True:
+        ret, frame = cap.read()
+        if not ret or frame is None:
+            # nếu stream dùng /capture (trả về single jpeg), cần thử lại
+            print("[WARN] Không nhận frame, thử reconnect...")
+            time.sleep(0.5)
+            continue
+
+        (h, w) = frame.shape[:2]
+        # chuẩn bị blob cho DNN (buffer dùng lại giữa các frame)
+        net.setInput(preprocess(frame))
+        detections = net.forward()
+
+        # duyệt detections (lọc theo confidence bằng NumPy), bỏ qua những lớp không quan tâm
+        results = postprocess_ssd(detections, w, h, CONF_THRESHOLD, num_classes=len(CLASSES), clip=False)
+        snapshot = [(CLASSES[idx], confidence, startX, startY, endX, endY)
+                    for idx, confidence, startX, startY, endX, endY in results.tolist()
+                    if CLASSES[idx] in INTERESTING]
+
+        # hiển thị (vẽ trên thread hiển thị)
+        display.show(frame, snapshot)
+        if HEADLESS and snapshot:
+            print(f"[{time.strftime('%H:%M:%S')}] " +
+                  ", ".join(f"{label}: {confidence:.2f}" for label, confidence, *_ in snapshot))
+        if display.poll_key() == ord("q"):
+            break
+except KeyboardInterrupt:
+    pass
 
 # cleanup
 cap.release()
-cv2.destroyAllWindows()
+display.close()
@@ -1,21 +1,32 @@
 import cv2
-import numpy as np
-import requests
-from PIL import Image
-import io
+import sys
 import time
 from collections import defaultdict
 
+from esp32_cascades import CascadeEngine, get_cascade, print_cascade_registry_info
+from esp32_display import create_display
+from esp32_frame_source import CaptureFrameSource, LatestFrameGrabber
+from esp32_motion_gate import MotionGate
+
 class ESP32CamSimpleObjectDetector:
-    def __init__(self, esp32_ip="192.168.1.14"):
+    def __init__(self, esp32_ip="192.168.1.14", frame_source=None, motion_threshold=None, headless=False):
         """
         Detector đồ vật đơn giản cho ESP32-CAM sử dụng Haar Cascade có sẵn
         
         Args:
             esp32_ip (str): IP address của ESP32-CAM
+            frame_source (FrameSource): Nguồn frame (mặc định poll /capture trên thread riêng)
+            motion_threshold (float): Tỉ lệ pixel thumbnail thay đổi tối thiểu để chạy cascade,
+                dưới ngưỡng dùng lại kết quả trước (MotionGate); None = tắt
+            headless (bool): Không vẽ và không mở cửa sổ (thoát bằng Ctrl+C); khi hiển thị,
+                việc vẽ chạy trên thread riêng (esp32_display)
         """
         self.esp32_ip = esp32_ip
         self.stream_url = f"http://{esp32_ip}/capture"
+        self.frame_source = frame_source or LatestFrameGrabber(
+            CaptureFrameSource(self.stream_url, timeout=2)
+        )
+        self.stream_url = self.frame_source.url
         
         # Khởi tạo các cascade cho đồ vật
         self.cascades = {}
@@ -29,14 +40,25 @@ class ESP32CamSimpleObjectDetector:
         
         # Tải các cascade có sẵn
         for obj_name, (cascade_file, color) in self.cascade_info.items():
-            cascade_path = cv2.data.haarcascades + cascade_file
-            cascade = cv2.CascadeClassifier(cascade_path)
-            if not cascade.empty():
+            cascade = get_cascade(cascade_file)
+            if cascade is not None:
                 self.cascades[obj_name] = (cascade, color)
                 print(f"✓ Đã tải cascade cho {obj_name}")
             else:
                 print(f"⚠️ Không tìm thấy cascade cho {obj_name}")
         
+        # Tham số detectMultiScale cho từng loại object, chạy song song mỗi frame
+        self.cascade_engine = CascadeEngine({
+            obj_name: (cascade, self._cascade_params(obj_name))
+            for obj_name, (cascade, color) in self.cascades.items()
+        })
+        
+        # Bỏ qua cascade khi cảnh đứng yên (tắt mặc định)
+        self.motion_gate = MotionGate(motion_threshold) if motion_threshold else None
+        self._last_results = None
+        self.headless = headless
+        self.display = None
+        
         # Thống kê
         self.detection_stats = defaultdict(int)
         self.total_frames = 0
@@ -51,25 +73,25 @@ class ESP32CamSimpleObjectDetector:
         Returns:
             numpy.ndarray: Frame image hoặc None nếu lỗi
         """
-        try:
-            response = requests.get(self.stream_url, timeout=2)
-            if response.status_code == 200:
-                image = Image.open(io.BytesIO(response.content))
-                frame = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
-                
-                # Resize để tối ưu
-                height, width = frame.shape[:2]
-                if width > 640:
-                    scale = 640 / width
-                    new_width = 640
-                    new_height = int(height * scale)
-                    frame = cv2.resize(frame, (new_width, new_height))
-                
-                return frame
-            else:
-                return None
-        except Exception as e:
-            return None
+        return self.frame_source.read()
+
+    @staticmethod
+    def _cascade_params(obj_name):
+        """Tham số detectMultiScale tối ưu cho từng loại object"""
+        if obj_name == 'smile':
+            # Tăng độ nghiêm ngặt cho smile để giảm false positive
+            return {'scaleFactor': 1.2, 'minNeighbors': 8, 'minSize': (30, 30),
+                    'flags': cv2.CASCADE_SCALE_IMAGE}
+        if obj_name == 'eye':
+            return {'scaleFactor': 1.1, 'minNeighbors': 5, 'minSize': (15, 15),
+                    'flags': cv2.CASCADE_SCALE_IMAGE}
+        if obj_name == 'car':
+            # Xe thường lớn hơn
+            return {'scaleFactor': 1.1, 'minNeighbors': 4, 'minSize': (50, 50),
+                    'flags': cv2.CASCADE_SCALE_IMAGE}
+        # Tham số mặc định cho các object khác
+        return {'scaleFactor': 1.1, 'minNeighbors': 5, 'minSize': (25, 25),
+                'flags': cv2.CASCADE_SCALE_IMAGE}
     
     def detect_objects(self, frame):
         """
@@ -79,67 +101,84 @@ class ESP32CamSimpleObjectDetector:
             frame: Input frame
             
         Returns:
-            tuple: (frame_with_detections, detections_info)
+            tuple: (frame_with_detections, detections_info, object_counts)
+        """
+        results = self.run_cascades(frame)
+        detections_info, object_counts = self.summarize_results(results)
+        return self.draw_boxes(frame, results), detections_info, object_counts
+    
+    def run_cascades(self, frame):
+        """
+        Chạy các cascade (không vẽ)
+        
+        Returns:
+            dict: {tên object: các box (x, y, w, h)}
+        """
+        # Nhận diện tất cả loại đồ vật trên cùng một ảnh gray (dùng lại kết quả khi cảnh không đổi)
+        if self.motion_gate is None or self.motion_gate.check(frame) or self._last_results is None:
+            self._last_results = self.cascade_engine.run(frame)
+        return self._last_results
+    
+    def summarize_results(self, results):
+        """
+        Thông tin detections (không vẽ)
+        
+        Returns:
+            tuple: (detections_info, object_counts)
         """
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
         detections_info = []
         object_counts = defaultdict(int)
-        
-        # Nhận diện từng loại đồ vật với tham số tối ưu
-        for obj_name, (cascade, color) in self.cascades.items():
-            # Tham số khác nhau cho từng loại object
-            if obj_name == 'smile':
-                # Tăng độ nghiêm ngặt cho smile để giảm false positive
-                objects = cascade.detectMultiScale(
-                    gray,
-                    scaleFactor=1.2,
-                    minNeighbors=8,  # Tăng để giảm false positive
-                    minSize=(30, 30),  # Tăng kích thước tối thiểu
-                    flags=cv2.CASCADE_SCALE_IMAGE
-                )
-            elif obj_name == 'eye':
-                # Tham số cho mắt
-                objects = cascade.detectMultiScale(
-                    gray,
-                    scaleFactor=1.1,
-                    minNeighbors=5,
-                    minSize=(15, 15),
-                    flags=cv2.CASCADE_SCALE_IMAGE
-                )
-            elif obj_name == 'car':
-                # Tham số cho xe
-                objects = cascade.detectMultiScale(
-                    gray,
-                    scaleFactor=1.1,
-                    minNeighbors=4,
-                    minSize=(50, 50),  # Xe thường lớn hơn
-                    flags=cv2.CASCADE_SCALE_IMAGE
-                )
-            else:
-                # Tham số mặc định cho các object khác
-                objects = cascade.detectMultiScale(
-                    gray,
-                    scaleFactor=1.1,
-                    minNeighbors=5,
-                    minSize=(25, 25),
-                    flags=cv2.CASCADE_SCALE_IMAGE
-                )
-            
-            # Vẽ bounding box cho mỗi object
-            for i, (x, y, w, h) in enumerate(objects):
-                cv2.rectangle(frame, (x, y), (x+w, y+h), color, 2)
-                cv2.putText(frame, f'{obj_name.title()} {i+1}', 
-                           (x, y-10), cv2.FONT_HERSHEY_SIMPLEX, 0.6, color, 2)
-                
+        for obj_name in self.cascades:
+            for x, y, w, h in results.get(obj_name, ()):
                 detections_info.append({
                     'class': obj_name,
                     'bbox': (x, y, w, h),
                     'confidence': 1.0
                 })
-                
                 object_counts[obj_name] += 1
+        return detections_info, dict(object_counts)
+    
+    def draw_boxes(self, frame, results):
+        """Vẽ bounding box cho mỗi object lên frame"""
+        for obj_name, (cascade, color) in self.cascades.items():
+            for i, (x, y, w, h) in enumerate(results.get(obj_name, ())):
+                cv2.rectangle(frame, (x, y), (x+w, y+h), color, 2)
+                cv2.putText(frame, f'{obj_name.title()} {i+1}', 
+                           (x, y-10), cv2.FONT_HERSHEY_SIMPLEX, 0.6, color, 2)
+        return frame
+    
+    def render_frame(self, frame, snapshot):
+        """
+        Vẽ frame để hiển thị (chạy trên thread hiển thị)
+        
+        Args:
+            frame: Frame đã chạy cascade
+            snapshot: (results, object_counts, fps)
+        """
+        results, object_counts, fps = snapshot
+        self.draw_boxes(frame, results)
+        
+        # Hiển thị thông tin
+        total_objects = sum(object_counts.values())
+        cv2.putText(frame, f"Objects: {total_objects}", (10, 30), 
+                   cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 255), 2)
+        
+        if fps > 0:
+            cv2.putText(frame, f"FPS: {fps:.1f}", (10, 60), 
+                       cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2)
+        
+        cv2.putText(frame, f"ESP32: {self.esp32_ip}", 
+                   (10, frame.shape[0] - 10), 
+                   cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1)
         
-        return frame, detections_info, dict(object_counts)
+        # Hiển thị chi tiết objects
+        y_offset = 90
+        for obj_name, count in object_counts.items():
+            cv2.putText(frame, f"{obj_name.title()}: {count}", 
+                       (10, y_offset), 
+                       cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 1)
+            y_offset += 20
+        return frame
     
     def run_detection(self):
         """
@@ -155,80 +194,70 @@ class ESP32CamSimpleObjectDetector:
         fps_counter = 0
         fps_start_time = time.time()
         last_print_time = time.time()
+        # Vẽ và hiển thị trên thread riêng (hoặc không vẽ gì khi headless)
+        self.display = create_display('ESP32-CAM Simple Object Detection', self.render_frame,
+                                      headless=self.headless)
         
-        while True:
-            current_time = time.time()
-            
-            # Lấy frame
-            frame = self.get_frame_from_esp32()
-            
-            if frame is None:
-                time.sleep(0.1)
-                continue
-            
-            # Nhận diện objects
-            frame_with_detections, detections, object_counts = self.detect_objects(frame)
-            
-            # Tính FPS
-            fps_counter += 1
-            if fps_counter % 30 == 0:
-                fps = fps_counter / (current_time - fps_start_time)
-                fps_counter = 0
-                fps_start_time = current_time
-            else:
-                fps = 0
-            
-            # Hiển thị thông tin
-            total_objects = sum(object_counts.values())
-            cv2.putText(frame_with_detections, f"Objects: {total_objects}", (10, 30), 
-                       cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 255), 2)
-            
-            if fps > 0:
-                cv2.putText(frame_with_detections, f"FPS: {fps:.1f}", (10, 60), 
-                           cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2)
-            
-            cv2.putText(frame_with_detections, f"ESP32: {self.esp32_ip}", 
-                       (10, frame_with_detections.shape[0] - 10), 
-                       cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1)
-            
-            # Hiển thị chi tiết objects
-            y_offset = 90
-            for obj_name, count in object_counts.items():
-                cv2.putText(frame_with_detections, f"{obj_name.title()}: {count}", 
-                           (10, y_offset), 
-                           cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 1)
-                y_offset += 20
-            
-            # Hiển thị frame
-            cv2.imshow('ESP32-CAM Simple Object Detection', frame_with_detections)
-            
-            # Cập nhật thống kê
-            self.total_frames += 1
-            for obj_name, count in object_counts.items():
-                self.detection_stats[obj_name] += count
-            
-            # In thông tin định kỳ
-            if current_time - last_print_time > 5:  # Mỗi 5 giây
-                if object_counts:
-                    print(f"📊 Detections: {total_objects} objects - {object_counts}")
-                last_print_time = current_time
-            
-            # Xử lý phím
-            key = cv2.waitKey(1) & 0xFF
-            if key == ord('q'):
-                break
-            elif key == ord('s'):
-                filename = f"esp32_simple_objects_{int(time.time())}.jpg"
-                cv2.imwrite(filename, frame_with_detections)
-                print(f"📸 Đã chụp ảnh: {filename}")
-            elif key == ord('r'):
-                self.detection_stats = defaultdict(int)
-                self.total_frames = 0
-                print("🔄 Đã reset thống kê")
-            elif key == ord('i'):
-                self._print_cascade_info()
-        
-        cv2.destroyAllWindows()
+        try:
+            while True:
+                current_time = time.time()
+                
+                # Lấy frame
+                frame = self.get_frame_from_esp32()
+                
+                if frame is None:
+                    time.sleep(0.1)
+                    continue
+                
+                # Nhận diện objects (không vẽ trên thread này)
+                results = self.run_cascades(frame)
+                detections, object_counts = self.summarize_results(results)
+                
+                # Tính FPS
+                fps_counter += 1
+                if fps_counter % 30 == 0:
+                    fps = fps_counter / (current_time - fps_start_time)
+                    fps_counter = 0
+                    fps_start_time = current_time
+                else:
+                    fps = 0
+                
+                # Vẽ trên thread hiển thị từ snapshot của frame này
+                self.display.show(frame, (results, object_counts, fps))
+                
+                # Cập nhật thống kê
+                total_objects = sum(object_counts.values())
+                self.total_frames += 1
+                for obj_name, count in object_counts.items():
+                    self.detection_stats[obj_name] += count
+                
+                # In thông tin định kỳ
+                if current_time - last_print_time > 5:  # Mỗi 5 giây
+                    if object_counts:
+                        print(f"📊 Detections: {total_objects} objects - {object_counts}")
+                    last_print_time = current_time
+                
+                # Xử lý phím
+                key = self.display.poll_key()
+                if key == ord('q'):
+                    break
+                elif key == ord('s') and self.display.last_image is not None:
+                    filename = f"esp32_simple_objects_{int(time.time())}.jpg"
+                    cv2.imwrite(filename, self.display.last_image)
+                    print(f"📸 Đã chụp ảnh: {filename}")
+                elif key == ord('r'):
+                    self.detection_stats = defaultdict(int)
+                    self.total_frames = 0
+                    print("🔄 Đã reset thống kê")
+                elif key == ord('i'):
+                    self._print_cascade_info()
+        except KeyboardInterrupt:
+            # Cách thoát duy nhất khi headless
+            pass
+        
+        self.frame_source.close()
+        self.cascade_engine.close()
+        self.display.close()
         self._print_final_stats()
     
     def _print_cascade_info(self):
@@ -236,12 +265,21 @@ class ESP32CamSimpleObjectDetector:
         print("\n📋 Thông tin Cascade:")
         for obj_name, (cascade, color) in self.cascades.items():
             print(f"   - {obj_name.title()}: {self.cascade_info[obj_name][0]}")
+        print_cascade_registry_info()
     
     def _print_final_stats(self):
         """In thống kê cuối"""
         print("\n📊 Thống kê cuối:")
         print(f"   - Tổng frames: {self.total_frames}")
         print(f"   - Tổng objects: {sum(self.detection_stats.values())}")
+        capture_stats = self.frame_source.stats()
+        if capture_stats:
+            print(f"   - Capture: {capture_stats['captured']} frames, "
+                  f"dropped {capture_stats['dropped']}, errors {capture_stats['errors']}, "
+                  f"trùng (bỏ qua) {capture_stats['duplicates']}")
+        self.cascade_engine.print_timings()
+        if self.motion_gate is not None:
+            self.motion_gate.print_stats(sum(t['avg_ms'] for t in self.cascade_engine.timings().values()))
         
         if self.detection_stats:
             print("   - Chi tiết:")
@@ -249,5 +287,5 @@ class ESP32CamSimpleObjectDetector:
                 print(f"     {obj_name.title()}: {count}")
 
 if __name__ == "__main__":
-    detector = ESP32CamSimpleObjectDetector("192.168.1.14")
+    detector = ESP32CamSimpleObjectDetector("192.168.1.14", headless="--headless" in sys.argv)
     detector.run_detection()
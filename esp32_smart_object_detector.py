@@ -1,28 +1,78 @@
+import argparse
 import cv2
 import numpy as np
-import requests
-from PIL import Image
-import io
 import time
 from collections import defaultdict, deque
 
+from esp32_display import create_display
+from esp32_dnn_config import load_tuned_net
+from esp32_engines import INT8_SSD_MODEL, OnnxSSDEngine
+from esp32_frame_source import CaptureFrameSource, LatestFrameGrabber
+from esp32_inference import InferencePipeline, SSDPreprocessor, forward_batch
+from esp32_latency import FrameRate, StageLatency
+from esp32_motion_gate import MotionGate
+from esp32_postprocess import postprocess_ssd
+from esp32_roi import RoiScheduler
+from esp32_tiling import TiledDetector
+from esp32_tracking import DetectTrackScheduler
+
 class ESP32CamSmartObjectDetector:
-    def __init__(self, esp32_ip="192.168.1.14"):
+    def __init__(self, esp32_ip="192.168.1.14", frame_source=None, inference_depth=2,
+                 inference_server=None, use_int8=False, track_interval=None,
+                 motion_threshold=None, roi_interval=None, tile_size=None, tile_overlap=0.25,
+                 headless=False, latency_log=None):
         """
         Detector đồ vật thông minh sử dụng MobileNet SSD
         
         Args:
             esp32_ip (str): IP address của ESP32-CAM
+            frame_source (FrameSource): Nguồn frame (mặc định poll /capture trên thread riêng)
+            inference_depth (int): Số frame inference cùng lúc trong run_detection
+                (mỗi frame thêm một bản sao net; 1 = đồng bộ như trước)
+            inference_server (BatchInferenceServer): Dùng chung net/batch với các camera khác
+            use_int8 (bool): Dùng model INT8 (esp32_quantize.py) qua ONNX Runtime thay cho Caffe FP32
+            track_interval (int): Chạy network tối đa mỗi N frame, các frame giữa dời box bằng
+                optical flow (N tự chỉnh theo chuyển động); None = chạy network mọi frame
+            motion_threshold (float): Tỉ lệ pixel thumbnail thay đổi tối thiểu để chạy inference,
+                dưới ngưỡng dùng lại detections trước (MotionGate); None = tắt
+            roi_interval (int): Chạy full frame mỗi N lần, các lần giữa chỉ chạy crop quanh vật
+                đã thấy và hành lang đi bộ ở độ phân giải gốc (RoiScheduler); None = luôn full frame
+            tile_size (int): Chia frame thành các tile vuông cạnh tile_size chồng nhau, chạy một
+                forward theo batch và ghép kết quả (TiledDetector, cho frame VGA trở lên); None = tắt
+                Nguồn frame mặc định khi đó giữ nguyên độ phân giải; frame_source tự truyền vào
+                cần tạo với max_width=None
+            tile_overlap (float): Tỉ lệ chồng giữa hai tile liền nhau
+            headless (bool): Không vẽ và không mở cửa sổ (thoát bằng Ctrl+C); khi hiển thị,
+                việc vẽ chạy trên thread riêng (esp32_display)
+            latency_log (str): File JSON lines nhận p50/p95/p99 của từng công đoạn mỗi 10 giây
         """
         self.esp32_ip = esp32_ip
         self.stream_url = f"http://{esp32_ip}/capture"
-        
-        # Load MobileNet SSD model
-        print("Loading MobileNet SSD model...")
-        self.net = cv2.dnn.readNetFromCaffe(
-            "MobileNetSSD_deploy.prototxt",
-            "MobileNetSSD_deploy.caffemodel"
+        # Tiling cần frame độ phân giải gốc, không thu về 640 px khi giải mã
+        self.frame_source = frame_source or LatestFrameGrabber(
+            CaptureFrameSource(self.stream_url, timeout=3, verbose=True,
+                               max_width=None if tile_size else 640)
         )
+        self.stream_url = self.frame_source.url
+        
+        # Độ trễ theo công đoạn (fetch/decode trên thread capture của frame source)
+        self.latency = StageLatency(esp32_ip, export_path=latency_log)
+        self.frame_source.latency = self.latency
+        self.frame_rate = FrameRate()
+        
+        # Load MobileNet SSD model (hoặc dùng net của server chung)
+        self.inference_depth = inference_depth
+        self.inference_server = inference_server
+        self.use_int8 = use_int8
+        if inference_server is not None:
+            self.net = inference_server.net
+        else:
+            print("Loading MobileNet SSD model...")
+            self.net = self._load_net()
+        self.inference = None
+        self.preprocess = SSDPreprocessor()
+        self.headless = headless
+        self.display = None
         
         # Danh sách các classes mà model có thể nhận diện
         self.classes = ["background", "aeroplane", "bicycle", "bird", "boat",
@@ -40,6 +90,30 @@ class ESP32CamSmartObjectDetector:
         # Buffer để smoothing và lọc false positive
         self.detection_history = defaultdict(lambda: deque(maxlen=5))
         
+        # Inference theo tile (tắt mặc định)
+        self.tiling = None
+        if tile_size:
+            self.tiling = TiledDetector(self._detect_batch, tile_size=tile_size, overlap=tile_overlap)
+        
+        # Inference theo ROI (tắt mặc định)
+        self.roi = None
+        if roi_interval:
+            self.roi = RoiScheduler(self._detect_batch, full_interval=roi_interval)
+        
+        # Detect-then-track (tắt mặc định), network chạy qua ROI hoặc tile nếu có
+        self.tracking = None
+        if track_interval:
+            detect = self._detect_array
+            if self.roi is not None:
+                detect = self._detect_roi
+            elif self.tiling is not None:
+                detect = self.tiling.process
+            self.tracking = DetectTrackScheduler(detect, max_interval=track_interval)
+        
+        # Bỏ qua inference khi cảnh đứng yên (tắt mặc định)
+        self.motion_gate = MotionGate(motion_threshold) if motion_threshold else None
+        self._last_results = None
+        
         # Thống kê
         self.detection_stats = defaultdict(int)
         self.total_frames = 0
@@ -47,30 +121,20 @@ class ESP32CamSmartObjectDetector:
         print(f"Kết nối ESP32-CAM tại: {self.stream_url}")
         print(f"Đã tải MobileNet SSD model với {len(self.classes)} classes")
         
+    def _load_net(self):
+        """Đọc MobileNet SSD (Caffe) với backend/thread đã tune cho máy này, hoặc model INT8"""
+        if self.use_int8:
+            # Mỗi replica của InferencePipeline một phần số core, không spin
+            return OnnxSSDEngine(INT8_SSD_MODEL, replicas=self.inference_depth)
+        return load_tuned_net(
+            "MobileNetSSD_deploy.prototxt",
+            "MobileNetSSD_deploy.caffemodel"
+        )
+    
     def get_frame_from_esp32(self):
         """Lấy frame từ ESP32-CAM"""
-        try:
-            response = requests.get(self.stream_url, timeout=3)
-            if response.status_code == 200:
-                image = Image.open(io.BytesIO(response.content))
-                frame = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
+        return self.frame_source.read()
 
-                # Resize để tối ưu
-                height, width = frame.shape[:2]
-                if width > 640:
-                    scale = 640 / width
-                    new_width = 640
-                    new_height = int(height * scale)
-                    frame = cv2.resize(frame, (new_width, new_height))
-
-                return frame
-            else:
-                print(f"[ESP32] HTTP {response.status_code} when requesting {self.stream_url}")
-                return None
-        except Exception as e:
-            print(f"[ESP32] Error getting frame: {e}")
-            return None
-    
     def update_detection_history(self, detections_info):
         """
         Cập nhật lịch sử detections cho smoothing
@@ -89,50 +153,156 @@ class ESP32CamSmartObjectDetector:
         for class_name in self.classes:
             self.detection_history[class_name].append(current_counts[class_name])
     
+    def _forward(self, frame):
+        """Output thô của MobileNet SSD cho một frame"""
+        if self.inference_server is not None:
+            # Net thuộc về server, không gọi forward trực tiếp từ thread này
+            start = time.perf_counter()
+            output = self.inference_server.submit(frame).result()
+            self.latency.lap('forward', start)
+            return output
+        # Đưa blob qua network
+        start = time.perf_counter()
+        self.net.setInput(self.preprocess(frame))
+        start = self.latency.lap('preprocess', start)
+        output = self.net.forward()
+        self.latency.lap('forward', start)
+        return output
+    
+    def _detect_array(self, frame):
+        """Detections của một frame dạng mảng DETECTION_DTYPE (đã lọc theo confidence)"""
+        return self._postprocess(frame, self._forward(frame))
+    
+    def _detect_batch(self, frames):
+        """Detections của nhiều ảnh (crop) trong một lần forward, tọa độ theo từng ảnh"""
+        if self.inference_server is not None:
+            # Server gộp các crop vào cùng batch
+            start = time.perf_counter()
+            futures = [self.inference_server.submit(frame) for frame in frames]
+            outputs = [future.result() for future in futures]
+            self.latency.lap('forward', start)
+        else:
+            outputs = forward_batch(self.net, self.preprocess, frames, self.latency)
+        return [self._postprocess(frame, output) for frame, output in zip(frames, outputs)]
+    
+    def _detect_roi(self, frame):
+        """Detections của một frame qua RoiScheduler (full frame hoặc các crop)"""
+        return self.roi.process(frame)[0]
+    
     def detect_objects(self, frame):
         """Nhận diện đồ vật sử dụng MobileNet SSD"""
+        return self.draw_detections(frame, self._forward(frame))
+    
+    def draw_detections(self, frame, detections):
+        """
+        Lọc output của MobileNet SSD và vẽ lên frame
+        
+        Args:
+            frame: Frame đã chạy inference
+            detections: Output của net.forward() cho frame này
+            
+        Returns:
+            tuple: (frame_with_detections, detections_info, object_counts)
+        """
+        return self.draw_results(frame, self._postprocess(frame, detections))
+    
+    def _postprocess(self, frame, detections):
+        """Lọc output của MobileNet SSD (vector hóa) thành mảng DETECTION_DTYPE"""
+        start = time.perf_counter()
         (h, w) = frame.shape[:2]
-        # Tạo blob từ image
-        blob = cv2.dnn.blobFromImage(frame, 0.007843, (300, 300), 127.5)
+        results = postprocess_ssd(detections, w, h, self.confidence_threshold,
+                                  num_classes=len(self.classes), clip=False)
+        self.latency.lap('postprocess', start)
+        return results
+    
+    def draw_results(self, frame, results):
+        """
+        Vẽ detections đã hậu xử lý lên frame
         
-        # Đưa blob qua network
-        self.net.setInput(blob)
-        detections = self.net.forward()
+        Args:
+            frame: Frame cần vẽ
+            results: Mảng DETECTION_DTYPE (từ postprocess_ssd hoặc tracker)
+            
+        Returns:
+            tuple: (frame_with_detections, detections_info, object_counts)
+        """
+        detections_info, object_counts = self.summarize_results(results)
+        return self.draw_boxes(frame, results), detections_info, object_counts
+    
+    def summarize_results(self, results):
+        """
+        Thông tin detections (không vẽ)
         
+        Returns:
+            tuple: (detections_info, object_counts)
+        """
         detections_info = []
         object_counts = defaultdict(int)
         
-        # Lọc và vẽ các detections
-        for i in range(detections.shape[2]):
-            confidence = detections[0, 0, i, 2]
+        for class_id, confidence, startX, startY, endX, endY in results.tolist():
+            class_name = self.classes[class_id]
+            detections_info.append({
+                'class': class_name,
+                'bbox': (startX, startY, endX - startX, endY - startY),
+                'confidence': confidence
+            })
+            object_counts[class_name] += 1
+        
+        return detections_info, dict(object_counts)
+    
+    def draw_boxes(self, frame, results):
+        """Vẽ bounding box và label của từng detection lên frame"""
+        for class_id, confidence, startX, startY, endX, endY in results.tolist():
+            color = self.colors[class_id].astype('int').tolist()
+            cv2.rectangle(frame, (startX, startY), (endX, endY), color, 2)
             
-            if confidence > self.confidence_threshold:
-                # Lấy index của class
-                class_id = int(detections[0, 0, i, 1])
-                class_name = self.classes[class_id]
-                
-                # Tính toán coordinates của bounding box
-                box = detections[0, 0, i, 3:7] * np.array([w, h, w, h])
-                (startX, startY, endX, endY) = box.astype("int")
-                
-                # Vẽ bounding box và label
-                color = self.colors[class_id].astype('int').tolist()
-                cv2.rectangle(frame, (startX, startY), (endX, endY), color, 2)
-                
-                label = f"{class_name}: {confidence * 100:.1f}%"
-                y = startY - 15 if startY - 15 > 15 else startY + 15
-                cv2.putText(frame, label, (startX, y),
-                           cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 2)
-                
-                detections_info.append({
-                    'class': class_name,
-                    'bbox': (startX, startY, endX - startX, endY - startY),
-                    'confidence': confidence
-                })
-                
-                object_counts[class_name] += 1
+            label = f"{self.classes[class_id]}: {confidence * 100:.1f}%"
+            y = startY - 15 if startY - 15 > 15 else startY + 15
+            cv2.putText(frame, label, (startX, y),
+                       cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 2)
+        return frame
+    
+    def render_frame(self, frame, snapshot):
+        """
+        Vẽ frame để hiển thị (chạy trên thread hiển thị)
+        
+        Args:
+            frame: Frame đã inference (None snapshot: frame placeholder khi không có ảnh)
+            snapshot: (results, object_counts, fps, confidence_threshold) hoặc None
+        """
+        if snapshot is None:
+            cv2.putText(frame, "No frame from ESP32-CAM", (10, 180),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 0, 255), 2)
+            cv2.putText(frame, f"URL: {self.stream_url}", (10, 210),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.5, (200, 200, 200), 1)
+            return frame
+        
+        results, object_counts, fps, confidence_threshold = snapshot
+        self.draw_boxes(frame, results)
+        
+        # Hiển thị thông tin
+        cv2.putText(frame, f"Objects: {sum(object_counts.values())}", (10, 30), 
+                   cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 255), 2)
+        
+        if fps > 0:
+            cv2.putText(frame, f"FPS: {fps:.1f}", (10, 60), 
+                       cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2)
+        
+        cv2.putText(frame, f"Confidence: {confidence_threshold:.1f}", (10, 90), 
+                   cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 0), 1)
         
-        return frame, detections_info, dict(object_counts)
+        cv2.putText(frame, f"ESP32: {self.esp32_ip}", 
+                   (10, frame.shape[0] - 10), 
+                   cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1)
+        
+        # Hiển thị chi tiết objects
+        y_offset = 120
+        for obj_name, count in object_counts.items():
+            cv2.putText(frame, f"{obj_name.title()}: {count}", 
+                       (10, y_offset), 
+                       cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 1)
+            y_offset += 20
+        return frame
     
     def run_detection(self):
         """Chạy detection loop chính"""
@@ -144,106 +314,104 @@ class ESP32CamSmartObjectDetector:
         print("   - 'c': Thay đổi confidence threshold")
         print("   - 'i': Thông tin cascade")
         
-        fps_counter = 0
-        fps_start_time = time.time()
         last_print_time = time.time()
-        # Ensure a named window exists so the GUI shows even when no frame is received
-        window_name = 'ESP32-CAM Smart Object Detection'
-        cv2.namedWindow(window_name, cv2.WINDOW_NORMAL)
+        # Vẽ và hiển thị trên thread riêng (hoặc không vẽ gì khi headless)
+        self.display = create_display('ESP32-CAM Smart Object Detection', self.render_frame,
+                                      headless=self.headless, latency=self.latency)
+        
+        if self.inference_server is not None:
+            # Frame được gộp batch với các camera khác trên server dùng chung
+            self.inference = self.inference_server.connect(self.latency)
+        elif self.tracking is None and self.roi is None and self.tiling is None:
+            # Mỗi request đang xử lý dùng một bản sao net trên worker thread riêng
+            nets = [self.net] + [self._load_net() for _ in range(self.inference_depth - 1)]
+            self.inference = InferencePipeline(nets, depth=self.inference_depth, latency=self.latency)
 
-        while True:
-            current_time = time.time()
-            
-            # Lấy frame
-            frame = self.get_frame_from_esp32()
-            # Nếu không nhận được frame, hiển thị placeholder để cửa sổ vẫn xuất hiện
-            if frame is None:
-                placeholder = np.zeros((360, 640, 3), dtype=np.uint8)
-                cv2.putText(placeholder, "No frame from ESP32-CAM", (10, 180),
-                            cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 0, 255), 2)
-                cv2.putText(placeholder, f"URL: {self.stream_url}", (10, 210),
-                            cv2.FONT_HERSHEY_SIMPLEX, 0.5, (200, 200, 200), 1)
-                cv2.imshow(window_name, placeholder)
-                # Allow user to press 'q' to quit even when no frames
-                key = cv2.waitKey(100) & 0xFF
+        try:
+            while True:
+                current_time = time.time()
+                
+                # Lấy frame
+                frame = self.get_frame_from_esp32()
+                # Nếu không nhận được frame, hiển thị placeholder để cửa sổ vẫn xuất hiện
+                if frame is None:
+                    self.display.show(np.zeros((360, 640, 3), dtype=np.uint8))
+                    # Allow user to press 'q' to quit even when no frames
+                    if self.display.poll_key() == ord('q'):
+                        break
+                    # small sleep to avoid busy loop
+                    time.sleep(0.1)
+                    continue
+                
+                if (self.motion_gate is not None and not self.motion_gate.check(frame)
+                        and self._last_results is not None):
+                    # Cảnh gần như không đổi: dùng lại detections của lần inference trước
+                    results = self._last_results
+                elif self.tracking is not None:
+                    results, _ = self.tracking.process(frame)
+                elif self.roi is not None:
+                    results, _ = self.roi.process(frame)
+                elif self.tiling is not None:
+                    results = self.tiling.process(frame)
+                else:
+                    # Nhận diện objects (kết quả trả về theo thứ tự frame, trễ tối đa depth-1 frame)
+                    result = self.inference.process(frame)
+                    if result is None:
+                        continue
+                    frame = result.frame
+                    results = self._postprocess(frame, result.output)
+                self._last_results = results
+                detections, object_counts = self.summarize_results(results)
+                
+                # FPS theo 30 frame gần nhất
+                fps = self.frame_rate.tick()
+                self.latency.maybe_export()
+                
+                # Vẽ trên thread hiển thị từ snapshot của frame này
+                self.display.show(frame, (results, object_counts, fps, self.confidence_threshold))
+                
+                # Cập nhật thống kê
+                self.total_frames += 1
+                for obj_name, count in object_counts.items():
+                    self.detection_stats[obj_name] += count
+                
+                # In thông tin định kỳ
+                if current_time - last_print_time > 5:
+                    if object_counts:
+                        print(f"📊 Detections: {sum(object_counts.values())} objects - {object_counts}")
+                    last_print_time = current_time
+                
+                # Xử lý phím
+                key = self.display.poll_key()
                 if key == ord('q'):
                     break
-                # small sleep to avoid busy loop
-                time.sleep(0.1)
-                continue
-            
-            # Nhận diện objects
-            frame_with_detections, detections, object_counts = self.detect_objects(frame)
-            
-            # Tính FPS
-            fps_counter += 1
-            if fps_counter % 30 == 0:
-                fps = fps_counter / (current_time - fps_start_time)
-                fps_counter = 0
-                fps_start_time = current_time
-            else:
-                fps = 0
-            
-            # Hiển thị thông tin
-            total_objects = sum(object_counts.values())
-            cv2.putText(frame_with_detections, f"Objects: {total_objects}", (10, 30), 
-                       cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 255), 2)
-            
-            if fps > 0:
-                cv2.putText(frame_with_detections, f"FPS: {fps:.1f}", (10, 60), 
-                           cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2)
-            
-            cv2.putText(frame_with_detections, f"Confidence: {self.confidence_threshold:.1f}", (10, 90), 
-                       cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 0), 1)
-            
-            cv2.putText(frame_with_detections, f"ESP32: {self.esp32_ip}", 
-                       (10, frame_with_detections.shape[0] - 10), 
-                       cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1)
-            
-            # Hiển thị chi tiết objects
-            y_offset = 120
-            for obj_name, count in object_counts.items():
-                cv2.putText(frame_with_detections, f"{obj_name.title()}: {count}", 
-                           (10, y_offset), 
-                           cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 1)
-                y_offset += 20
-            
-            # Hiển thị frame
-            cv2.imshow('ESP32-CAM Smart Object Detection', frame_with_detections)
-            
-            # Cập nhật thống kê
-            self.total_frames += 1
-            for obj_name, count in object_counts.items():
-                self.detection_stats[obj_name] += count
-            
-            # In thông tin định kỳ
-            if current_time - last_print_time > 5:
-                if object_counts:
-                    print(f"📊 Detections: {total_objects} objects - {object_counts}")
-                last_print_time = current_time
-            
-            # Xử lý phím
-            key = cv2.waitKey(1) & 0xFF
-            if key == ord('q'):
-                break
-            elif key == ord('s'):
-                filename = f"esp32_smart_objects_{int(time.time())}.jpg"
-                cv2.imwrite(filename, frame_with_detections)
-                print(f"📸 Đã chụp ảnh: {filename}")
-            elif key == ord('r'):
-                self.detection_stats = defaultdict(int)
-                self.total_frames = 0
-                for obj_name in self.detection_history:
-                    self.detection_history[obj_name].clear()
-                print("🔄 Đã reset thống kê")
-            elif key == ord('c'):
-                # Thay đổi confidence threshold
-                self.confidence_threshold = min(0.9, self.confidence_threshold + 0.1) if self.confidence_threshold < 0.9 else 0.3
-                print(f"🔄 Confidence threshold: {self.confidence_threshold:.1f}")
-            elif key == ord('i'):
-                self._print_model_info()
-        
-        cv2.destroyAllWindows()
+                elif key == ord('s') and self.display.last_image is not None:
+                    filename = f"esp32_smart_objects_{int(time.time())}.jpg"
+                    cv2.imwrite(filename, self.display.last_image)
+                    print(f"📸 Đã chụp ảnh: {filename}")
+                elif key == ord('r'):
+                    self.detection_stats = defaultdict(int)
+                    self.total_frames = 0
+                    for obj_name in self.detection_history:
+                        self.detection_history[obj_name].clear()
+                    self.latency.reset()
+                    print("🔄 Đã reset thống kê")
+                elif key == ord('c'):
+                    # Thay đổi confidence threshold
+                    self.confidence_threshold = min(0.9, self.confidence_threshold + 0.1) if self.confidence_threshold < 0.9 else 0.3
+                    print(f"🔄 Confidence threshold: {self.confidence_threshold:.1f}")
+                elif key == ord('i'):
+                    self._print_model_info()
+        except KeyboardInterrupt:
+            # Cách thoát duy nhất khi headless
+            pass
+        
+        self.frame_source.close()
+        if self.inference is not None:
+            self.inference.close()
+        self.display.close()
+        if self.latency.export_path:
+            self.latency.export_jsonl()
         self._print_final_stats()
     
     def _print_model_info(self):
@@ -258,6 +426,51 @@ class ESP32CamSmartObjectDetector:
         print("\n📊 Thống kê cuối:")
         print(f"   - Tổng frames: {self.total_frames}")
         print(f"   - Tổng objects: {sum(self.detection_stats.values())}")
+        capture_stats = self.frame_source.stats()
+        if capture_stats:
+            print(f"   - Capture: {capture_stats['captured']} frames, "
+                  f"dropped {capture_stats['dropped']}, errors {capture_stats['errors']}, "
+                  f"trùng (bỏ qua) {capture_stats['duplicates']}")
+        if self.inference is not None:
+            inference_stats = self.inference.stats()
+            print(f"   - Inference: depth {inference_stats['depth']}, "
+                  f"latency avg {inference_stats['latency_avg_ms']:.1f} ms, "
+                  f"max {inference_stats['latency_max_ms']:.1f} ms")
+        if self.tracking is not None:
+            tracking_stats = self.tracking.stats()
+            print(f"   - Tracking: network {tracking_stats['detections']}/{tracking_stats['frames']} frames "
+                  f"({tracking_stats['detect_ratio'] * 100:.0f}%), N hiện tại {tracking_stats['interval']}, "
+                  f"detect {tracking_stats['detect_avg_ms']:.1f} ms, track {tracking_stats['track_avg_ms']:.1f} ms, "
+                  f"mất dấu {tracking_stats['lost']} lần")
+        if self.roi is not None:
+            roi_stats = self.roi.stats()
+            print(f"   - ROI: full frame {roi_stats['full']}/{roi_stats['frames']} lần "
+                  f"({roi_stats['full_avg_ms']:.1f} ms), crop {roi_stats['roi_frames']} lần "
+                  f"({roi_stats['rois_avg']:.1f} crop, {roi_stats['roi_avg_ms']:.1f} ms), "
+                  f"pixel qua network {roi_stats['pixel_ratio'] * 100:.0f}%")
+        if self.tiling is not None:
+            tiling_stats = self.tiling.stats()
+            print(f"   - Tiling: {tiling_stats['tiles_per_frame']:.1f} ảnh/forward, "
+                  f"{tiling_stats['avg_ms']:.1f} ms/frame")
+        if self.display is not None and not self.display.headless:
+            display_stats = self.display.stats()
+            print(f"   - Hiển thị: {display_stats['rendered']} frames vẽ (tối đa "
+                  f"{display_stats['refresh_rate']:.0f} Hz), bỏ {display_stats['skipped']}, "
+                  f"vẽ {display_stats['render_avg_ms']:.1f} ms (ngoài vòng inference)")
+        self.latency.print_stats()
+        if self.motion_gate is not None:
+            if self.tracking is not None:
+                # Chi phí trung bình một frame không bị gate bỏ qua (detect hoặc track)
+                inference_ms = (tracking_stats['detect_avg_ms'] * tracking_stats['detect_ratio']
+                                + tracking_stats['track_avg_ms'] * (1 - tracking_stats['detect_ratio']))
+            elif self.roi is not None:
+                inference_ms = ((roi_stats['full_avg_ms'] * roi_stats['full']
+                                 + roi_stats['roi_avg_ms'] * roi_stats['roi_frames']) / max(roi_stats['frames'], 1))
+            elif self.tiling is not None:
+                inference_ms = tiling_stats['avg_ms']
+            else:
+                inference_ms = inference_stats['latency_avg_ms'] if self.inference is not None else 0.0
+            self.motion_gate.print_stats(inference_ms)
         
         if self.detection_stats:
             print("   - Chi tiết:")
@@ -265,5 +478,24 @@ class ESP32CamSmartObjectDetector:
                 print(f"     {obj_name.title()}: {count}")
 
 if __name__ == "__main__":
-    detector = ESP32CamSmartObjectDetector("192.168.1.14")
+    parser = argparse.ArgumentParser(description="Nhận diện đồ vật thông minh từ ESP32-CAM")
+    parser.add_argument('--ip', default="192.168.1.14")
+    parser.add_argument('--int8', action='store_true', help='Dùng model INT8 (esp32_quantize.py)')
+    parser.add_argument('--track', type=int, default=None, metavar='N',
+                        help='Chạy network tối đa mỗi N frame, giữa các lần dùng tracker')
+    parser.add_argument('--motion-gate', type=float, default=None, metavar='RATIO',
+                        help='Bỏ qua inference khi tỉ lệ pixel thay đổi nhỏ hơn RATIO (vd 0.02)')
+    parser.add_argument('--roi', type=int, default=None, metavar='N',
+                        help='Chạy full frame mỗi N lần, giữa các lần chỉ chạy crop vùng quan tâm')
+    parser.add_argument('--tile', type=int, default=None, metavar='SIZE',
+                        help='Chia frame thành các tile SIZE x SIZE chồng nhau (frame VGA trở lên)')
+    parser.add_argument('--tile-overlap', type=float, default=0.25)
+    parser.add_argument('--headless', action='store_true', help='Không vẽ, không mở cửa sổ (Ctrl+C để thoát)')
+    parser.add_argument('--latency-log', default=None, metavar='PATH',
+                        help='Ghi p50/p95/p99 từng công đoạn ra file JSON lines mỗi 10 giây')
+    args = parser.parse_args()
+    detector = ESP32CamSmartObjectDetector(args.ip, use_int8=args.int8, track_interval=args.track,
+                                           motion_threshold=args.motion_gate, roi_interval=args.roi,
+                                           tile_size=args.tile, tile_overlap=args.tile_overlap,
+                                           headless=args.headless, latency_log=args.latency_log)
     detector.run_detection()
@@ -0,0 +1,140 @@
+"""
+Inference theo tile cho frame độ phân giải cao (VGA trở lên)
+
+MobileNet SSD nén cả frame về 300x300 nên với VGA/SVGA phần lớn pixel bị bỏ
+và vật nhỏ biến mất. TiledDetector chia frame thành các tile vuông chồng lên
+nhau, đưa tất cả tile (và tùy chọn thêm cả frame thu nhỏ cho vật lớn trùm
+nhiều tile) vào một lần forward theo batch, rồi ghép về tọa độ frame: NMS theo
+class loại box trùng ở vùng chồng, sau đó bỏ các mảnh box bị cắt ở mép tile
+nằm gần trọn trong box lớn hơn cùng class.
+"""
+import math
+import time
+
+import numpy as np
+
+from esp32_roi import merge_detections, offset_detections
+
+
+def tile_regions(width, height, tile_size=300, overlap=0.25):
+    """
+    Vị trí các tile vuông phủ kín frame
+
+    Số tile mỗi chiều là ít nhất để bước giữa hai tile không vượt quá
+    tile_size * (1 - overlap); các tile được dàn đều, tile cuối chạm mép frame.
+
+    Args:
+        width: Chiều rộng frame
+        height: Chiều cao frame
+        tile_size: Cạnh tile (pixel)
+        overlap: Tỉ lệ chồng tối thiểu giữa hai tile liền nhau (0..1)
+
+    Returns:
+        list: [(x1, y1, x2, y2), ...]
+    """
+    stride = max(1, int(tile_size * (1 - overlap)))
+
+    def starts(length):
+        size = min(tile_size, length)
+        count = 1 if length <= size else math.ceil((length - size) / stride) + 1
+        if count == 1:
+            return [0], size
+        return [round(i * (length - size) / (count - 1)) for i in range(count)], size
+
+    xs, tile_w = starts(width)
+    ys, tile_h = starts(height)
+    return [(x, y, x + tile_w, y + tile_h) for y in ys for x in xs]
+
+
+def suppress_fragments(detections, containment=0.8):
+    """
+    Bỏ các box nằm gần trọn (>= containment diện tích) trong một box khác cùng class có confidence cao hơn
+
+    Vật nằm trên đường nối hai tile thường cho một box đầy đủ và một mảnh bị
+    cắt; IoU của hai box này thấp nên NMS không loại được mảnh.
+
+    Args:
+        detections: Mảng DETECTION_DTYPE theo confidence giảm dần (như merge_detections trả về)
+
+    Returns:
+        numpy.ndarray: Mảng DETECTION_DTYPE
+    """
+    if len(detections) < 2:
+        return detections
+    boxes = np.stack([detections[name] for name in ('x1', 'y1', 'x2', 'y2')], axis=1).astype(np.float64)
+    inter_w = np.minimum(boxes[:, None, 2], boxes[None, :, 2]) - np.maximum(boxes[:, None, 0], boxes[None, :, 0])
+    inter_h = np.minimum(boxes[:, None, 3], boxes[None, :, 3]) - np.maximum(boxes[:, None, 1], boxes[None, :, 1])
+    intersection = np.clip(inter_w, 0, None) * np.clip(inter_h, 0, None)
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    # contained[i, j]: box i nằm trong box j
+    contained = intersection >= containment * np.maximum(areas[:, None], 1e-9)
+    contained &= detections['class_id'][:, None] == detections['class_id'][None, :]
+    # Chỉ box đứng trước (confidence cao hơn) mới loại được box sau
+    contained &= np.tri(len(detections), k=-1, dtype=bool)
+    return detections[~contained.any(axis=1)]
+
+
+class TiledDetector:
+    """Chạy detect(frames) trên các tile chồng nhau của frame và ghép kết quả"""
+
+    def __init__(self, detect, tile_size=300, overlap=0.25, include_full=True,
+                 iou_threshold=0.45, containment=0.8):
+        """
+        Args:
+            detect: Hàm list ảnh -> list mảng DETECTION_DTYPE (tọa độ của từng ảnh),
+                nên chạy cả list trong một lần forward
+            tile_size: Cạnh tile (pixel của frame), nên bằng input của net (300)
+            overlap: Tỉ lệ chồng giữa hai tile liền nhau
+            include_full (bool): Thêm cả frame vào batch để bắt vật lớn trùm nhiều tile
+            iou_threshold: IoU để loại trùng giữa các tile
+            containment: Tỉ lệ diện tích để coi một box là mảnh của box khác (suppress_fragments)
+        """
+        self.detect = detect
+        self.tile_size = tile_size
+        self.overlap = overlap
+        self.include_full = include_full
+        self.iou_threshold = iou_threshold
+        self.containment = containment
+        self._regions = {}
+        self._stats = {'frames': 0, 'tiles': 0, 'total_s': 0.0}
+
+    def regions(self, frame_shape):
+        """Các tile của frame (cache theo kích thước frame)"""
+        height, width = frame_shape[:2]
+        if (width, height) not in self._regions:
+            self._regions[(width, height)] = tile_regions(width, height, self.tile_size, self.overlap)
+        return self._regions[(width, height)]
+
+    def process(self, frame):
+        """
+        Returns:
+            numpy.ndarray: Mảng DETECTION_DTYPE theo tọa độ frame
+        """
+        start = time.perf_counter()
+        regions = self.regions(frame.shape)
+        crops = [frame[y1:y2, x1:x2] for x1, y1, x2, y2 in regions]
+        offsets = [(x1, y1) for x1, y1, _, _ in regions]
+        if self.include_full and len(regions) > 1:
+            crops.append(frame)
+            offsets.append((0, 0))
+
+        parts = [offset_detections(detections, dx, dy)
+                 for detections, (dx, dy) in zip(self.detect(crops), offsets)]
+        detections = suppress_fragments(merge_detections(parts, self.iou_threshold), self.containment)
+
+        self._stats['frames'] += 1
+        self._stats['tiles'] += len(crops)
+        self._stats['total_s'] += time.perf_counter() - start
+        return detections
+
+    def stats(self):
+        """
+        Returns:
+            dict: {'frames', 'tiles_per_frame', 'avg_ms'}
+        """
+        s = self._stats
+        return {
+            'frames': s['frames'],
+            'tiles_per_frame': s['tiles'] / s['frames'] if s['frames'] else 0.0,
+            'avg_ms': s['total_s'] / s['frames'] * 1000 if s['frames'] else 0.0,
+        }
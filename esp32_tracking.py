@@ -0,0 +1,213 @@
+"""
+Detect-then-track: chạy network mỗi N frame, giữa các lần đó dời box bằng optical flow
+
+Bản OpenCV của repo (không có contrib) không có KCF/MOSSE nên box được dời bằng
+Lucas-Kanade thưa trên ảnh gray thu nhỏ: mỗi box lấy vài điểm đặc trưng,
+điểm được kiểm tra forward-backward, box dời theo trung vị độ dịch và co giãn
+theo trung vị khoảng cách tới tâm. Một lưới điểm trên cả frame đo chuyển động
+chung (người dùng đang đi hay đứng yên) để tự chỉnh N.
+"""
+import time
+
+import cv2
+import numpy as np
+
+from esp32_postprocess import DETECTION_DTYPE
+
+
+def _box_columns(detections):
+    return np.stack([detections[name] for name in ('x1', 'y1', 'x2', 'y2')], axis=1).astype(np.float32)
+
+
+class FlowBoxTracker:
+    """Dời các box (DETECTION_DTYPE) sang frame kế tiếp bằng optical flow thưa"""
+
+    def __init__(self, width=320, max_points=16, fb_threshold=1.0, min_points=3):
+        """
+        Args:
+            width: Chiều rộng ảnh gray dùng để tính flow
+            max_points: Số điểm đặc trưng tối đa mỗi box
+            fb_threshold: Sai số forward-backward tối đa (pixel ảnh nhỏ) để giữ một điểm
+            min_points: Số điểm tốt tối thiểu để box còn được theo dõi
+        """
+        self.width = width
+        self.max_points = max_points
+        self.fb_threshold = fb_threshold
+        self.min_points = min_points
+        self._lk_params = dict(winSize=(15, 15), maxLevel=2,
+                               criteria=(cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 10, 0.03))
+        self._gray = None
+        self._scale = 1.0
+        self.detections = np.empty(0, dtype=DETECTION_DTYPE)
+
+    def _prepare(self, frame):
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+        self._scale = self.width / gray.shape[1]
+        height = int(round(gray.shape[0] * self._scale))
+        return cv2.resize(gray, (self.width, height), interpolation=cv2.INTER_AREA)
+
+    def init(self, frame, detections):
+        """Bắt đầu theo dõi các detection của frame vừa chạy network"""
+        self._gray = self._prepare(frame)
+        self.detections = detections.copy()
+
+    def _points(self, gray, boxes):
+        """Điểm đặc trưng trong từng box và một lưới điểm nền; trả (points, owner) với owner -1 là nền"""
+        points, owners = [], []
+        height, width = gray.shape
+        for index, (x1, y1, x2, y2) in enumerate(boxes):
+            x1, y1 = max(int(x1), 0), max(int(y1), 0)
+            x2, y2 = min(int(np.ceil(x2)), width), min(int(np.ceil(y2)), height)
+            if x2 - x1 < 4 or y2 - y1 < 4:
+                continue
+            corners = cv2.goodFeaturesToTrack(gray[y1:y2, x1:x2], self.max_points, 0.01, 3)
+            if corners is None:
+                continue
+            corners = corners.reshape(-1, 2) + (x1, y1)
+            points.append(corners)
+            owners.append(np.full(len(corners), index))
+        grid = np.mgrid[height // 8:height:height // 4, width // 8:width:width // 4].reshape(2, -1).T[:, ::-1]
+        points.append(grid.astype(np.float32))
+        owners.append(np.full(len(grid), -1))
+        return np.concatenate(points).astype(np.float32), np.concatenate(owners)
+
+    def update(self, frame):
+        """
+        Dời các box sang frame mới
+
+        Returns:
+            tuple: (detections, confidence, motion) với confidence 0..1 là tỉ lệ
+                điểm theo được (trung bình các box, 1.0 nếu không có box) và
+                motion là độ dịch trung vị của lưới nền (% chiều rộng frame)
+        """
+        gray = self._prepare(frame)
+        if self._gray is None or self._gray.shape != gray.shape:
+            self._gray = gray
+            return self.detections, 0.0, 0.0
+
+        boxes = _box_columns(self.detections) * self._scale
+        points, owners = self._points(self._gray, boxes)
+        moved, status, _ = cv2.calcOpticalFlowPyrLK(self._gray, gray, points, None, **self._lk_params)
+        back, back_status, _ = cv2.calcOpticalFlowPyrLK(gray, self._gray, moved, None, **self._lk_params)
+        good = (status.ravel() == 1) & (back_status.ravel() == 1)
+        good &= np.linalg.norm(points - back, axis=1) < self.fb_threshold
+        self._gray = gray
+
+        background = good & (owners == -1)
+        shift = np.linalg.norm(moved[background] - points[background], axis=1)
+        motion = float(np.median(shift)) / self.width * 100 if len(shift) else 100.0
+
+        keep = np.zeros(len(boxes), dtype=bool)
+        confidences = []
+        for index, box in enumerate(boxes):
+            own = owners == index
+            ok = own & good
+            total = int(own.sum())
+            confidences.append(ok.sum() / total if total else 0.0)
+            if ok.sum() < self.min_points:
+                continue
+            old, new = points[ok], moved[ok]
+            dx, dy = np.median(new - old, axis=0)
+            old_spread = np.median(np.linalg.norm(old - old.mean(axis=0), axis=1))
+            new_spread = np.median(np.linalg.norm(new - new.mean(axis=0), axis=1))
+            scale = new_spread / old_spread if old_spread > 1e-3 else 1.0
+            cx, cy = (box[0] + box[2]) / 2 + dx, (box[1] + box[3]) / 2 + dy
+            half_w, half_h = (box[2] - box[0]) * scale / 2, (box[3] - box[1]) * scale / 2
+            boxes[index] = (cx - half_w, cy - half_h, cx + half_w, cy + half_h)
+            keep[index] = True
+
+        tracked = self.detections[keep].copy()
+        boxes = np.round(boxes[keep] / self._scale)
+        for column, name in enumerate(('x1', 'y1', 'x2', 'y2')):
+            tracked[name] = boxes[:, column]
+        self.detections = tracked
+        confidence = float(np.mean(confidences)) if confidences else 1.0
+        return tracked, confidence, motion
+
+
+class DetectTrackScheduler:
+    """
+    Chạy detect(frame) mỗi N frame (hoặc khi tracker mất dấu), frame còn lại dùng tracker
+
+    N tự chỉnh theo chuyển động: giảm một nửa khi cảnh chuyển động nhanh,
+    tăng dần khi cảnh gần như đứng yên, trong khoảng [min_interval, max_interval].
+    """
+
+    def __init__(self, detect, min_interval=1, max_interval=10, min_confidence=0.5,
+                 motion_low=0.3, motion_high=2.0, tracker=None):
+        """
+        Args:
+            detect: Hàm frame -> mảng DETECTION_DTYPE (chạy network)
+            min_interval: N nhỏ nhất (1 = detect mọi frame khi chuyển động mạnh)
+            max_interval: N lớn nhất
+            min_confidence: Detect lại khi confidence của tracker thấp hơn ngưỡng này
+            motion_low: Chuyển động (% chiều rộng/frame) dưới mức này thì tăng N
+            motion_high: Chuyển động trên mức này thì giảm N
+            tracker: FlowBoxTracker (mặc định tạo mới)
+        """
+        self.detect = detect
+        self.min_interval = max(1, min_interval)
+        self.max_interval = max(self.min_interval, max_interval)
+        self.min_confidence = min_confidence
+        self.motion_low = motion_low
+        self.motion_high = motion_high
+        self.tracker = tracker or FlowBoxTracker()
+        self.interval = self.max_interval
+        self._since_detect = None
+        self._stats = {'frames': 0, 'detections': 0, 'tracks': 0, 'lost': 0, 'detect_s': 0.0, 'track_s': 0.0}
+
+    def process(self, frame):
+        """
+        Returns:
+            tuple: (mảng DETECTION_DTYPE, detected) với detected=True nếu network đã chạy
+        """
+        self._stats['frames'] += 1
+        if self._since_detect is not None:
+            # Tracker chạy cả ở frame sẽ detect để đo chuyển động và chỉnh N
+            start = time.perf_counter()
+            detections, confidence, motion = self.tracker.update(frame)
+            self._stats['track_s'] += time.perf_counter() - start
+            self._stats['tracks'] += 1
+            self._adapt(motion)
+            if self._since_detect < self.interval:
+                if confidence >= self.min_confidence:
+                    self._since_detect += 1
+                    return detections, False
+                self._stats['lost'] += 1
+
+        start = time.perf_counter()
+        detections = self.detect(frame)
+        self.tracker.init(frame, detections)
+        self._stats['detect_s'] += time.perf_counter() - start
+        self._stats['detections'] += 1
+        self._since_detect = 1
+        return detections, True
+
+    def _adapt(self, motion):
+        if motion > self.motion_high:
+            self.interval = max(self.min_interval, self.interval // 2)
+        elif motion < self.motion_low:
+            self.interval = min(self.max_interval, self.interval + 1)
+
+    def reset(self):
+        """Bắt buộc detect ở frame kế tiếp"""
+        self._since_detect = None
+
+    def stats(self):
+        """
+        Returns:
+            dict: {'frames', 'detections', 'tracked', 'lost', 'detect_ratio', 'interval',
+                'detect_avg_ms', 'track_avg_ms'}
+        """
+        s = self._stats
+        tracked = s['frames'] - s['detections']
+        return {
+            'frames': s['frames'],
+            'detections': s['detections'],
+            'tracked': tracked,
+            'lost': s['lost'],
+            'detect_ratio': s['detections'] / s['frames'] if s['frames'] else 0.0,
+            'interval': self.interval,
+            'detect_avg_ms': s['detect_s'] / s['detections'] * 1000 if s['detections'] else 0.0,
+            'track_avg_ms': s['track_s'] / s['tracks'] * 1000 if s['tracks'] else 0.0,
+        }
@@ -357,6 +357,8 @@ void handleCapture() {
   }
   
   server.sendHeader("Access-Control-Allow-Origin", "*");
+  // Timestamp của frame buffer: Python bỏ qua ảnh trùng (cùng timestamp) mà không giải mã
+  server.sendHeader("X-Timestamp", String(fb->timestamp.tv_sec) + "." + String(fb->timestamp.tv_usec));
   server.sendHeader("Cache-Control", "no-cache, no-store, must-revalidate");
   server.sendHeader("Pragma", "no-cache");
   server.sendHeader("Expires", "0");
@@ -522,6 +522,8 @@ void handleCapture() {
   }
   
   server.sendHeader("Access-Control-Allow-Origin", "*");
+  // Timestamp của frame buffer: Python bỏ qua ảnh trùng (cùng timestamp) mà không giải mã
+  server.sendHeader("X-Timestamp", String(fb->timestamp.tv_sec) + "." + String(fb->timestamp.tv_usec));
   server.send_P(200, "image/jpeg", (const char*)fb->buf, fb->len);
   esp_camera_fb_return(fb);
 }
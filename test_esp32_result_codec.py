@@ -0,0 +1,219 @@
+"""
+Round-trip ResultEncoder -> ResultDecoder (esp32_result_codec)
+
+Chạy từ thư mục gốc của repo:
+    python -m pytest test_esp32_result_codec.py
+"""
+import random
+
+import pytest
+
+from esp32_result_codec import (MAX_OBJECTS, TYPE_DELTA, TYPE_FULL, ResultDecoder,
+                                ResultEncoder)
+
+CLASSES = ['person', 'bicycle', 'car', 'chair', 'bottle']
+FRAME_SIZE = (640, 480)
+
+
+def random_result(rng, n):
+    objects = []
+    for _ in range(n):
+        x, y = rng.randint(0, 500), rng.randint(0, 350)
+        objects.append({
+            'class': rng.choice(CLASSES),
+            'bbox': [x, y, rng.randint(10, 640 - x), rng.randint(10, 480 - y)],
+            'confidence': rng.random(),
+        })
+    return {'distance_mm': rng.randint(-1, 4000), 'pip': 'FRONT', 'pip_alert': True, 'objects': objects}
+
+
+def assert_same(expected, decoded, frame_size=FRAME_SIZE):
+    assert decoded['distance_mm'] == expected['distance_mm']
+    assert decoded['pip'] == expected['pip']
+    assert decoded['pip_alert'] == expected['pip_alert']
+    assert len(decoded['objects']) == len(expected['objects'])
+    # Lượng tử 8 bit: sai số tối đa nửa bước (cạnh / 510) cộng làm tròn về pixel
+    tolerance = max(frame_size) / 510 + 1
+    for exp, got in zip(expected['objects'], decoded['objects']):
+        assert got['class'] == exp['class']
+        assert all(abs(a - b) <= tolerance for a, b in zip(exp['bbox'], got['bbox']))
+        assert abs(got['confidence'] - exp['confidence']) <= 1 / 255
+
+
+def message_type(payload):
+    return payload[0]
+
+
+@pytest.mark.parametrize('delta', [False, True])
+def test_round_trip(delta):
+    rng = random.Random(0)
+    encoder = ResultEncoder(CLASSES, delta=delta)
+    decoder = ResultDecoder(CLASSES)
+    result = random_result(rng, 5)
+    for step in range(100):
+        if step % 3 == 0:
+            result = random_result(rng, rng.randint(0, 8))
+        elif result['objects']:
+            # Chỉ một object di chuyển
+            result['objects'][0]['bbox'][0] = rng.randint(0, 300)
+        payload = encoder.encode(result)
+        assert_same(result, decoder.decode(payload))
+        encoder.ack()
+
+
+def test_full_until_first_ack():
+    encoder = ResultEncoder(CLASSES, delta=True)
+    result = random_result(random.Random(1), 3)
+    assert message_type(encoder.encode(result)) == TYPE_FULL
+    assert message_type(encoder.encode(result)) == TYPE_FULL
+    encoder.ack()
+    assert message_type(encoder.encode(result)) == TYPE_DELTA
+
+
+def test_delta_sends_only_changed_objects():
+    encoder = ResultEncoder(CLASSES, delta=True)
+    decoder = ResultDecoder(CLASSES)
+    result = random_result(random.Random(2), 6)
+    full = encoder.encode(result)
+    decoder.decode(full)
+    encoder.ack()
+
+    result['objects'][2]['bbox'][1] += 100
+    delta = encoder.encode(result)
+    assert message_type(delta) == TYPE_DELTA
+    # Header như nhau, một object (slot + 6 bytes) thay vì sáu
+    assert len(full) - len(delta) == 6 * 6 - (1 + 1 + 6)
+    assert_same(result, decoder.decode(delta))
+
+
+def test_delta_against_last_acked_state_across_seq_gap():
+    encoder = ResultEncoder(CLASSES, delta=True)
+    decoder = ResultDecoder(CLASSES)
+    rng = random.Random(3)
+    first = random_result(rng, 4)
+    decoder.decode(encoder.encode(first))
+    encoder.ack()
+    acked_seq = encoder.seq
+
+    # Payload này không tới được ESP32 (không ack, decoder không thấy)
+    lost = random_result(rng, 2)
+    encoder.encode(lost)
+
+    latest = random_result(rng, 3)
+    payload = encoder.encode(latest)
+    assert message_type(payload) == TYPE_DELTA
+    decoded = decoder.decode(payload)
+    assert decoded['seq'] == encoder.seq == acked_seq + 2
+    assert_same(latest, decoded)
+
+
+def test_ack_of_unknown_seq_is_ignored():
+    encoder = ResultEncoder(CLASSES, delta=True)
+    encoder.encode(random_result(random.Random(4), 2))
+    encoder.ack(1234)
+    assert message_type(encoder.encode(random_result(random.Random(5), 2))) == TYPE_FULL
+
+
+def test_decoder_rejects_delta_without_base():
+    encoder = ResultEncoder(CLASSES, delta=True)
+    result = random_result(random.Random(6), 3)
+    encoder.encode(result)
+    encoder.ack()
+    delta = encoder.encode(result)
+    with pytest.raises(ValueError):
+        ResultDecoder(CLASSES).decode(delta)
+
+
+def test_keyframe_interval_forces_full():
+    encoder = ResultEncoder(CLASSES, delta=True, keyframe_interval=4)
+    result = random_result(random.Random(7), 2)
+    types = []
+    for _ in range(9):
+        types.append(message_type(encoder.encode(result)))
+        encoder.ack()
+    assert types == [TYPE_FULL, TYPE_DELTA, TYPE_DELTA, TYPE_DELTA,
+                     TYPE_FULL, TYPE_DELTA, TYPE_DELTA, TYPE_DELTA, TYPE_FULL]
+
+
+@pytest.mark.parametrize('delta', [False, True])
+def test_empty_detection_list(delta):
+    encoder = ResultEncoder(CLASSES, delta=delta)
+    decoder = ResultDecoder(CLASSES)
+    decoder.decode(encoder.encode(random_result(random.Random(8), 4)))
+    encoder.ack()
+    empty = {'distance_mm': -1, 'pip': 'NONE', 'pip_alert': False, 'objects': []}
+    decoded = decoder.decode(encoder.encode(empty))
+    assert decoded['objects'] == []
+    assert decoded['pip'] == 'NONE' and not decoded['pip_alert']
+
+
+def test_seq_wraps_around():
+    encoder = ResultEncoder(CLASSES, delta=True)
+    decoder = ResultDecoder(CLASSES)
+    encoder.seq = 0xFFFE
+    result = random_result(random.Random(9), 2)
+    for expected_seq in (0xFFFF, 0, 1):
+        decoded = decoder.decode(encoder.encode(result))
+        encoder.ack()
+        assert decoded['seq'] == expected_seq
+        assert_same(result, decoded)
+
+
+def test_quantization_bounds():
+    encoder = ResultEncoder(CLASSES, frame_size=FRAME_SIZE)
+    decoder = ResultDecoder(CLASSES)
+    result = {'distance_mm': 100000, 'pip': 'LEFT', 'pip_alert': True, 'objects': [
+        # Box tràn ra ngoài frame và confidence ngoài 0..1 bị kẹp
+        {'class': 'car', 'bbox': [-50, -10, 5000, 5000], 'confidence': 1.7},
+        {'class': 'person', 'bbox': [0, 0, 0, 0], 'confidence': -0.2},
+        {'class': 'chair', 'bbox': [640, 480, 640, 480], 'confidence': 1.0},
+    ]}
+    objects = decoder.decode(encoder.encode(result))['objects']
+    assert objects[0]['bbox'] == [0, 0, 640, 480] and objects[0]['confidence'] == 1.0
+    assert objects[1]['bbox'] == [0, 0, 0, 0] and objects[1]['confidence'] == 0.0
+    assert objects[2]['bbox'] == [640, 480, 640, 480] and objects[2]['confidence'] == 1.0
+
+
+def test_frame_size_per_payload():
+    encoder = ResultEncoder(CLASSES, frame_size=FRAME_SIZE)
+    decoder = ResultDecoder(CLASSES)
+    result = random_result(random.Random(12), 4)
+    small = {**result, 'objects': [dict(obj, bbox=[v // 4 for v in obj['bbox']]) for obj in result['objects']]}
+    # Frame 160x120 đi kèm payload, không phụ thuộc encoder.frame_size
+    assert_same(small, decoder.decode(encoder.encode(small, (160, 120))), frame_size=(160, 120))
+    assert encoder.frame_size == FRAME_SIZE
+    assert_same(result, decoder.decode(encoder.encode(result)))
+
+
+def test_distance_and_object_count_are_clamped():
+    encoder = ResultEncoder(CLASSES)
+    decoder = ResultDecoder(CLASSES)
+    result = random_result(random.Random(10), MAX_OBJECTS + 20)
+    result['distance_mm'] = 100000
+    decoded = decoder.decode(encoder.encode(result))
+    assert decoded['distance_mm'] == 32767
+    assert len(decoded['objects']) == MAX_OBJECTS
+
+
+def test_unknown_class():
+    encoder = ResultEncoder(CLASSES)
+    result = {'distance_mm': 0, 'pip': 'NONE', 'pip_alert': False,
+              'objects': [{'class': 'giraffe', 'bbox': [1, 2, 3, 4], 'confidence': 0.5}]}
+    assert ResultDecoder(CLASSES).decode(encoder.encode(result))['objects'][0]['class'] == 'unknown'
+
+
+def test_header_size():
+    # Firmware đọc header theo docstring của esp32_result_codec (13 bytes + pip)
+    empty = {'distance_mm': 0, 'pip': '', 'pip_alert': False, 'objects': []}
+    assert len(ResultEncoder(CLASSES).encode(empty)) == 13 + 1
+
+
+def test_malformed_payload():
+    payload = ResultEncoder(CLASSES).encode(random_result(random.Random(11), 3))
+    decoder = ResultDecoder(CLASSES)
+    with pytest.raises(ValueError):
+        decoder.decode(payload[:-3])
+    with pytest.raises(ValueError):
+        decoder.decode(payload + b'\x00')
+    with pytest.raises(ValueError):
+        decoder.decode(b'\x07' + payload[1:])